@@ -0,0 +1,126 @@
+"""
+Runs many independent scripts on a pool of processes, keeping the output
+and errors of every script apart, and writes a summary of how each of them
+went and how long it took.
+"""
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from handling.error_reporting import reportingTo
+
+SUMMARY = "summary.txt"
+
+
+def findScripts(pattern):
+    """ Returns the paths of the scripts in a directory and the directories
+    below it, or of those matching a glob pattern, in sorted order."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "**", "*.sy")
+    return sorted(path for path in glob.glob(pattern, recursive=True)
+                  if os.path.isfile(path))
+
+
+def _runScript(task):
+    """ Runs one script on a worker. run is called with the path of the
+    script and whether its source is the same as another script's, and
+    returns nothing. Returns what the script printed, the errors it
+    reported and its wall time."""
+    run, path, repeated = task
+    output = io.StringIO()
+    errors = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output), \
+            contextlib.redirect_stderr(errors), reportingTo(errors):
+        try:
+            run(path, repeated)
+        except Exception:
+            traceback.print_exc()
+        except SystemExit as exit:
+            if exit.code:
+                print("Exited with %s" % exit.code, file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    return output.getvalue(), errors.getvalue(), elapsed
+
+
+class Batch(object):
+    """ Runs scripts on jobs processes with run, which a worker calls for
+    every script with its path and whether another script has the same
+    source, so a worker can parse it only once.
+
+    What a script prints goes to <name>.out in the output directory and
+    the errors it reports to <name>.err, where name is the path of the
+    script without .sy below the directory all the scripts are in. Every
+    script is run in a process of the pool, but the process runs other
+    scripts before and after it.
+    """
+
+    def __init__(self, run, output, jobs=None):
+        self.run = run
+        self.output = output
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+
+    def execute(self, paths):
+        """ Runs the scripts at paths and writes the summary. Returns the
+        number of scripts that reported errors."""
+        sources = {}
+        for path in paths:
+            with open(path, "rb") as script:
+                source = script.read()
+            sources.setdefault(source, []).append(path)
+        repeated = set(path for group in sources.values() if len(group) > 1
+                       for path in group)
+        # Longer scripts first, so no long script starts last and keeps
+        # the pool waiting on it
+        sizes = dict((path, len(source)) for source, group in sources.items()
+                     for path in group)
+        order = sorted(paths, key=lambda path: -sizes[path])
+        tasks = [(self.run, path, path in repeated) for path in order]
+
+        root = os.path.commonpath([os.path.abspath(os.path.dirname(path))
+                                   for path in paths]) if paths else ""
+        results = {}
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            for path, (output, errors, elapsed) in zip(
+                    order, pool.map(_runScript, tasks)):
+                name = os.path.splitext(os.path.relpath(
+                    os.path.abspath(path), root))[0]
+                self._write(name + ".out", output)
+                if errors:
+                    self._write(name + ".err", errors)
+                results[path] = (bool(errors), elapsed)
+        wall = time.perf_counter() - start
+        return self._summarize(paths, results, wall)
+
+    def _write(self, name, text):
+        path = os.path.join(self.output, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as result:
+            result.write(text)
+
+    def _summarize(self, paths, results, wall):
+        """ Writes the summary, prints its totals and returns the number of
+        scripts with errors."""
+        lines = []
+        failed = 0
+        total = 0.0
+        for path in paths:
+            error, elapsed = results[path]
+            failed += error
+            total += elapsed
+            lines.append("%-6s %10.3fms  %s" % ("error" if error else "ok",
+                                                elapsed * 1000, path))
+        totals = ("%d scripts, %d with errors, %.3fs on %d jobs, %.3fs "
+                  "running scripts" % (len(paths), failed, wall, self.jobs,
+                                       total))
+        lines.append(totals)
+        self._write(SUMMARY, "\n".join(lines) + "\n")
+        print(totals)
+        print("Summary written to %s" % os.path.join(self.output, SUMMARY))
+        return failed
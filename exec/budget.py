@@ -0,0 +1,105 @@
+"""
+Limits how long a script may run, by the number of steps it takes and by
+wall time, so scripts that never end are stopped, and how much memory its
+strings may take, so scripts that keep growing them are stopped too.
+"""
+import time
+
+from handling import exceptions
+from tree.scanner import Token
+
+# Steps taken between looks at the clock, reading it costs more than a
+# step does
+CHECK_EVERY = 1000
+
+
+def firstToken(node):
+    """ Returns the first token found in a statement or expression, which
+    tells the line it is on, or None when it has none."""
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if node is None:
+            continue
+        if node.__class__ is Token:
+            return node
+        if isinstance(node, list):
+            pending.extend(reversed(node))
+        elif hasattr(node, "_fields"):
+            pending.extend(getattr(node, field)
+                           for field in reversed(node._fields))
+    return None
+
+
+class Budget(object):
+    """ Steps and seconds a run may take, and characters its strings may
+    take, None for no limit. A step is a pass through the body of a loop or
+    the entry into a block, so every way a script can keep running takes
+    steps.
+
+    The interpreter counts steps down itself and calls check when it is
+    about to take the last of the steps start or check returned. Only then
+    are the steps added up and the clock read.
+
+    Strings only grow by concatenation, the interpreter calls charge with
+    the size of every string it is about to make. The sizes are added up
+    until they could go over the budget along with the strings variables
+    held when they were last measured. Only then are the strings of
+    variables measured again, and the new string has to fit with them.
+    """
+
+    def __init__(self, steps=None, seconds=None, memory=None):
+        self.steps = steps
+        self.seconds = seconds
+        self.memory = memory
+
+    def start(self):
+        """ Starts a run, returns the steps to take before calling
+        check."""
+        self.taken = 0
+        self.live = 0  # Characters of the strings of variables
+        self.made = 0  # Characters of strings made since they were measured
+        self.deadline = None
+        if self.seconds is not None:
+            self.deadline = time.perf_counter() + self.seconds
+        return self._chunk()
+
+    def _chunk(self):
+        if self.steps is None:
+            self.chunk = CHECK_EVERY
+        else:
+            # The step after the last one allowed always calls check
+            self.chunk = min(CHECK_EVERY, self.steps - self.taken + 1)
+        return self.chunk
+
+    def check(self, node):
+        """ Adds the steps returned last to the steps taken, node is what
+        the last of them is about to run. Raises BudgetExceeded when the
+        budget is used up, returns the steps to take before calling check
+        again otherwise."""
+        self.taken += self.chunk
+        if self.steps is not None and self.taken > self.steps:
+            raise exceptions.BudgetExceeded(
+                "Step budget of %d used up" % self.steps, "steps",
+                firstToken(node))
+        if self.deadline is not None and \
+                time.perf_counter() >= self.deadline:
+            raise exceptions.BudgetExceeded(
+                "Time budget of %gs used up" % self.seconds, "time",
+                firstToken(node))
+        return self._chunk()
+
+    def charge(self, size, token, measure):
+        """ Accounts for a string of size characters about to be made by the
+        operator token. measure returns the characters the strings of
+        variables take. Raises BudgetExceeded when the string does not
+        fit."""
+        self.made += size
+        if self.live + self.made <= self.memory:
+            return
+        self.live = measure()
+        self.made = size
+        if self.live + size > self.memory:
+            raise exceptions.BudgetExceeded(
+                "Memory budget of %d characters used up, by a string of %d "
+                "characters" % (self.memory, size), "memory", token)
@@ -0,0 +1,513 @@
+"""
+Compiles statements into bytecode, which is run by the virtual machine
+in exec/vm.py instead of walking the tree.
+"""
+from exec.resolver import declarations
+from exec.syinterpreter import FLOAT_OPERATORS, MAX_DEPTH
+from handling import exceptions
+from tree import scanner as tok
+from tree.expressions import Assign, Binary, Call, Grouping, Literal, \
+    Logical, Unary, Variable
+from tree.stmt import If, StmtVisitor
+from tree import stmt
+
+# Opcodes. An instruction is a tuple of an opcode and three arguments,
+# which are None when an opcode does not use them. Variables are found by
+# the index of their frame and their slot in it, constants by their index
+# in the constant pool. Jumps go to the instruction at index a, conditional
+# jumps are taken when the truth of their value is b. The opcodes run the
+# most come first, the virtual machine tests for them in this order.
+(LOAD_BINARY_CONST,  # Apply an operator to variable b of frame a and a
+                     # constant, c is the name, the function applying the
+                     # operator to two numbers, the constant and operator
+ STORE_POP,          # Pop a value into variable b of frame a, c is its name
+ LOAD_COMPARE_JUMP,  # Apply an operator to a variable and a constant and
+                     # jump on the result, c is the frame, slot, name,
+                     # function, constant and operator
+ BINARY_CONST,       # Apply operator c to the top of the stack and constant
+                     # b, a applies it to two numbers
+ LOAD,               # Push variable b of frame a, c is its name
+ BINARY_VAR,         # Apply an operator to the top of the stack and
+                     # variable b of frame a, c is the name, function and
+                     # operator
+ BINARY,             # Apply operator c to the two values on top of the
+                     # stack, a applies it to two numbers
+ JUMP,               # Jump to a
+ CONST,              # Push constant a
+ COMPARE_JUMP,       # Like BINARY and jump on the result, c is the function
+                     # and operator
+ JUMP_IF,            # Pop a value and jump on it
+ ENTER,              # Push a frame with a slots for a block
+ LEAVE,              # Pop the frame of a block
+ PRINT,              # Pop a value and print it
+ STORE,              # Store the top of the stack in variable b of frame a
+ DEFINE,             # Pop a value into variable b of frame a, c is its type
+                     # name and type token
+ POP,                # Pop a value
+ OR_JUMP,            # When the top of the stack is true replace it with
+                     # true and jump, otherwise pop it
+ AND_JUMP,           # When the top of the stack is false replace it with
+                     # false and jump, otherwise pop it
+ TO_BOOL,            # Replace the top of the stack with its truth
+ UNARY,              # Apply operator c to the top of the stack
+ LOAD_ANY,           # Push the first defined variable of the frame and slot
+                     # pairs in a, c is its name
+ STORE_ANY,          # STORE into the first defined variable of the pairs
+                     # in a
+ UNWIND,             # Drop all frames past the first b and jump
+ ) = range(24)
+
+OPCODE_NAMES = (
+    "LOAD_BINARY_CONST", "STORE_POP", "LOAD_COMPARE_JUMP", "BINARY_CONST",
+    "LOAD", "BINARY_VAR", "BINARY", "JUMP", "CONST", "COMPARE_JUMP",
+    "JUMP_IF", "ENTER", "LEAVE", "PRINT", "STORE", "DEFINE", "POP",
+    "OR_JUMP", "AND_JUMP", "TO_BOOL", "UNARY", "LOAD_ANY", "STORE_ANY",
+    "UNWIND")
+
+
+class Code(object):
+    """ Compiled statements, a list of instructions along with the pool of
+    constants they refer to."""
+
+    __slots__ = ('instructions', 'constants')
+
+    def __init__(self, instructions, constants):
+        self.instructions = instructions
+        self.constants = constants
+
+    def __str__(self):
+        lines = []
+        for index, (op, a, b, c) in enumerate(self.instructions):
+            args = [repr(arg) for arg in (a, b) if arg is not None]
+            if op == CONST:
+                args.append("(%r)" % self.constants[a])
+            for arg in c if c.__class__ is tuple else (c,):
+                if hasattr(arg, 'lexeme'):
+                    args.append("'%s'" % arg.lexeme)
+            lines.append("%5d %-20s %s" % (index, OPCODE_NAMES[op],
+                                           " ".join(args)))
+        return "\n".join(lines)
+
+
+class Scope(object):
+    """ Variables declared in a block, or at the top level, and the slots
+    they have in its frame. Blocks that declare nothing get no frame."""
+
+    __slots__ = ('names', 'frame', 'above')
+
+    def __init__(self, names, frame, above):
+        self.names = names
+        self.frame = frame  # Index of the frame at runtime
+        self.above = above
+
+
+class Loop(object):
+    """ Where break and continue statements in a loop jump to."""
+
+    __slots__ = ('frames', 'breaks', 'continues', 'continueAt')
+
+    def __init__(self, frames):
+        self.frames = frames  # Number of frames outside of the loop
+        self.breaks = []  # Jumps waiting for the end of the loop
+        self.continues = []  # Jumps waiting for continueAt
+        self.continueAt = None
+
+
+class _Label(object):
+    """ Jump in the middle of an expression. Emitted the first time it comes
+    off the stack of pending nodes and pointed at the code after it the
+    second time."""
+
+    __slots__ = ('op', 'index')
+
+    def __init__(self, op):
+        self.op = op
+        self.index = None
+
+
+def resolve(scope, name):
+    """ Returns the frame and slot pairs of every scope, from scope out,
+    that declares the variable name."""
+    found = []
+    while scope is not None:
+        slot = scope.names.get(name.lexeme)
+        if slot is not None:
+            found.append((scope.frame, slot))
+        scope = scope.above
+    return tuple(found)
+
+
+def jumps(statement):
+    """ Returns whether a statement has a break or continue statement that
+    is not inside of a loop in it, one that leaves the statement for the
+    loop around it."""
+    pending = [statement]
+    while pending:
+        statement = pending.pop()
+        if statement is None:
+            continue
+        kind = statement.kind
+        if kind == stmt.BREAK or kind == stmt.CONTINUE:
+            return True
+        if kind == stmt.BLOCK:
+            pending.extend(statement.statements)
+        elif kind == stmt.IF:
+            pending.append(statement.then_branch)
+            pending.extend(elseif.then_branch for elseif in statement.elseifs)
+            pending.append(statement.else_branch)
+        elif kind == stmt.FOR:
+            # The else branch is not part of the loop
+            pending.append(statement.else_branch)
+    return False
+
+
+def empty(statement):
+    """ Returns whether a statement does nothing, so no code is needed."""
+    if statement.kind == stmt.BLOCK:
+        return all(statement is not None and statement.kind == stmt.PASS
+                   for statement in statement.statements)
+    return statement.kind == stmt.PASS
+
+
+class Compiler(StmtVisitor):
+    """ Compiles statements into Code for the virtual machine.
+
+    Every block that declares variables gets a frame, a list with a slot
+    for each of them. Blocks are scanned for declarations before they are
+    compiled, so each variable is found through the frames of the scopes
+    that declare it rather than by name. Variables declared at the top level
+    are kept between calls to compile.
+
+    break and continue become jumps to where their loop ends and to where
+    it goes on with its next pass, which unwind the frames of the blocks
+    they leave. A for loop goes on at its increment, a do loop at its
+    condition and the other loops at the condition before their body, so
+    code outside of loops never checks for them.
+    """
+
+    def __init__(self):
+        StmtVisitor.__init__(self)
+        self.globals = Scope({}, 0, None)
+        self.scope = self.globals
+        self.loop = None
+
+    def compile(self, statements):
+        """ Compiles a list of top level statements into Code."""
+        self.scope = self.globals
+        self.loop = None
+        self.instructions = []
+        self.constants = []
+        self._constantIndex = {}
+        declarations(statements, self.globals.names)
+        for statement in statements:
+            self._stmtTable[statement.kind](statement)
+        return Code(self.instructions, self.constants)
+
+    def compileExpression(self, expr):
+        """ Compiles an expression in the current scope into Code that
+        leaves its value on the stack."""
+        self.instructions = []
+        self.constants = []
+        self._constantIndex = {}
+        self._expression(expr)
+        return Code(self.instructions, self.constants)
+
+    def _emit(self, op, a=None, b=None, c=None):
+        self.instructions.append((op, a, b, c))
+        return len(self.instructions) - 1
+
+    def _patch(self, index, target=None):
+        """ Points the jump at index to target, or the next instruction."""
+        if target is None:
+            target = len(self.instructions)
+        op, a, b, c = self.instructions[index]
+        self.instructions[index] = (op, target, b, c)
+
+    def _constant(self, value):
+        # Keyed by type too, as 1.0 == True, and floats by their text, as
+        # -0.0 == 0.0
+        if value.__class__ is float:
+            key = (float, repr(value))
+        else:
+            key = (value.__class__, value)
+        index = self._constantIndex.get(key)
+        if index is None:
+            index = len(self.constants)
+            self.constants.append(value)
+            self._constantIndex[key] = index
+        return index
+
+    def _frames(self):
+        """ Returns the number of frames in use."""
+        return self.scope.frame + 1
+
+    def _resolve(self, name):
+        return resolve(self.scope, name)
+
+    # Functions for compiling statements
+    def visitBreak(self, stmt):
+        loop = self.loop
+        if loop.frames == self._frames():
+            loop.breaks.append(self._emit(JUMP))
+        else:
+            loop.breaks.append(self._emit(UNWIND, None, loop.frames))
+
+    def visitContinue(self, stmt):
+        loop = self.loop
+        op = JUMP if loop.frames == self._frames() else UNWIND
+        index = self._emit(op, loop.continueAt, loop.frames)
+        if loop.continueAt is None:
+            loop.continues.append(index)
+
+    def visitPass(self, stmt):
+        pass
+
+    def _loopBody(self, body, loop):
+        outer = self.loop
+        self.loop = loop
+        self._stmtTable[body.kind](body)
+        self.loop = outer
+
+    def _finishLoop(self, loop):
+        """ Points the continues of a loop at where they go."""
+        for index in loop.continues:
+            self._patch(index, loop.continueAt)
+
+    def visitWhile(self, stmt):
+        loop = Loop(self._frames())
+        head = loop.continueAt = len(self.instructions)
+        exits = self._condition(stmt.condition, False)
+        self._loopBody(stmt.body, loop)
+        self._emit(JUMP, head)
+        for index in exits + loop.breaks:
+            self._patch(index)
+
+    def visitUntil(self, stmt):
+        loop = Loop(self._frames())
+        head = loop.continueAt = len(self.instructions)
+        exits = self._condition(stmt.condition, True)
+        self._loopBody(stmt.body, loop)
+        self._emit(JUMP, head)
+        for index in exits + loop.breaks:
+            self._patch(index)
+
+    def visitDo(self, stmt):
+        loop = Loop(self._frames())
+        top = len(self.instructions)
+        self._loopBody(stmt.body, loop)
+        loop.continueAt = len(self.instructions)
+        self._finishLoop(loop)
+        again = self._condition(stmt.condition,
+                                stmt.condition_type == "while")
+        for index in again:
+            self._patch(index, top)
+        for index in loop.breaks:
+            self._patch(index)
+
+    def visitFor(self, stmt):
+        if stmt.initializer:
+            self._stmtTable[stmt.initializer.kind](stmt.initializer)
+        loop = Loop(self._frames())
+        head = len(self.instructions)
+        exits = self._condition(stmt.condition, False)
+        self._loopBody(stmt.body, loop)
+        loop.continueAt = len(self.instructions)
+        self._finishLoop(loop)
+        if stmt.increment is not None:
+            self._expression(stmt.increment)
+            self._emit(POP)
+        self._emit(JUMP, head)
+        # The else branch runs when the condition ends the loop, a break
+        # jumps past it
+        for index in exits:
+            self._patch(index)
+        if stmt.else_branch is not None:
+            self._stmtTable[stmt.else_branch.kind](stmt.else_branch)
+        for index in loop.breaks:
+            self._patch(index)
+
+    def visitIf(self, stmt):
+        # An else branch that is another if statement is compiled by this
+        # loop, so long else if chains do not run into the recursion limit
+        ends = []
+        while True:
+            skip = self._condition(stmt.condition, False)
+            self._stmtTable[stmt.then_branch.kind](stmt.then_branch)
+            for elseif in stmt.elseifs:
+                ends.append(self._emit(JUMP))
+                for index in skip:
+                    self._patch(index)
+                skip = self._condition(elseif.condition, False)
+                self._stmtTable[elseif.then_branch.kind](elseif.then_branch)
+            stmt = stmt.else_branch
+            if stmt is not None and empty(stmt):
+                stmt = None
+            if stmt is not None:
+                ends.append(self._emit(JUMP))
+            for index in skip:
+                self._patch(index)
+            if stmt is None:
+                break
+            if stmt.__class__ is not If:
+                self._stmtTable[stmt.kind](stmt)
+                break
+        for index in ends:
+            self._patch(index)
+
+    def visitVar(self, stmt):
+        if stmt.initializer is None:
+            self._emit(CONST, self._constant(None))
+        else:
+            self._expression(stmt.initializer)
+        frame, slot = self._resolve(stmt.name)[0]
+        self._emit(DEFINE, frame, slot,
+                   (str(stmt.type.type).lower(), stmt.type))
+
+    def visitBlock(self, stmt):
+        names = declarations(stmt.statements)
+        if names:
+            self.scope = Scope(names, self._frames(), self.scope)
+            self._emit(ENTER, len(names))
+        for statement in stmt.statements:
+            self._stmtTable[statement.kind](statement)
+        if names:
+            self._emit(LEAVE)
+            self.scope = self.scope.above
+
+    def visitExpression(self, stmt):
+        expr = stmt.expression
+        if expr.__class__ is Assign:
+            # Store the value without leaving it on the stack
+            self._expression(expr.value)
+            found = self._resolve(expr.name)
+            if len(found) == 1:
+                self._emit(STORE_POP, found[0][0], found[0][1], expr.name)
+                return
+            self._emit(STORE_ANY, found, None, expr.name)
+        else:
+            self._expression(expr)
+        self._emit(POP)
+
+    def visitPrint(self, stmt):
+        self._expression(stmt.expression)
+        self._emit(PRINT)
+
+    # Functions for compiling expressions
+    def _condition(self, expr, jumpIf, depth=0):
+        """ Compiles an expression that decides a jump. Returns the jumps
+        taken when its truth is jumpIf, which the caller points at their
+        target, and falls through otherwise. Logical operators become
+        jumps and comparisons jump on their result directly."""
+        while expr.__class__ is Grouping:
+            expr = expr.expression
+        cls = expr.__class__
+        if depth < MAX_DEPTH:
+            if cls is Logical:
+                # Jump when the left side alone decides the result
+                decides = expr.operator.kind == tok.OR
+                if decides == jumpIf:
+                    jumps = self._condition(expr.left, jumpIf, depth + 1)
+                    return jumps + self._condition(expr.right, jumpIf,
+                                                   depth + 1)
+                skip = self._condition(expr.left, decides, depth + 1)
+                jumps = self._condition(expr.right, jumpIf, depth + 1)
+                for index in skip:
+                    self._patch(index)
+                return jumps
+            if cls is Unary and expr.operator.kind == tok.BANG:
+                return self._condition(expr.right, not jumpIf, depth + 1)
+            if cls is Binary:
+                operator = expr.operator
+                function = FLOAT_OPERATORS[operator.kind]
+                left = self._variable(expr.left)
+                right = expr.right
+                if left is not None and right.__class__ is Literal and \
+                        right.val.__class__ is float:
+                    return [self._emit(LOAD_COMPARE_JUMP, None, jumpIf, left +
+                                       (function, self._constant(right.val),
+                                        operator))]
+                self._expression(expr.left)
+                self._expression(right)
+                return [self._emit(COMPARE_JUMP, None, jumpIf,
+                                   (function, operator))]
+        self._expression(expr)
+        return [self._emit(JUMP_IF, None, jumpIf)]
+
+    def _variable(self, expr):
+        """ Returns the frame, slot and name of a variable found in a single
+        scope, or None for anything else."""
+        if expr.__class__ is Variable:
+            found = self._resolve(expr.name)
+            if len(found) == 1:
+                return found[0] + (expr.name,)
+        return None
+
+    def _expression(self, expr):
+        """ Compiles an expression that leaves its value on the stack. Nodes
+        waiting for their operands are kept on an explicit stack, so deeply
+        nested expressions compile without recursion."""
+        emit = self._emit
+        pending = [expr]
+        while pending:
+            expr = pending.pop()
+            cls = expr.__class__
+            if cls is tuple:
+                # Instruction whose operands have been compiled
+                emit(*expr)
+            elif cls is _Label:
+                if expr.index is None:
+                    expr.index = emit(expr.op)
+                else:
+                    self._patch(expr.index)
+            elif cls is Literal:
+                emit(CONST, self._constant(expr.val))
+            elif cls is Variable:
+                found = self._resolve(expr.name)
+                if len(found) == 1:
+                    emit(LOAD, found[0][0], found[0][1], expr.name)
+                else:
+                    emit(LOAD_ANY, found, None, expr.name)
+            elif cls is Binary:
+                operator = expr.operator
+                function = FLOAT_OPERATORS[operator.kind]
+                left = self._variable(expr.left)
+                right = expr.right
+                if right.__class__ is Literal and right.val.__class__ is float:
+                    constant = self._constant(right.val)
+                    if left is not None:
+                        emit(LOAD_BINARY_CONST, left[0], left[1],
+                             (left[2], function, constant, operator))
+                        continue
+                    pending.append((BINARY_CONST, function, constant,
+                                    operator))
+                else:
+                    variable = self._variable(right)
+                    if variable is not None:
+                        pending.append((BINARY_VAR, variable[0], variable[1],
+                                        (variable[2], function, operator)))
+                    else:
+                        pending.append((BINARY, function, None, operator))
+                        pending.append(right)
+                pending.append(expr.left)
+            elif cls is Grouping:
+                pending.append(expr.expression)
+            elif cls is Logical:
+                label = _Label(OR_JUMP if expr.operator.kind == tok.OR
+                               else AND_JUMP)
+                pending.extend((label, (TO_BOOL, None, None, None),
+                                expr.right, label, expr.left))
+            elif cls is Unary:
+                pending.append((UNARY, None, None, expr.operator))
+                pending.append(expr.right)
+            elif cls is Assign:
+                found = self._resolve(expr.name)
+                if len(found) == 1:
+                    pending.append((STORE, found[0][0], found[0][1],
+                                    expr.name))
+                else:
+                    pending.append((STORE_ANY, found, None, expr.name))
+                pending.append(expr.value)
+            elif cls is Call:
+                # Sython has nothing to call yet, the parser makes no calls
+                raise exceptions.RuntimeException("Calls are not supported",
+                                                  expr.paren)
@@ -0,0 +1,236 @@
+"""
+Keeps the parsed statements of a script in a .syc file next to it, so a
+script that has not changed since it last ran is not scanned and parsed
+again.
+"""
+import hashlib
+import marshal
+import os
+import stat
+import sys
+import tempfile
+import zlib
+
+from tree import expressions, stmt
+from tree.scanner import Token, TokenType
+
+# Changes whenever the format of .syc files changes
+FORMAT = 1
+
+MAGIC = b"SYC\n"
+
+# Every class of node, a node is stored with its index in this list
+NODES = [
+    expressions.Assign, expressions.Binary, expressions.Logical,
+    expressions.Grouping, expressions.Literal, expressions.Unary,
+    expressions.Call, expressions.Variable,
+    stmt.If, stmt.Block, stmt.Expression, stmt.Print, stmt.Var, stmt.While,
+    stmt.For, stmt.Do, stmt.Until, stmt.Break, stmt.Continue, stmt.Pass,
+]
+_NODE_INDEX = dict((cls, index) for index, cls in enumerate(NODES))
+
+# Fields holding tokens, lists of nodes and plain values. Every other field
+# holds a node or None
+TOKEN_FIELDS = ("name", "operator", "type", "paren")
+LIST_FIELDS = ("statements", "elseifs", "arguments")
+VALUE_FIELDS = ("val", "condition_type", "x")
+NODE, TOKEN, LIST, VALUE = range(4)
+_KINDS = [tuple(TOKEN if field in TOKEN_FIELDS else
+                LIST if field in LIST_FIELDS else
+                VALUE if field in VALUE_FIELDS else NODE
+                for field in cls._fields) for cls in NODES]
+
+# Sources of the scanner and the parser, a fix to them can change the
+# statements a script is parsed into without changing the classes of nodes
+SOURCES = ("tree/scanner.py", "exec/lexer.py", "exec/syparser.py")
+
+
+def _sources():
+    """ Returns the sources of the scanner and the parser."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sources = []
+    for name in SOURCES:
+        with open(os.path.join(root, *name.split("/")), "rb") as sourceFile:
+            sources.append(sourceFile.read())
+    return sources
+
+
+# Scripts cached by another version of the interpreter, its scanner and
+# parser or the classes of nodes, are parsed again
+VERSION = hashlib.sha256(repr((
+    FORMAT, marshal.version, sys.implementation.cache_tag,
+    [(cls.__module__, cls.__name__, cls._fields) for cls in NODES],
+    _sources(),
+)).encode()).digest()
+
+
+def cachePath(path):
+    """ Returns the path of the .syc file of the script at path."""
+    return os.path.splitext(path)[0] + ".syc"
+
+
+def key(source):
+    """ Returns the key of the cached statements of source, the bytes of a
+    script."""
+    return hashlib.sha256(VERSION + source).digest()
+
+
+def load(path, digest):
+    """ Returns the statements cached for the script at path, or None when
+    there are none for the key digest."""
+    try:
+        with open(cachePath(path), "rb") as cacheFile:
+            data = cacheFile.read()
+    except OSError:
+        return None
+    header = MAGIC + digest
+    if not data.startswith(header):
+        return None
+    try:
+        return decode(data[len(header):])
+    except (ValueError, EOFError, TypeError, IndexError, zlib.error):
+        # A damaged cache is parsed again and replaced
+        return None
+
+
+def store(path, digest, statements):
+    """ Caches the statements of the script at path under the key digest.
+    The .syc file is written to a temporary file first and moved in place,
+    so it is never seen half written. Returns False when it could not be
+    written, which only costs the next run a parse."""
+    target = cachePath(path)
+    try:
+        data = MAGIC + digest + encode(statements)
+        mode = stat.S_IMODE(os.stat(path).st_mode) & 0o666
+        handle, temporary = tempfile.mkstemp(
+            suffix=".tmp", prefix=os.path.basename(target) + ".",
+            dir=os.path.dirname(target) or ".")
+        try:
+            with os.fdopen(handle, "wb") as cacheFile:
+                cacheFile.write(data)
+            os.chmod(temporary, mode | stat.S_IRUSR | stat.S_IWUSR)
+            os.replace(temporary, target)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def encode(statements):
+    """ Returns the bytes of a list of statements.
+
+    Nodes are grouped by their height, the length of the longest path
+    from them down to a node without children, and then by their class.
+    Every group is stored as a column for each field, so decoding builds
+    a whole group at once, after the lower groups its nodes refer to.
+    Nodes and tokens are referred to by their place in the order they are
+    built, counting from 1, 0 stands for None. Tokens are stored as
+    columns too, the way the parallel scanner sends them."""
+    names = []
+    nameIndex = {}
+    types = []
+    lexemes = []
+    seen = {}  # Lexemes written so far, repeated ones are written once
+    literals = []
+    lines = []
+    tokenIndex = {}
+
+    def token(value):
+        if value is None:
+            return 0
+        index = tokenIndex.get(id(value))
+        if index is None:
+            name = value.type.name
+            if name not in nameIndex:
+                nameIndex[name] = len(names)
+                names.append(name)
+            types.append(nameIndex[name])
+            lexemes.append(seen.setdefault(value.lexeme, value.lexeme))
+            literals.append(value.literal)
+            lines.append(value.line)
+            index = tokenIndex[id(value)] = len(lexemes)
+        return index
+
+    # Nodes are kept off the call stack, expressions can be nested too deep
+    # for recursion. Children get their height before their parents
+    heights = {}
+    groups = {}  # Height and class index to the nodes in the group
+    pending = [(statement, None) for statement in reversed(statements)]
+    while pending:
+        current, children = pending.pop()
+        if current is None:
+            continue
+        if children is not None:
+            height = 0
+            for child in children:
+                if heights[id(child)] >= height:
+                    height = heights[id(child)] + 1
+            heights[id(current)] = height
+            key = (height, _NODE_INDEX[current.__class__])
+            groups.setdefault(key, []).append(current)
+            continue
+        if id(current) in heights:
+            continue
+        index = _NODE_INDEX[current.__class__]
+        children = []
+        for field, kind in zip(current._fields, _KINDS[index]):
+            if kind == NODE:
+                child = getattr(current, field)
+                if child is not None:
+                    children.append(child)
+            elif kind == LIST:
+                children.extend(getattr(current, field))
+        pending.append((current, children))
+        pending.extend((child, None) for child in reversed(children))
+
+    nodeIndex = {}
+    layers = []
+    for height, index in sorted(groups):
+        if height == len(layers):
+            layers.append([])
+        group = groups[height, index]
+        columns = []
+        for field, kind in zip(NODES[index]._fields, _KINDS[index]):
+            values = [getattr(node, field) for node in group]
+            if kind == NODE:
+                values = [0 if value is None else nodeIndex[id(value)]
+                          for value in values]
+            elif kind == LIST:
+                values = [tuple(nodeIndex[id(node)] for node in value)
+                          for value in values]
+            elif kind == TOKEN:
+                values = [token(value) for value in values]
+            columns.append(values)
+        for node in group:
+            nodeIndex[id(node)] = len(nodeIndex) + 1
+        layers[-1].append((index, columns))
+
+    top = [0 if statement is None else nodeIndex[id(statement)]
+           for statement in statements]
+    return zlib.compress(marshal.dumps(
+        ((names, types, lexemes, literals, lines), layers, top)), 1)
+
+
+def decode(data):
+    """ Returns the list of statements encode gave the bytes of."""
+    columns, layers, top = marshal.loads(zlib.decompress(data))
+    names, types, lexemes, literals, lines = columns
+    names = [TokenType(name) for name in names]
+    tokens = [None]
+    tokens.extend(map(Token, map(names.__getitem__, types), lexemes,
+                      literals, lines))
+    nodes = [None]
+
+    def many(indices):
+        return [nodes[index] for index in indices]
+
+    getters = {NODE: nodes.__getitem__, TOKEN: tokens.__getitem__,
+               LIST: many}
+    for layer in layers:
+        for index, columns in layer:
+            args = [column if kind == VALUE else map(getters[kind], column)
+                    for kind, column in zip(_KINDS[index], columns)]
+            nodes.extend(map(NODES[index], *args))
+    return [nodes[index] for index in top]
@@ -0,0 +1,317 @@
+"""
+Checks the types of resolved statements before they run. Reports the
+operations that can only fail and marks the ones that can not, so the
+interpreter skips checking them.
+"""
+import operator as ops
+
+from handling.error_reporting import Error
+from tree import scanner as tok
+from tree.expressions import Assign, Binary, Grouping, Literal, Logical, \
+    Unary, Variable
+from tree.stmt import If, StmtVisitor
+
+# Classes of values, as bits of a mask of the classes a value could have
+FLOAT = 1
+INT = 2  # Only the 0 a num starts out with
+BOOL = 4
+STR = 8
+NIL = 16
+ANY = FLOAT | INT | BOOL | STR | NIL
+
+CLASSES = {float: FLOAT, int: INT, bool: BOOL, str: STR, type(None): NIL}
+
+# Values a variable of every type accepts, and the one it starts out with
+ACCEPTS = {"num": FLOAT | INT | BOOL, "str": STR, "bool": BOOL}
+DEFAULTS = {"num": INT, "str": NIL, "bool": BOOL}
+
+# Messages of the runtime errors of definitions and assignments
+DEFINE_ERRORS = {"num": "Type error: not a num", "str": "Type error: not str",
+                 "bool": "Type error not a bool"}
+ASSIGN_ERRORS = {"num": "Type error: not num", "str": "Type error: not str",
+                 "bool": "Type error: not bool"}
+
+# Binary operators applied to two floats, or + to two strings, which need no
+# checks
+FLOAT_OPERATORS = {
+    tok.MINUS: ops.sub,
+    tok.PLUS: ops.add,
+    tok.STAR: ops.mul,
+    tok.SLASH: ops.truediv,
+    tok.GREATER: ops.gt,
+    tok.GREATER_EQUAL: ops.ge,
+    tok.LESS: ops.lt,
+    tok.LESS_EQUAL: ops.le,
+    tok.BANG_EQUAL: ops.ne,
+    tok.EQUAL_EQUAL: ops.eq
+}
+
+ARITHMETIC = (tok.MINUS, tok.STAR, tok.SLASH)
+COMPARISONS = (tok.GREATER, tok.GREATER_EQUAL, tok.LESS, tok.LESS_EQUAL)
+
+
+class TypeChecker(StmtVisitor):
+    """ Finds the classes of the values every variable can hold, from the
+    values its declarations and assignments give it, and from them the
+    classes of the value of every expression.
+
+    This ignores the order statements run in, so it stays true for every
+    path through them. Starting with no values at all, the statements are
+    checked over and over until no variable gets a new class. On the last
+    pass operators whose operands are always numbers, or strings for +, get
+    the function applying them directly, and definitions and assignments
+    of values their variable always accepts are marked safe. Operations
+    whose operands can never pass the checks of the interpreter are
+    reported as errors.
+
+    Top level variables keep their classes between calls to check, as do
+    the names the resolver gives them slots for.
+    """
+
+    def __init__(self, resolver):
+        StmtVisitor.__init__(self)
+        self.resolver = resolver
+        self.values = {}  # Variable to the mask of its classes
+        self.types = {}  # Variable to the type names it is declared with
+        # Returns the function applying + on two strings for its operator
+        # token, when given, otherwise they are added directly
+        self.concatenation = None
+
+    def check(self, statements):
+        """ Resolves and checks a list of top level statements. Returns
+        False when there are errors, after reporting them."""
+        known = len(self.resolver.globals)
+        if not self.resolver.resolve(statements):
+            return False
+        values = dict(self.values)
+        types = dict((key, set(names)) for key, names in self.types.items())
+
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            self.errors = []
+            self.scopes = [self.resolver.globals]
+            for statement in statements:
+                self._statement(statement)
+        if not self.errors:
+            self._forgetBlocks()
+            return True
+
+        for token, msg in self.errors:
+            Error().error(token, msg)
+        # The statements are not going to run
+        self.values = values
+        self.types = types
+        self.resolver.forget(known)
+        return False
+
+    def _forgetBlocks(self):
+        """ Keeps only the top level variables, the variables of blocks are
+        not seen again."""
+        top = id(self.resolver.globals)
+        for table in (self.values, self.types):
+            for key in [key for key in table if key[0] != top]:
+                del table[key]
+
+    def _statement(self, statement):
+        if statement is not None:
+            self._stmtTable[statement.kind](statement)
+
+    def _add(self, key, mask):
+        """ Adds classes to the values of a variable."""
+        values = self.values.get(key, 0)
+        if values | mask != values:
+            self.values[key] = values | mask
+            self.changed = True
+
+    # Functions for checking statements
+    def visitBreak(self, stmt):
+        pass
+
+    def visitContinue(self, stmt):
+        pass
+
+    def visitPass(self, stmt):
+        pass
+
+    def visitFor(self, stmt):
+        self._statement(stmt.initializer)
+        self._type(stmt.condition)
+        if stmt.increment is not None:
+            self._type(stmt.increment)
+        self._statement(stmt.body)
+        self._statement(stmt.else_branch)
+
+    def visitWhile(self, stmt):
+        self._type(stmt.condition)
+        self._statement(stmt.body)
+
+    def visitDo(self, stmt):
+        self._statement(stmt.body)
+        self._type(stmt.condition)
+
+    def visitUntil(self, stmt):
+        self._type(stmt.condition)
+        self._statement(stmt.body)
+
+    def visitIf(self, stmt):
+        while True:
+            self._type(stmt.condition)
+            self._statement(stmt.then_branch)
+            for elseif in stmt.elseifs:
+                self._type(elseif.condition)
+                self._statement(elseif.then_branch)
+            stmt = stmt.else_branch
+            if stmt.__class__ is not If:
+                self._statement(stmt)
+                return
+
+    def visitVar(self, stmt):
+        vtype = stmt.vtype
+        key = (id(self.scopes[-1]), stmt.slot)
+        types = self.types.setdefault(key, set())
+        if vtype not in types:
+            types.add(vtype)
+            self.changed = True
+
+        if stmt.initializer is None:
+            self._add(key, DEFAULTS[vtype])
+            stmt.safe = False
+            return
+        value = self._type(stmt.initializer)
+        accepts = ACCEPTS[vtype]
+        mask = value & accepts
+        if value & NIL:
+            mask |= DEFAULTS[vtype]
+        self._add(key, mask)
+        stmt.safe = value != 0 and value & ~accepts == 0
+        if value and not mask:
+            self.errors.append((stmt.type, DEFINE_ERRORS[vtype]))
+
+    def visitBlock(self, stmt):
+        if stmt.names:
+            self.scopes.append(stmt.names)
+        for statement in stmt.statements:
+            self._statement(statement)
+        if stmt.names:
+            self.scopes.pop()
+
+    def visitExpression(self, stmt):
+        self._type(stmt.expression)
+
+    def visitPrint(self, stmt):
+        self._type(stmt.expression)
+
+    # Functions for checking expressions
+    def _variables(self, expr):
+        """ Returns the variables a variable or assignment could be, the one
+        it is resolved to and those further out it is found in while that
+        one is not defined yet."""
+        name = expr.name.lexeme
+        scopes = self.scopes
+        index = len(scopes) - 1 - expr.depth
+        found = [(id(scopes[index]), expr.slot)]
+        for scope in reversed(scopes[:index]):
+            slot = scope.get(name)
+            if slot is not None:
+                found.append((id(scope), slot))
+        return found
+
+    def _type(self, expr):
+        """ Returns the mask of the classes the value of an expression can
+        have. Operands are typed before their operator with a stack of
+        their own, as expressions can be nested too deep for recursion."""
+        pending = [(expr, False)]
+        masks = []
+        while pending:
+            expr, ready = pending.pop()
+            cls = expr.__class__
+            if cls is Literal:
+                masks.append(CLASSES.get(expr.val.__class__, ANY))
+            elif cls is Variable:
+                mask = 0
+                for key in self._variables(expr):
+                    mask |= self.values.get(key, 0)
+                # Reading an uninitialized variable fails
+                expr.types = mask & ~NIL
+                masks.append(expr.types)
+            elif not ready:
+                pending.append((expr, True))
+                if cls is Binary or cls is Logical:
+                    pending.append((expr.right, False))
+                    pending.append((expr.left, False))
+                elif cls is Grouping:
+                    pending.append((expr.expression, False))
+                elif cls is Unary:
+                    pending.append((expr.right, False))
+                elif cls is Assign:
+                    pending.append((expr.value, False))
+            elif cls is Binary:
+                right = masks.pop()
+                expr.types = self._binary(expr, masks.pop(), right)
+                masks.append(expr.types)
+            elif cls is Logical:
+                masks.pop()
+                expr.types = BOOL if masks.pop() else 0
+                masks.append(expr.types)
+            elif cls is Unary:
+                expr.types = self._unary(expr, masks.pop())
+                masks.append(expr.types)
+            elif cls is Assign:
+                masks.append(self._assign(expr, masks.pop()))
+            elif cls is not Grouping:
+                masks.append(ANY)
+        return masks[0]
+
+    def _binary(self, expr, left, right):
+        operator = expr.operator
+        op = operator.kind
+        floats = left & right & FLOAT
+        expr.apply = None
+        if op in ARITHMETIC or op in COMPARISONS:
+            if floats and left == right == FLOAT:
+                expr.apply = FLOAT_OPERATORS[op]
+            mask = (FLOAT if op in ARITHMETIC else BOOL) if floats else 0
+            msg = "Operands must be numbers!"
+        elif op == tok.PLUS:
+            strings = left & right & STR
+            if left == right == FLOAT or left == right == STR and \
+                    self.concatenation is None:
+                expr.apply = FLOAT_OPERATORS[op]
+            elif left == right == STR:
+                expr.apply = self.concatenation(operator)
+            mask = (FLOAT if floats else 0) | (STR if strings else 0)
+            msg = "Operands must be two numbers or two strings"
+        else:
+            # Equality compares any two values
+            if left == right == FLOAT:
+                expr.apply = FLOAT_OPERATORS[op]
+            return BOOL if left and right else 0
+        if left and right and not mask:
+            self.errors.append((operator, msg))
+        return mask
+
+    def _unary(self, expr, right):
+        if expr.operator.kind == tok.BANG:
+            return BOOL if right else 0
+        if right and not right & FLOAT:
+            self.errors.append((expr.operator, "Operand must be a number!"))
+        return right & FLOAT
+
+    def _assign(self, expr, value):
+        found = self._variables(expr)
+        types = set()
+        for key in found:
+            types.update(self.types.get(key, ()))
+        accepts = 0
+        for vtype in types:
+            accepts |= ACCEPTS[vtype]
+        for key in found:
+            for vtype in self.types.get(key, ()):
+                self._add(key, value & ACCEPTS[vtype])
+
+        expr.safe = value != 0 and bool(types) and all(
+            value & ~ACCEPTS[vtype] == 0 for vtype in types)
+        if value and len(types) == 1 and not value & accepts:
+            self.errors.append((expr.name, ASSIGN_ERRORS[types.pop()]))
+        return value & accepts
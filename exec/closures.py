@@ -0,0 +1,456 @@
+"""
+Compiles statements into nested Python closures, each specialized for its
+node, which are run by calling the closure of the whole program. Lighter
+than the bytecode virtual machine, it keeps variables in the same frames.
+"""
+from exec.bytecode import Compiler, Scope, jumps, resolve
+from exec.resolver import declarations
+from exec.syinterpreter import FLOAT_OPERATORS, MAX_DEPTH, binary, \
+    isTruthy, stringify, unary
+from exec.vm import VirtualMachine
+from handling import exceptions
+from handling.environment import checkAssign, checkDefine
+from tree import scanner as tok
+from tree.expressions import Assign, Binary, Call, Grouping, Literal, \
+    Logical, Unary, Variable
+from tree.stmt import If, StmtVisitor
+
+
+class Jump(object):
+    """ Returned by the closure of a statement that a break or continue
+    leaves. Closures of other statements return None, or the value of their
+    expression, never a Jump."""
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+BREAK = Jump("BREAK")
+CONTINUE = Jump("CONTINUE")
+
+
+class ClosureCompiler(StmtVisitor):
+    """ Compiles statements into a closure that takes a ClosureMachine.
+
+    Variables are found in frames the same way the virtual machine finds
+    them. The closures of break and continue return BREAK and CONTINUE,
+    which the blocks and if statements around them return on to their
+    loop. Only blocks holding a break or continue check what their
+    statements return, and only loops with one of their own check what
+    their body returns. Expressions nested deeper than MAX_DEPTH are
+    compiled to bytecode instead, which runs without recursion.
+    """
+
+    def __init__(self):
+        StmtVisitor.__init__(self)
+        self.globals = Scope({}, 0, None)
+        self.scope = self.globals
+        self.bytecode = Compiler()
+        self.bytecode.globals = self.globals
+
+    def compile(self, statements):
+        """ Compiles a list of top level statements into a closure."""
+        self.scope = self.globals
+        declarations(statements, self.globals.names)
+        return self._sequence([self._statement(statement)
+                               for statement in statements])
+
+    def _statement(self, statement):
+        return self._stmtTable[statement.kind](statement)
+
+    def _sequence(self, closures):
+        """ Returns a closure running closures one after the other."""
+        if len(closures) == 1:
+            return closures[0]
+
+        def sequence(rt):
+            for closure in closures:
+                closure(rt)
+        return sequence
+
+    def _resolve(self, name):
+        return resolve(self.scope, name)
+
+    # Functions for compiling statements
+    def visitBreak(self, stmt):
+        def breaking(rt):
+            return BREAK
+        return breaking
+
+    def visitContinue(self, stmt):
+        def continueing(rt):
+            return CONTINUE
+        return continueing
+
+    def visitPass(self, stmt):
+        def passing(rt):
+            pass
+        return passing
+
+    def visitFor(self, stmt):
+        initializer = None
+        if stmt.initializer:
+            initializer = self._statement(stmt.initializer)
+        condition = self._test(stmt.condition)
+        body = self._statement(stmt.body)
+        increment = None
+        if stmt.increment is not None:
+            increment = self._expression(stmt.increment)
+        otherwise = None
+        if stmt.else_branch is not None:
+            otherwise = self._statement(stmt.else_branch)
+
+        if not stmt.jumps:
+            def forLoop(rt):
+                if initializer is not None:
+                    initializer(rt)
+                while condition(rt):
+                    body(rt)
+                    if increment is not None:
+                        increment(rt)
+                if otherwise is not None:
+                    return otherwise(rt)
+            return forLoop
+
+        def jumpingFor(rt):
+            if initializer is not None:
+                initializer(rt)
+            while condition(rt):
+                if body(rt) is BREAK:
+                    # Leaves the else branch out too
+                    return
+                if increment is not None:
+                    increment(rt)
+            if otherwise is not None:
+                return otherwise(rt)
+        return jumpingFor
+
+    def visitWhile(self, stmt):
+        condition = self._test(stmt.condition)
+        body = self._statement(stmt.body)
+        if not stmt.jumps:
+            def whileLoop(rt):
+                while condition(rt):
+                    body(rt)
+            return whileLoop
+
+        def jumpingWhile(rt):
+            while condition(rt):
+                if body(rt) is BREAK:
+                    return
+        return jumpingWhile
+
+    def visitDo(self, stmt):
+        condition = self._test(stmt.condition)
+        body = self._statement(stmt.body)
+        until = stmt.condition_type != "while"
+        if not stmt.jumps:
+            def doLoop(rt):
+                # Execute the block at least once
+                body(rt)
+                while condition(rt) != until:
+                    body(rt)
+            return doLoop
+
+        def jumpingDo(rt):
+            while body(rt) is not BREAK and condition(rt) != until:
+                pass
+        return jumpingDo
+
+    def visitUntil(self, stmt):
+        condition = self._test(stmt.condition)
+        body = self._statement(stmt.body)
+        if not stmt.jumps:
+            def untilLoop(rt):
+                while not condition(rt):
+                    body(rt)
+            return untilLoop
+
+        def jumpingUntil(rt):
+            while not condition(rt):
+                if body(rt) is BREAK:
+                    return
+        return jumpingUntil
+
+    def visitIf(self, stmt):
+        # Else if chains, including else branches that are if statements,
+        # become one list of conditions and branches
+        branches = []
+        otherwise = None
+        while True:
+            branches.append((self._test(stmt.condition),
+                             self._statement(stmt.then_branch)))
+            for elseif in stmt.elseifs:
+                branches.append((self._test(elseif.condition),
+                                 self._statement(elseif.then_branch)))
+            stmt = stmt.else_branch
+            if stmt is None:
+                break
+            if stmt.__class__ is not If:
+                otherwise = self._statement(stmt)
+                break
+
+        if len(branches) == 1:
+            condition, then = branches[0]
+            if otherwise is None:
+                def ifThen(rt):
+                    if condition(rt):
+                        return then(rt)
+                return ifThen
+
+            def ifElse(rt):
+                if condition(rt):
+                    return then(rt)
+                return otherwise(rt)
+            return ifElse
+
+        def ifChain(rt):
+            for condition, then in branches:
+                if condition(rt):
+                    return then(rt)
+            if otherwise is not None:
+                return otherwise(rt)
+        return ifChain
+
+    def visitVar(self, stmt):
+        if stmt.initializer is None:
+            value = None
+        else:
+            value = self._expression(stmt.initializer)
+        frame, slot = self._resolve(stmt.name)[0]
+        typetok = stmt.type
+        vtype = str(typetok.type).lower()
+
+        def define(rt):
+            rt.frames[frame][slot] = checkDefine(
+                vtype, typetok, None if value is None else value(rt))
+            rt.types[frame][slot] = vtype
+        return define
+
+    def visitBlock(self, stmt):
+        names = declarations(stmt.statements)
+        if names:
+            self.scope = Scope(names, self.scope.frame + 1, self.scope)
+        statements = [self._statement(statement)
+                      for statement in stmt.statements]
+        if names:
+            self.scope = self.scope.above
+        size = len(names)
+
+        if not any(jumps(statement) for statement in stmt.statements):
+            if not size:
+                return self._sequence(statements)
+
+            def scopedBlock(rt):
+                rt.frames.append([None] * size)
+                rt.types.append([None] * size)
+                for statement in statements:
+                    statement(rt)
+                rt.frames.pop()
+                rt.types.pop()
+            return scopedBlock
+
+        # A break or continue ends the block, and is returned on
+        def jumpingBlock(rt):
+            if size:
+                rt.frames.append([None] * size)
+                rt.types.append([None] * size)
+            for statement in statements:
+                jump = statement(rt)
+                if jump.__class__ is Jump:
+                    break
+            else:
+                jump = None
+            if size:
+                rt.frames.pop()
+                rt.types.pop()
+            return jump
+        return jumpingBlock
+
+    def visitExpression(self, stmt):
+        return self._expression(stmt.expression)
+
+    def visitPrint(self, stmt):
+        value = self._expression(stmt.expression)
+
+        def printing(rt):
+            print(stringify(value(rt)))
+        return printing
+
+    # Functions for compiling expressions
+    def _test(self, expr, depth=0):
+        """ Compiles an expression into a closure returning its truth."""
+        while expr.__class__ is Grouping:
+            expr = expr.expression
+        cls = expr.__class__
+        if depth < MAX_DEPTH:
+            if cls is Logical:
+                left = self._test(expr.left, depth + 1)
+                right = self._test(expr.right, depth + 1)
+                if expr.operator.kind == tok.OR:
+                    return lambda rt: left(rt) or right(rt)
+                return lambda rt: left(rt) and right(rt)
+            if cls is Unary and expr.operator.kind == tok.BANG:
+                right = self._test(expr.right, depth + 1)
+                return lambda rt: not right(rt)
+            if cls is Binary and expr.operator.kind in (
+                    tok.GREATER, tok.GREATER_EQUAL, tok.LESS, tok.LESS_EQUAL,
+                    tok.BANG_EQUAL, tok.EQUAL_EQUAL):
+                # Comparisons always give a bool
+                return self._expression(expr, depth)
+        value = self._expression(expr, depth)
+        return lambda rt: isTruthy(value(rt))
+
+    def _variable(self, expr):
+        """ Returns the frame and slot of a variable found in a single
+        scope, or None for anything else."""
+        if expr.__class__ is Variable:
+            found = self._resolve(expr.name)
+            if len(found) == 1:
+                return found[0]
+        return None
+
+    def _expression(self, expr, depth=0):
+        """ Compiles an expression into a closure returning its value."""
+        cls = expr.__class__
+        if cls is Literal:
+            val = expr.val
+            return lambda rt: val
+        if cls is Variable:
+            return self._load(expr.name)
+        if cls is Assign:
+            return self._assign(expr.name, self._expression(expr.value))
+        if depth > MAX_DEPTH:
+            self.bytecode.scope = self.scope
+            code = self.bytecode.compileExpression(expr)
+            instructions = code.instructions
+            constants = code.constants
+            return lambda rt: rt._run(instructions, constants, rt.frames,
+                                      rt.types)
+        if cls is Grouping:
+            return self._expression(expr.expression, depth + 1)
+        if cls is Binary:
+            return self._binary(expr, depth + 1)
+        if cls is Logical:
+            left = self._test(expr.left, depth + 1)
+            right = self._test(expr.right, depth + 1)
+            if expr.operator.kind == tok.OR:
+                return lambda rt: True if left(rt) or right(rt) else False
+            return lambda rt: True if left(rt) and right(rt) else False
+        if cls is Unary:
+            operator = expr.operator
+            right = self._expression(expr.right, depth + 1)
+            if operator.kind == tok.MINUS:
+                def negate(rt):
+                    value = right(rt)
+                    if value.__class__ is float:
+                        return -1 * value
+                    return unary(operator, value)
+                return negate
+            return lambda rt: unary(operator, right(rt))
+        if cls is Call:
+            # Sython has nothing to call yet, the parser makes no calls
+            raise exceptions.RuntimeException("Calls are not supported",
+                                              expr.paren)
+
+    def _binary(self, expr, depth):
+        operator = expr.operator
+        function = FLOAT_OPERATORS[operator.kind]
+        right = expr.right
+        if right.__class__ is Literal and right.val.__class__ is float:
+            constant = right.val
+            variable = self._variable(expr.left)
+            if variable is not None:
+                frame, slot = variable
+                load = self._load(expr.left.name)
+
+                def binaryVariableConstant(rt):
+                    left = rt.frames[frame][slot]
+                    if left.__class__ is float:
+                        return function(left, constant)
+                    return binary(operator, load(rt), constant)
+                return binaryVariableConstant
+
+            left = self._expression(expr.left, depth)
+
+            def binaryConstant(rt):
+                value = left(rt)
+                if value.__class__ is float:
+                    return function(value, constant)
+                return binary(operator, value, constant)
+            return binaryConstant
+
+        left = self._expression(expr.left, depth)
+        right = self._expression(right, depth)
+
+        def binaryOperation(rt):
+            a = left(rt)
+            b = right(rt)
+            if a.__class__ is float and b.__class__ is float:
+                return function(a, b)
+            return binary(operator, a, b)
+        return binaryOperation
+
+    def _load(self, name):
+        found = self._resolve(name)
+        if len(found) != 1:
+            return lambda rt: rt._load(found, name)
+        frame, slot = found[0]
+
+        def load(rt):
+            value = rt.frames[frame][slot]
+            if value is None:
+                return rt._load(found, name)
+            return value
+        return load
+
+    def _assign(self, name, value):
+        found = self._resolve(name)
+        if len(found) != 1:
+            def assignAny(rt):
+                result = value(rt)
+                rt._store(found, name, result)
+                return result
+            return assignAny
+        frame, slot = found[0]
+
+        def assign(rt):
+            result = value(rt)
+            vtype = rt.types[frame][slot]
+            if vtype != "num" or result.__class__ is not float:
+                if vtype is None:
+                    rt._store(found, name, result)
+                    return result
+                checkAssign(vtype, name, result)
+            rt.frames[frame][slot] = result
+            return result
+        return assign
+
+
+class ClosureMachine(VirtualMachine):
+    """ Runs the closures compiled by ClosureCompiler. Keeps the frames of
+    the virtual machine."""
+
+    def __init__(self):
+        VirtualMachine.__init__(self)
+        self.compiler = ClosureCompiler()
+
+    def run(self, program):
+        """ Runs a compiled program. Frames of blocks are dropped when it
+        fails, the top level variables are kept."""
+        frames = self.frames
+        types = self.types
+        # Make room for top level variables declared since the last run
+        missing = len(self.compiler.globals.names) - len(frames[0])
+        frames[0].extend([None] * missing)
+        types[0].extend([None] * missing)
+        try:
+            program(self)
+        finally:
+            del frames[1:]
+            del types[1:]
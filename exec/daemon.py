@@ -0,0 +1,245 @@
+"""
+Keeps a warm process listening on a Unix domain socket, which runs scripts
+for clients so they skip starting Python and importing the interpreter.
+Only needs the standard library, so clients start quickly too.
+"""
+import io
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+
+# Kinds of messages. A message is its kind, the length of its payload and
+# the payload
+REQUEST = b"R"  # Directory of the client, then its arguments, NUL separated
+STDOUT = b"O"  # Output of the job
+STDERR = b"E"  # Errors of the job
+EXIT = b"X"  # Exit status of the job, which ends it
+
+_HEADER = struct.Struct("!cI")
+_STATUS = struct.Struct("!i")
+
+
+def socketDirectory():
+    """ Returns the directory of the socket of the daemon of this user,
+    which only the user can use, so other users can not put a socket of
+    their own in its place."""
+    directory = os.environ.get("XDG_RUNTIME_DIR")
+    if directory:
+        return directory
+    # tempfile takes longer to import than a client takes to run a job
+    return os.path.join(os.environ.get("TMPDIR") or "/tmp",
+                        "sython-%d" % os.getuid())
+
+
+def socketPath():
+    """ Returns the socket of the daemon of this user, unless another one
+    is given."""
+    return os.path.join(socketDirectory(), "sython.sock")
+
+
+def checkPrivate(path, kind):
+    """ Raises PermissionError unless path is of the kind, a check from
+    stat like stat.S_ISSOCK, owned by this user and of no use to anyone
+    else. Links are not followed, they could lead anywhere."""
+    status = os.lstat(path)
+    if not kind(status.st_mode) or status.st_uid != os.getuid() or \
+            status.st_mode & 0o077:
+        raise PermissionError("%s is not private to this user" % path)
+
+
+def send(connection, kind, payload):
+    connection.sendall(_HEADER.pack(kind, len(payload)) + payload)
+
+
+def receive(stream):
+    """ Returns the kind and payload of the next message read from a file
+    of the connection, or None when it was closed."""
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    kind, size = _HEADER.unpack(header)
+    payload = stream.read(size)
+    if len(payload) < size:
+        return None
+    return kind, payload
+
+
+class _Channel(io.RawIOBase):
+    """ Sends what is written to it as messages of one kind."""
+
+    def __init__(self, connection, kind):
+        io.RawIOBase.__init__(self)
+        self.connection = connection
+        self.kind = kind
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        send(self.connection, self.kind, bytes(data))
+        return len(data)
+
+
+class Server(object):
+    """ Runs the job of every client in a process forked from this one,
+    which has everything imported already. A forked process starts out with
+    nothing from the jobs before it, and is gone with everything the job
+    did when it ends.
+
+    run is called in the forked process with the arguments of the client,
+    after moving to its directory, and returns the exit status. What it
+    prints is sent to the client line by line. At most jobs run at the
+    same time, other clients wait for one of them to end.
+    """
+
+    def __init__(self, run, path=None, jobs=None):
+        self.run = run
+        self.path = path or socketPath()
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.children = set()
+
+    def serve(self):
+        """ Serves clients until the process is interrupted or terminated."""
+        listener = self._listen()
+        previous = signal.signal(signal.SIGTERM, _terminate)
+        try:
+            while True:
+                self._reap(len(self.children) >= self.jobs)
+                connection, _ = listener.accept()
+                try:
+                    pid = os.fork()
+                except OSError:
+                    connection.close()
+                    raise
+                if pid == 0:
+                    listener.close()
+                    signal.signal(signal.SIGTERM, previous)
+                    signal.signal(signal.SIGINT, signal.SIG_DFL)
+                    self._serveJob(connection)
+                connection.close()
+                self.children.add(pid)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            os.unlink(self.path)
+            signal.signal(signal.SIGTERM, previous)
+
+    def _listen(self):
+        if self.path == socketPath():
+            directory = socketDirectory()
+            try:
+                os.mkdir(directory, 0o700)
+            except FileExistsError:
+                pass
+            checkPrivate(directory, stat.S_ISDIR)
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                # Left behind by a daemon that did not stop cleanly
+                os.unlink(self.path)
+            else:
+                raise OSError("A daemon is already listening on %s" %
+                              self.path)
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        listener.listen(128)
+        return listener
+
+    def _reap(self, wait):
+        """ Forgets the jobs that ended, waiting for one when wait is
+        set."""
+        while self.children:
+            pid, _ = os.waitpid(-1, 0 if wait else os.WNOHANG)
+            if pid == 0:
+                return
+            self.children.discard(pid)
+            wait = False
+
+    def _serveJob(self, connection):
+        """ Runs one job in the forked process, never returns."""
+        status = 1
+        try:
+            stream = connection.makefile("rb")
+            message = receive(stream)
+            # Both are sent a line at a time, so the client sees output as
+            # it is printed and errors after the output before them
+            stdout = io.TextIOWrapper(io.BufferedWriter(
+                _Channel(connection, STDOUT)), encoding="utf-8",
+                line_buffering=True)
+            stderr = io.TextIOWrapper(io.BufferedWriter(
+                _Channel(connection, STDERR)), encoding="utf-8",
+                line_buffering=True)
+            sys.stdout = stdout
+            sys.stderr = stderr
+            sys.stdin = open(os.devnull)
+            try:
+                if message is None or message[0] != REQUEST:
+                    raise ValueError("Expected a request")
+                fields = message[1].decode("utf-8").split("\0")
+                os.chdir(fields[0])
+                status = self.run(fields[1:])
+            except SystemExit as exit:
+                status = exit.code
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+            if status is None:
+                status = 0
+            elif not isinstance(status, int):
+                # Exit with a message, like Python
+                print(status, file=sys.stderr)
+                status = 1
+            stdout.flush()
+            stderr.flush()
+            send(connection, EXIT, _STATUS.pack(status))
+        finally:
+            os._exit(0)
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def request(arguments, path=None, cwd=None):
+    """ Runs a job with the given arguments on the daemon, writing what it
+    prints to the output and errors of this process. Returns its exit
+    status. Raises FileNotFoundError or ConnectionRefusedError when no
+    daemon is listening, PermissionError when the socket, or the directory
+    of the default one, is not private to this user, and other OSErrors
+    when the connection fails after the job started."""
+    if path is None:
+        path = socketPath()
+        checkPrivate(socketDirectory(), stat.S_ISDIR)
+    checkPrivate(path, stat.S_ISSOCK)
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+        fields = [cwd or os.getcwd()] + list(arguments)
+        send(connection, REQUEST, "\0".join(fields).encode("utf-8"))
+        stream = connection.makefile("rb")
+        outputs = {STDOUT: sys.stdout, STDERR: sys.stderr}
+        while True:
+            message = receive(stream)
+            if message is None:
+                raise OSError("The daemon closed the connection")
+            kind, payload = message
+            if kind == EXIT:
+                return _STATUS.unpack(payload)[0]
+            output = outputs[kind]
+            output.flush()
+            if hasattr(output, "buffer"):
+                output.buffer.write(payload)
+                output.buffer.flush()
+            else:
+                output.write(payload.decode("utf-8", "replace"))
+    finally:
+        connection.close()
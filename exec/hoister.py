@@ -0,0 +1,511 @@
+"""
+Moves work out of loops once statements are checked. Expressions whose
+value can not change while a loop runs are evaluated once before it, and
+expressions repeated within a statement of a loop are evaluated once.
+"""
+from exec.checker import BOOL, CLASSES, FLOAT, INT, STR
+from exec.resolver import variables
+from tree import scanner as tok
+from tree.expressions import Assign, Binary, Grouping, Literal, Logical, \
+    Unary, Variable
+from tree.scanner import Token, TokenType
+from tree.stmt import Expression, If, StmtVisitor, Var
+from tree import stmt
+
+LOOPS = (stmt.WHILE, stmt.FOR, stmt.DO, stmt.UNTIL)
+EQUALITY = (tok.BANG_EQUAL, tok.EQUAL_EQUAL)
+
+# Fields holding the operands of every class of expression that has any
+OPERANDS = {Binary: ("left", "right"), Logical: ("left", "right"),
+            Unary: ("right",), Grouping: ("expression",), Assign: ("value",)}
+
+# Repeated expressions are only reused when they have at least this many
+# operators, reading a variable costs about as much as applying one
+MIN_OPERATORS = 2
+
+# Expressions nested deeper than this are left as they are, the
+# assignments reusing their parts would each be evaluated recursively
+MAX_NESTING = 50
+
+
+def declaredType(mask):
+    """ Returns the type name of a variable that accepts every value of
+    the classes in mask, None when no type does."""
+    if mask == BOOL:
+        return "bool"
+    if mask == STR:
+        return "str"
+    if mask and mask & ~(FLOAT | INT | BOOL) == 0:
+        return "num"
+    return None
+
+
+def literalKey(expr):
+    """ Returns a key equal for literals of the same value. It holds the
+    class too, as 1.0 == True, and the text of floats, as -0.0 == 0.0."""
+    val = expr.val
+    if val.__class__ is float:
+        return (Literal, float, repr(val))
+    return (Literal, val.__class__, val)
+
+
+def operands(expr):
+    """ Returns the names of the fields holding the operands of an
+    expression."""
+    return OPERANDS.get(expr.__class__, ())
+
+
+class Hoister(StmtVisitor):
+    """ Rewrites loops found in lists of statements, using the classes the
+    type checker found for the values of expressions.
+
+    An operator is moved out of a loop when no variable it reads is
+    assigned or declared anywhere in the loop, and when it can not fail:
+    its operands are proven to pass the checks of the operator and every
+    variable it reads is defined before the loop by a declaration that can
+    not leave it uninitialized. Its value is kept in a temporary declared
+    before the loop, under a name no script can use. Operators of loops
+    nested in others are assigned to their temporary right before the
+    nested loop, the temporaries themselves are all declared before the
+    outermost loop so blocks do not get new variables.
+
+    Within a statement of a loop an expression repeated without anything
+    in between assigning its variables is evaluated once, where it first
+    appears, and assigned to a temporary the others read. Expressions only
+    evaluated depending on the value of an and or or are left alone.
+
+    Lists of statements are changed in place. Afterwards the statements are
+    resolved again, to bind the temporaries.
+    """
+
+    def __init__(self, resolver):
+        StmtVisitor.__init__(self)
+        self.resolver = resolver
+        self.enabled = True
+        self.count = 0  # Temporaries made so far, keeps their names unique
+        self.defined = set()  # Names that can be read without failing
+        self.sink = None  # Declarations to put before the outermost loop
+        self.before = None  # Statements to put before the current one
+
+    def hoist(self, statements):
+        """ Rewrites the loops of a list of top level statements that have
+        been checked, changing the list in place."""
+        if not self.enabled:
+            return
+        count = self.count
+        self.defined = set()
+        self.sink = None
+        self._list(statements)
+        if self.count != count:
+            self.resolver.resolve(statements)
+
+    def _list(self, statements):
+        defined = self.defined
+        before = self.before
+        self.defined = set(defined)
+        result = []
+        for statement in statements:
+            self.before = result
+            self._statement(statement)
+            result.append(statement)
+            for declaration in variables([statement]):
+                name = declaration.name.lexeme
+                if declaration.initializer is None and \
+                        declaration.vtype == "str":
+                    # Reading it fails until something is assigned to it
+                    self.defined.discard(name)
+                elif declaration is statement:
+                    self.defined.add(name)
+        statements[:] = result
+        self.defined = defined
+        self.before = before
+
+    def _statement(self, statement):
+        if statement is not None:
+            self._stmtTable[statement.kind](statement)
+
+    def _bare(self, statement):
+        """ Visits a statement that is not in a list, nothing can be put
+        before it."""
+        before = self.before
+        self.before = None
+        self._statement(statement)
+        self.before = before
+
+    def _temporary(self, vtype, line):
+        """ Returns the name token of a new temporary and the token of its
+        type."""
+        self.count += 1
+        name = Token(TokenType("IDENTIFIER"), "$%d" % self.count, None, line)
+        return name, Token(TokenType(vtype.upper()), vtype, None, line)
+
+    # Functions for visiting statements
+    def visitBreak(self, stmt):
+        pass
+
+    def visitContinue(self, stmt):
+        pass
+
+    def visitPass(self, stmt):
+        pass
+
+    def visitFor(self, stmt):
+        self._loop(stmt)
+
+    def visitWhile(self, stmt):
+        self._loop(stmt)
+
+    def visitDo(self, stmt):
+        self._loop(stmt)
+
+    def visitUntil(self, stmt):
+        self._loop(stmt)
+
+    def visitIf(self, stmt):
+        while True:
+            stmt.condition = self._common(stmt.condition)
+            self._bare(stmt.then_branch)
+            for elseif in stmt.elseifs:
+                elseif.condition = self._common(elseif.condition)
+                self._bare(elseif.then_branch)
+            if stmt.else_branch.__class__ is not If:
+                self._bare(stmt.else_branch)
+                return
+            stmt = stmt.else_branch
+
+    def visitVar(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer = self._common(stmt.initializer)
+
+    def visitBlock(self, stmt):
+        self._list(stmt.statements)
+
+    def visitExpression(self, stmt):
+        stmt.expression = self._common(stmt.expression)
+
+    def visitPrint(self, stmt):
+        stmt.expression = self._common(stmt.expression)
+
+    def _loop(self, loop):
+        before = self.before
+        sink = self.sink
+        outermost = sink is None
+        if before is None and outermost:
+            # Nothing can be put before this loop, only the loops in its
+            # lists of statements are rewritten
+            self._inside(loop)
+            return
+
+        if outermost:
+            self.sink = []
+        if before is not None:
+            for name, typetok, expr in self._invariants(loop):
+                if outermost:
+                    temporary = Var(name, typetok, expr)
+                    temporary.safe = True
+                else:
+                    self.sink.append(Var(name, typetok, None))
+                    temporary = Expression(self._assign(name, expr))
+                before.append(temporary)
+                self.defined.add(name.lexeme)
+        self._inside(loop)
+        if outermost:
+            before.extend(self.sink)
+            self.sink = None
+
+    def _inside(self, loop):
+        kind = loop.kind
+        if kind == stmt.FOR:
+            self._bare(loop.initializer)
+            loop.condition = self._common(loop.condition)
+            if loop.increment is not None:
+                loop.increment = self._common(loop.increment)
+            self._bare(loop.body)
+            self._bare(loop.else_branch)
+        elif kind == stmt.DO:
+            self._bare(loop.body)
+            loop.condition = self._common(loop.condition)
+        else:
+            loop.condition = self._common(loop.condition)
+            self._bare(loop.body)
+
+    def _assign(self, name, expr):
+        assign = Assign(name, expr)
+        # The temporary is declared with a type that accepts the value
+        assign.safe = True
+        return assign
+
+    # Functions for moving invariant expressions out of loops
+    def _invariants(self, loop):
+        """ Replaces the invariant operators of a loop with temporaries,
+        returns the name, type and expression of every temporary."""
+        assigned = set()
+        each(loop, lambda expr: assignments(expr, assigned), assigned)
+        found = {}
+        temporaries = []
+
+        def hoist(expr):
+            return self._hoist(expr, assigned, found, temporaries)
+
+        loop.condition = hoist(loop.condition)
+        if loop.kind == stmt.FOR and loop.increment is not None:
+            loop.increment = hoist(loop.increment)
+        each(loop.body, hoist)
+        return temporaries
+
+    def _hoist(self, expr, assigned, found, temporaries):
+        """ Returns an expression with its invariant operators replaced by
+        the temporaries that hold their values."""
+        info = self._invariance(expr, assigned)
+
+        def replaced(node):
+            ok, mask, key = info[id(node)]
+            while node.__class__ is Grouping:
+                node = node.expression
+            cls = node.__class__
+            if not ok or (cls is not Binary and cls is not Logical and
+                          cls is not Unary):
+                return None
+            if key not in found:
+                vtype = declaredType(mask)
+                if vtype is None:
+                    return None
+                name, typetok = self._temporary(vtype, node.operator.line)
+                found[key] = name
+                temporaries.append((name, typetok, node))
+            variable = Variable(found[key])
+            variable.types = mask
+            return variable
+
+        return replace(expr, replaced)
+
+    def _invariance(self, expr, assigned):
+        """ Returns a dictionary from the id of every node of an expression
+        to whether it is invariant and can not fail, the mask of the
+        classes of its value and a key equal for equal expressions."""
+        info = {}
+        pending = [(expr, False)]
+        while pending:
+            node, ready = pending.pop()
+            cls = node.__class__
+            if cls is Literal:
+                info[id(node)] = (True, CLASSES.get(node.val.__class__, 0),
+                                  literalKey(node))
+                continue
+            if cls is Variable:
+                name = node.name.lexeme
+                info[id(node)] = (name not in assigned and
+                                  name in self.defined, node.types or 0,
+                                  (cls, name))
+                continue
+            fields = operands(node)
+            if not ready:
+                pending.append((node, True))
+                pending.extend((getattr(node, field), False)
+                               for field in fields)
+                continue
+            parts = [info[id(getattr(node, field))] for field in fields]
+            ok = all(part[0] for part in parts)
+            key = (cls,) + tuple(part[2] for part in parts)
+            if cls is Grouping:
+                info[id(node)] = parts[0]
+                continue
+            if cls is Binary:
+                op = node.operator.kind
+                key += (op,)
+                ok = ok and (op in EQUALITY or node.apply is not None and (
+                    op != tok.SLASH or nonzero(node.right)))
+            elif cls is Unary:
+                op = node.operator.kind
+                key += (op,)
+                ok = ok and (op == tok.BANG or parts[0][1] == FLOAT)
+            elif cls is Logical:
+                key += (node.operator.kind,)
+            else:
+                info[id(node)] = (False, 0, None)
+                continue
+            info[id(node)] = (ok, node.types or 0, key)
+        return info
+
+    # Functions for reusing repeated expressions
+    def _common(self, expr):
+        """ Returns an expression with its repeated parts evaluated once,
+        when it is evaluated in a loop."""
+        if self.sink is None:
+            return expr
+        nodes = []  # Every node in the order they are evaluated in
+        parents = {}  # Id of a node to its parent and the field it is in
+        conditional = set()  # Ids of nodes that may not be evaluated
+        assigned = set()
+        pending = [(expr, None, None, False, 0)]
+        while pending:
+            node, parent, field, maybe, depth = pending.pop()
+            if depth > MAX_NESTING:
+                return expr
+            nodes.append(node)
+            parents[id(node)] = (parent, field)
+            if maybe:
+                conditional.add(id(node))
+            if node.__class__ is Assign:
+                assigned.add(node.name.lexeme)
+            fields = operands(node)
+            for index in range(len(fields) - 1, -1, -1):
+                name = fields[index]
+                pending.append((getattr(node, name), node, name, maybe or (
+                    node.__class__ is Logical and index == 1), depth + 1))
+
+        info = self._purity(nodes, assigned)
+        groups = {}
+        for node in nodes:
+            pure, mask, key, count = info[id(node)]
+            if pure and count >= MIN_OPERATORS and \
+                    id(node) not in conditional and \
+                    declaredType(mask) is not None and \
+                    node.__class__ is not Grouping:
+                groups.setdefault(key, []).append(node)
+
+        position = dict((id(node), index) for index, node in
+                        enumerate(nodes))
+        removed = set()
+        for key, group in sorted(groups.items(),
+                                 key=lambda item: -info[id(item[1][0])][3]):
+            group = [node for node in group if id(node) not in removed]
+            if len(group) < 2:
+                continue
+            group.sort(key=lambda node: position[id(node)])
+            first = group[0]
+            mask = info[id(first)][1]
+            name, typetok = self._temporary(declaredType(mask),
+                                            first.operator.line)
+            self.sink.append(Var(name, typetok, None))
+            expr = self._put(expr, parents, first, self._assign(name, first))
+            for node in group[1:]:
+                variable = Variable(name)
+                variable.types = mask
+                expr = self._put(expr, parents, node, variable)
+                removed.update(id(part) for part in subtree(node))
+        return expr
+
+    def _put(self, expr, parents, node, replacement):
+        """ Puts replacement where node is, returns the new expression."""
+        parent, field = parents[id(node)]
+        if parent is None:
+            return replacement
+        setattr(parent, field, replacement)
+        return expr
+
+    def _purity(self, nodes, assigned):
+        """ Returns a dictionary from the id of every node to whether it
+        always gives the same value, the mask of the classes of its value,
+        a key equal for equal expressions and its number of operators."""
+        info = {}
+        for node in reversed(nodes):
+            cls = node.__class__
+            if cls is Literal:
+                info[id(node)] = (True, CLASSES.get(node.val.__class__, 0),
+                                  literalKey(node), 0)
+                continue
+            if cls is Variable:
+                name = node.name.lexeme
+                info[id(node)] = (name not in assigned, node.types or 0,
+                                  (cls, name), 0)
+                continue
+            parts = [info[id(getattr(node, field))]
+                     for field in operands(node)]
+            if cls is Grouping:
+                info[id(node)] = parts[0]
+                continue
+            if cls is Assign:
+                info[id(node)] = (False, 0, None, 0)
+                continue
+            pure = all(part[0] for part in parts)
+            key = (cls, node.operator.kind) + tuple(part[2] for part in parts)
+            count = 1 + sum(part[3] for part in parts)
+            info[id(node)] = (pure, node.types or 0, key, count)
+        return info
+
+
+def nonzero(expr):
+    """ Returns True when an expression is a literal number other than
+    zero, which can be divided by."""
+    while expr.__class__ is Grouping:
+        expr = expr.expression
+    return expr.__class__ is Literal and expr.val.__class__ is float and \
+        expr.val != 0
+
+
+def subtree(expr):
+    """ Yields every node of an expression."""
+    pending = [expr]
+    while pending:
+        node = pending.pop()
+        yield node
+        pending.extend(getattr(node, field) for field in operands(node))
+
+
+def replace(expr, replaced):
+    """ Replaces the outermost nodes of an expression for which replaced
+    returns a new node, returns the new expression."""
+    new = replaced(expr)
+    if new is not None:
+        return new
+    pending = [expr]
+    while pending:
+        node = pending.pop()
+        for field in operands(node):
+            child = getattr(node, field)
+            new = replaced(child)
+            if new is not None:
+                setattr(node, field, new)
+            else:
+                pending.append(child)
+    return expr
+
+
+def assignments(expr, names):
+    """ Adds the names an expression assigns to names, returns the
+    expression."""
+    for node in subtree(expr):
+        if node.__class__ is Assign:
+            names.add(node.name.lexeme)
+    return expr
+
+
+def each(statement, rewrite, declared=None):
+    """ Replaces every expression of a statement and of the statements in
+    it with what rewrite returns for it. Adds the names declared anywhere
+    in it to declared, when given."""
+    pending = [statement]
+    while pending:
+        statement = pending.pop()
+        if statement is None:
+            continue
+        kind = statement.kind
+        if kind == stmt.IF:
+            while True:
+                statement.condition = rewrite(statement.condition)
+                pending.append(statement.then_branch)
+                for elseif in statement.elseifs:
+                    elseif.condition = rewrite(elseif.condition)
+                    pending.append(elseif.then_branch)
+                if statement.else_branch.__class__ is not If:
+                    pending.append(statement.else_branch)
+                    break
+                statement = statement.else_branch
+        elif kind == stmt.BLOCK:
+            pending.extend(statement.statements)
+        elif kind == stmt.EXPRESSION or kind == stmt.PRINT:
+            statement.expression = rewrite(statement.expression)
+        elif kind == stmt.VAR:
+            if declared is not None:
+                declared.add(statement.name.lexeme)
+            if statement.initializer is not None:
+                statement.initializer = rewrite(statement.initializer)
+        elif kind in LOOPS:
+            statement.condition = rewrite(statement.condition)
+            pending.append(statement.body)
+            if kind == stmt.FOR:
+                if statement.increment is not None:
+                    statement.increment = rewrite(statement.increment)
+                pending.append(statement.initializer)
+                pending.append(statement.else_branch)
@@ -0,0 +1,112 @@
+"""
+Class that keeps the tokens and statements of a source file up to date
+as the file is edited, without scanning and parsing the whole file again.
+"""
+import bisect
+from exec.syparser import Parser
+from tree.scanner import Scanner
+
+
+class Document(object):
+    """ Source code along with its tokens and top level statements.
+
+    Tokens never span lines, so an edit is re-scanned from the start of the
+    first line it touches to the end of the last one. Top level statements
+    are then re-parsed from the first one that could have seen a changed
+    token, until the parser is back at the start of an old statement that
+    comes after the edit. Every other statement is reused as is.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.tokens = Scanner(source).scanTokens()
+        self.starts = []  # Index of the first token of every statement
+        self.statements = []
+        self._parseFrom(0, 0, None, 0)
+
+    def edit(self, offset, deleted, inserted):
+        """ Replaces deleted characters at offset with the inserted text
+        and returns the updated list of statements."""
+        source = self.source
+        tokens = self.tokens
+
+        # Lines touched by the edit, from the start of the first one to
+        # the end of the last one, not counting its newline
+        first = source.rfind('\n', 0, offset) + 1
+        last = source.find('\n', offset + deleted)
+        if last == -1:
+            last = len(source)
+        firstLine = source.count('\n', 0, first) + 1
+        lastLine = firstLine + source.count('\n', first, last)
+        delta = inserted.count('\n') - \
+            source.count('\n', offset, offset + deleted)
+
+        self.source = source[:offset] + inserted + source[offset + deleted:]
+
+        # Re-scan the touched lines, EOF is never part of them
+        scan = Scanner(self.source[first:last + len(inserted) - deleted])
+        scan.line = firstLine
+        scan._scanSource()
+        new = scan.tokenList
+        start = self._firstOnLine(firstLine)
+        end = min(self._firstOnLine(lastLine + 1), len(tokens) - 1)
+        tokens[start:end] = new
+        if delta:
+            for index in range(start + len(new), len(tokens)):
+                tokens[index].line += delta
+
+        self._reparse(start, end, start + len(new))
+        return self.statements
+
+    def _firstOnLine(self, line):
+        """ Returns the index of the first token on or after line."""
+        tokens = self.tokens
+        low = 0
+        high = len(tokens)
+        while low < high:
+            mid = (low + high) // 2
+            if tokens[mid].line < line:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _reparse(self, start, oldEnd, newEnd):
+        """ Re-parses the statements that saw tokens start to oldEnd, which
+        are now tokens start to newEnd."""
+        # Statements look at most one token past their end, so the one
+        # holding the token before the change has to be parsed again too
+        first = max(bisect.bisect_right(self.starts, start - 1) - 1, 0)
+        self._parseFrom(first, self.starts[first] if self.starts else 0,
+                        oldEnd, newEnd - oldEnd)
+
+    def _parseFrom(self, first, position, oldEnd, shift):
+        """ Parses statements from token position, replacing old statements
+        from index first on. Tokens before oldEnd changed and everything
+        after them moved by shift. Stops once the parser is past the changed
+        tokens and at the start of an old statement, which is reused along
+        with all of the ones after it. oldEnd of None parses everything."""
+        starts = self.starts
+        statements = self.statements
+        parser = Parser(self.tokens)
+        parser.current = position
+        parser.inloop = 0
+
+        newStarts = []
+        newStatements = []
+        resume = len(starts)
+        while not parser._isAtEnd():
+            if oldEnd is not None and position >= oldEnd + shift:
+                old = bisect.bisect_left(starts, position - shift, first)
+                if old < len(starts) and starts[old] == position - shift:
+                    resume = old
+                    break
+            newStarts.append(position)
+            newStatements.append(parser.declaration())
+            position = parser.current
+
+        if shift:
+            for index in range(resume, len(starts)):
+                starts[index] += shift
+        starts[first:resume] = newStarts
+        statements[first:resume] = newStatements
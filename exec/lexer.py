@@ -2,23 +2,107 @@
 Class that oversees the lexers and stores the tokens long term.
 
 """
+import io
 import sys
-from tree.scanner import Scanner
+from concurrent.futures import ProcessPoolExecutor
+from handling.error_reporting import Error, reportingTo
+from tree.scanner import Scanner, Token, TokenType, TOKEN_NAMES, streamTokens
+
+# Sources smaller than this are always scanned on one process, the cost of
+# starting workers is larger than the cost of scanning them
+PARALLEL_THRESHOLD = 1 << 20
+
 
 class Lexer(object):
 
-    def __init__(self, path_to_file=None):
+    def __init__(self, path_to_file=None, jobs=1):
+        """ jobs is the number of processes used to scan large files."""
         self.path = path_to_file
+        self.jobs = jobs
 
     def execute(self, source=None):
-        if self.path:
+        """ Scans the file, or source when it is given."""
+        if self.path and source is None:
             with open(self.path, 'r') as sourceFile:
                 sourcecode = sourceFile.read()
         else:
             sourcecode = source
 
-        scan = Scanner(sourcecode)
-        self.tokens = scan.scanTokens()
+        if self.jobs > 1 and len(sourcecode) >= PARALLEL_THRESHOLD:
+            self.tokens = scanParallel(sourcecode, self.jobs)
+        else:
+            scan = Scanner(sourcecode)
+            self.tokens = scan.scanTokens()
+
+    def stream(self, source=None):
+        """ Generator that yields tokens while the file is read in chunks,
+        so the whole file is never held in memory."""
+        if self.path:
+            with open(self.path, 'r') as sourceFile:
+                for token in streamTokens(sourceFile):
+                    yield token
+        else:
+            for token in streamTokens(io.StringIO(source)):
+                yield token
+
+
+def splitSource(source, count):
+    """ Splits source into about count chunks. Strings and comments
+    never span lines, so every newline is a safe place to cut. Returns a
+    list of (chunk, line the chunk starts on) pairs."""
+    size = max(len(source) // count, 1)
+    chunks = []
+    start = 0
+    line = 1
+    while start < len(source):
+        cut = source.find('\n', start + size)
+        if cut == -1:
+            cut = len(source)
+        else:
+            cut += 1
+        chunk = source[start:cut]
+        chunks.append((chunk, line))
+        line += chunk.count('\n')
+        start = cut
+    return chunks
+
+
+def _scanChunk(args):
+    """ Scans one chunk on a worker. Tokens are sent back as columns of
+    plain values, which are much cheaper to pickle than Token objects,
+    along with anything the scanner reported."""
+    chunk, line = args
+    scan = Scanner(chunk)
+    scan.line = line
+    reports = io.StringIO()
+    with reportingTo(reports):
+        scan._scanSource()
+    tokens = scan.tokenList
+    columns = ([token.kind for token in tokens],
+               [token.lexeme for token in tokens],
+               [token.literal for token in tokens],
+               [token.line for token in tokens])
+    return columns, reports.getvalue(), scan.line
+
+
+def scanParallel(source, jobs):
+    """ Scans source on a pool of jobs processes and returns the same token
+    list Scanner.scanTokens would. Errors are reported in source order once
+    every chunk has been scanned."""
+    types = [TokenType(name) for name in TOKEN_NAMES]
+    tokens = []
+    line = 1
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # A few chunks per worker keeps them busy when chunks scan unevenly
+        chunks = splitSource(source, jobs * 4)
+        for columns, reports, line in pool.map(_scanChunk, chunks):
+            if reports:
+                (Error.file or sys.stdout).write(reports)
+            kinds, lexemes, literals, lines = columns
+            tokens.extend(map(Token, map(types.__getitem__, kinds), lexemes,
+                              literals, lines))
+    tokens.append(Token(TokenType("EOF"), "", None, line))
+    return tokens
 
 
 # Should only be main program if testing lexer
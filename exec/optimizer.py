@@ -0,0 +1,223 @@
+"""
+Simplifies parsed statements before they run. Folds operators on constants
+into the constants they give, removes branches whose conditions are decided
+before anything runs and statements that can never run.
+"""
+from handling import exceptions
+from exec.resolver import variables
+from exec.syinterpreter import binary, isTruthy, unary
+from tree import scanner as tok
+from tree.expressions import Assign, Binary, Grouping, Literal, Logical, \
+    Unary
+from tree.stmt import Block, Break, Continue, If, Pass, StmtVisitor
+
+
+def declares(statement):
+    """ Returns True when a statement declares a variable in the scope it
+    is in, which resolves the variables of that scope differently even
+    when it never runs."""
+    return next(variables([statement]), None) is not None
+
+
+class Optimizer(StmtVisitor):
+    """ Returns every statement in its simplified form, changing the
+    statements and expressions it is given in place where it can.
+
+    Nothing that could fail at runtime is folded, an operator whose
+    constants give an error, such as a division by zero or the subtraction
+    of strings, is left to give that error when it runs. Statements that
+    declare variables are kept even when they can never run, as leaving
+    them out would change the scope their variables resolve to.
+    """
+
+    def optimize(self, statements):
+        """ Returns a simplified list of top level statements."""
+        return [self._statement(statement) for statement in statements]
+
+    def _statement(self, statement):
+        if statement is None:
+            return None
+        return self._stmtTable[statement.kind](statement)
+
+    # Functions for simplifying statements
+    def visitBreak(self, stmt):
+        return stmt
+
+    def visitContinue(self, stmt):
+        return stmt
+
+    def visitPass(self, stmt):
+        return stmt
+
+    def visitFor(self, stmt):
+        stmt.initializer = self._statement(stmt.initializer)
+        stmt.condition = self._expression(stmt.condition)
+        if stmt.increment is not None:
+            stmt.increment = self._expression(stmt.increment)
+        stmt.body = self._statement(stmt.body)
+        stmt.else_branch = self._statement(stmt.else_branch)
+        return stmt
+
+    def visitWhile(self, stmt):
+        stmt.condition = self._expression(stmt.condition)
+        stmt.body = self._statement(stmt.body)
+        return stmt
+
+    def visitDo(self, stmt):
+        stmt.body = self._statement(stmt.body)
+        stmt.condition = self._expression(stmt.condition)
+        return stmt
+
+    def visitUntil(self, stmt):
+        stmt.condition = self._expression(stmt.condition)
+        stmt.body = self._statement(stmt.body)
+        return stmt
+
+    def visitIf(self, stmt):
+        # The else if chain is flattened into one list of branches, by a
+        # loop so long chains do not run into the recursion limit
+        branches = []
+        while True:
+            branches.append((stmt.condition, stmt.then_branch))
+            for elseif in stmt.elseifs:
+                branches.append((elseif.condition, elseif.then_branch))
+            stmt = stmt.else_branch
+            if stmt.__class__ is not If:
+                break
+        else_branch = self._statement(stmt)
+        branches = [(self._expression(condition), self._statement(branch))
+                    for condition, branch in branches]
+
+        taken = []
+        dropped = []
+        last = else_branch
+        for index, (condition, branch) in enumerate(branches):
+            if condition.__class__ is not Literal:
+                taken.append((condition, branch))
+            elif isTruthy(condition.val):
+                # Nothing after this branch is ever reached
+                dropped.extend(other for _, other in branches[index + 1:])
+                dropped.append(else_branch)
+                last = branch
+                break
+            else:
+                dropped.append(branch)
+
+        if any(declares(branch) for branch in dropped if branch is not None):
+            taken = branches
+            last = else_branch
+        if not taken:
+            return last if last is not None else Pass(None)
+        condition, branch = taken[0]
+        return If(condition, branch,
+                  [If(other, then, [], None) for other, then in taken[1:]],
+                  last)
+
+    def visitVar(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer = self._expression(stmt.initializer)
+        return stmt
+
+    def visitBlock(self, stmt):
+        statements = []
+        ended = False
+        for statement in stmt.statements:
+            if ended:
+                # A break or continue skips the rest of the block
+                if declares(statement):
+                    statements.append(self._statement(statement))
+                continue
+            statement = self._statement(statement)
+            statements.append(statement)
+            ended = self._ends(statement)
+        stmt.statements = statements
+        return stmt
+
+    def _ends(self, statement):
+        """ Returns True when the statements after this one in its block
+        can never run."""
+        while statement.__class__ is Block:
+            if not statement.statements:
+                return False
+            statement = statement.statements[-1]
+        return statement.__class__ is Break or statement.__class__ is Continue
+
+    def visitExpression(self, stmt):
+        stmt.expression = self._expression(stmt.expression)
+        return stmt
+
+    def visitPrint(self, stmt):
+        stmt.expression = self._expression(stmt.expression)
+        return stmt
+
+    # Functions for simplifying expressions
+    def _expression(self, expr):
+        """ Returns the simplified form of an expression. Operands are
+        simplified before their operator with a stack of their own, as
+        expressions can be nested too deep for recursion."""
+        pending = [(expr, False)]
+        results = []
+        while pending:
+            expr, ready = pending.pop()
+            cls = expr.__class__
+            if not ready:
+                pending.append((expr, True))
+                if cls is Binary or cls is Logical:
+                    pending.append((expr.right, False))
+                    pending.append((expr.left, False))
+                elif cls is Grouping:
+                    pending.append((expr.expression, False))
+                elif cls is Unary:
+                    pending.append((expr.right, False))
+                elif cls is Assign:
+                    pending.append((expr.value, False))
+            elif cls is Binary:
+                expr.right = results.pop()
+                expr.left = results.pop()
+                results.append(self._binary(expr))
+            elif cls is Logical:
+                expr.right = results.pop()
+                expr.left = results.pop()
+                results.append(self._logical(expr))
+            elif cls is Unary:
+                expr.right = results.pop()
+                results.append(self._unary(expr))
+            elif cls is Assign:
+                expr.value = results.pop()
+                results.append(expr)
+            elif cls is not Grouping:
+                results.append(expr)
+            # A grouping is left as the expression inside of it
+        return results[0]
+
+    def _binary(self, expr):
+        left = expr.left
+        right = expr.right
+        if left.__class__ is not Literal or right.__class__ is not Literal:
+            return expr
+        try:
+            return Literal(binary(expr.operator, left.val, right.val))
+        except (exceptions.RuntimeException, ArithmeticError):
+            return expr
+
+    def _logical(self, expr):
+        left = expr.left
+        if left.__class__ is not Literal:
+            return expr
+        truthy = isTruthy(left.val)
+        if truthy == (expr.operator.kind == tok.OR):
+            # The right side is never evaluated
+            return Literal(truthy)
+        right = expr.right
+        if right.__class__ is not Literal:
+            return expr
+        return Literal(isTruthy(right.val))
+
+    def _unary(self, expr):
+        right = expr.right
+        if right.__class__ is not Literal:
+            return expr
+        try:
+            return Literal(unary(expr.operator, right.val))
+        except exceptions.RuntimeException:
+            return expr
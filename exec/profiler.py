@@ -0,0 +1,173 @@
+"""
+Records how often every statement of a script runs and how long it takes,
+to find the lines a slow script spends its time on.
+"""
+import time
+
+from exec.budget import firstToken
+from tree.stmt import BLOCK
+
+
+class Profiler(object):
+    """ Times every statement an interpreter runs, given to
+    Interpreter.profile. Statements are told apart by the statements they
+    run inside, so the time of a statement is known for every path it is
+    reached by, like the frames of a call stack.
+
+    The cumulative time of a statement includes the statements it runs,
+    its self time does not. Statements running inside a statement on the
+    same line, or of the same kind, only add their self time to the line,
+    or the kind, so no time is counted twice. The hits of a line are the
+    times it started running, those of a kind every statement of it that
+    ran. Blocks are on the line of the statement they belong to, where
+    their brace usually is.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.frames = {}  # Parent frame and statement to their frame
+        # Parent frame, statement, hits, cumulative and self time of every
+        # frame, the first frame is the script itself
+        self.parents = [None]
+        self.statements = [None]
+        self.hits = [0]
+        self.cumulative = [0.0]
+        self.own = [0.0]
+
+    def instrument(self, table):
+        """ Returns the dispatch table of statement visitors, with every
+        visitor timing the statements it runs."""
+        clock = self.clock
+        frames = self.frames
+        hits = self.hits
+        cumulative = self.cumulative
+        own = self.own
+        current = 0
+        inner = 0.0  # Time of the statements run by the current one
+
+        def wrap(visit):
+            def profiled(stmt):
+                nonlocal current, inner
+                parent = current
+                frame = frames.get((parent, stmt))
+                if frame is None:
+                    frame = self._newFrame(parent, stmt)
+                outer = inner
+                inner = 0.0
+                current = frame
+                start = clock()
+                try:
+                    visit(stmt)
+                finally:
+                    # Break and continue leave statements by raising
+                    elapsed = clock() - start
+                    hits[frame] += 1
+                    cumulative[frame] += elapsed
+                    own[frame] += elapsed - inner
+                    inner = outer + elapsed
+                    current = parent
+            return profiled
+        return tuple(wrap(visit) for visit in table)
+
+    def _newFrame(self, parent, stmt):
+        frame = len(self.parents)
+        self.frames[parent, stmt] = frame
+        self.parents.append(parent)
+        self.statements.append(stmt)
+        self.hits.append(0)
+        self.cumulative.append(0.0)
+        self.own.append(0.0)
+        return frame
+
+    def _lines(self):
+        """ Returns the line of the statement of every frame. Statements
+        without tokens, such as prints of literals, are on the line of the
+        statement they run inside, 0 at the top."""
+        lines = [0]
+        for frame in range(1, len(self.parents)):
+            parent = self.parents[frame]
+            stmt = self.statements[frame]
+            token = None
+            if stmt.kind != BLOCK or not parent:
+                token = firstToken(stmt)
+            lines.append(token.line if token is not None else lines[parent])
+        return lines
+
+    def _kinds(self):
+        return [None] + [stmt.__class__.__name__
+                         for stmt in self.statements[1:]]
+
+    def _totals(self, keys, nestedHits):
+        """ Returns the hits, cumulative and self time of every key, one for
+        each frame. Frames inside a frame with the same key only add their
+        hits when nestedHits is set, and never their cumulative time."""
+        totals = {}
+        outer = [frozenset()]  # Keys of the frames a frame is inside
+        for frame in range(1, len(self.parents)):
+            parent = self.parents[frame]
+            outer.append(outer[parent] | {keys[parent]})
+            key = keys[frame]
+            entry = totals.setdefault(key, [0, 0.0, 0.0])
+            if key not in outer[frame]:
+                entry[0] += self.hits[frame]
+                entry[1] += self.cumulative[frame]
+            elif nestedHits:
+                entry[0] += self.hits[frame]
+            entry[2] += self.own[frame]
+        return totals
+
+    def lines(self):
+        """ Returns the line, hits, cumulative and self time of every line
+        that ran, the most self time first."""
+        return self._sorted(self._totals(self._lines(), False))
+
+    def kinds(self):
+        """ Returns the kind, hits, cumulative and self time of every kind
+        of statement that ran, the most self time first."""
+        return self._sorted(self._totals(self._kinds(), True))
+
+    def _sorted(self, totals):
+        return sorted(((key,) + tuple(entry) for key, entry in totals.items()),
+                      key=lambda row: (-row[3], row[0]))
+
+    def total(self):
+        """ Returns the time spent running statements."""
+        return sum(self.cumulative[frame]
+                   for frame in range(1, len(self.parents))
+                   if self.parents[frame] == 0)
+
+    def report(self, file, source=None, limit=None):
+        """ Writes a table of the lines the most time was spent on, at most
+        limit of them, and one of the kinds of statements. source is the
+        text of the script, to show the lines."""
+        total = self.total() or 1.0
+        text = source.splitlines() if source is not None else []
+        print("Profile, %.3fs running statements" % self.total(), file=file)
+        print("%6s %10s %18s %18s  %s" % ("line", "hits", "cumulative",
+                                         "self", "source"), file=file)
+        for line, hits, cumulative, own in self.lines()[:limit]:
+            shown = text[line - 1].strip() if 0 < line <= len(text) else ""
+            print("%6s %10d %10.6fs %5.1f%% %10.6fs %5.1f%%  %s" % (
+                  line or "?", hits, cumulative, cumulative / total * 100,
+                  own, own / total * 100, shown[:40]), file=file)
+        print("%-10s %10s %18s %18s" % ("kind", "hits", "cumulative",
+                                        "self"), file=file)
+        for kind, hits, cumulative, own in self.kinds():
+            print("%-10s %10d %10.6fs %5.1f%% %10.6fs %5.1f%%" % (
+                  kind, hits, cumulative, cumulative / total * 100,
+                  own, own / total * 100), file=file)
+
+    def writeStacks(self, file, root="script"):
+        """ Writes the self time of every path to a statement in
+        microseconds, in the collapsed stack format of flame graph tools.
+        A frame is the kind of a statement and its line."""
+        lines = self._lines()
+        kinds = self._kinds()
+        names = [root]
+        for frame in range(1, len(self.parents)):
+            names.append("%s;%s:%d" % (names[self.parents[frame]],
+                                       kinds[frame], lines[frame]))
+        for frame in range(1, len(self.parents)):
+            micros = int(round(self.own[frame] * 1e6))
+            if micros:
+                file.write("%s %d\n" % (names[frame], micros))
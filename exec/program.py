@@ -0,0 +1,133 @@
+"""
+Compiles a script once into a program for applications embedding Sython,
+which runs it over and over with different values for its global
+variables. A program never changes once compiled, so any number of threads
+can run it at the same time.
+"""
+import io
+
+from exec.optimizer import Optimizer
+from exec.syinterpreter import Interpreter
+from exec.syparser import Parser
+from handling import exceptions
+from handling.environment import Environment
+from handling.error_reporting import reportingTo
+from tree.expressions import Literal
+from tree.scanner import KEYWORDS, Scanner, Token, TokenType
+from tree.stmt import Var
+
+# Values the declarations of parameters are checked with, which have the
+# class every value bound to them is converted to
+SAMPLES = {"num": 0.0, "str": "", "bool": False}
+
+
+def compile(source, parameters=None):
+    """ Returns the Program of the Sython source. parameters is a dictionary
+    of the names of global variables the script reads without declaring
+    them to their type, "num", "str" or "bool". Every run is given a value
+    for each of them. Raises a ParserException with the errors reported
+    when the script has any."""
+    parameters = dict(parameters or {})
+    for name, vtype in parameters.items():
+        if not name.isidentifier() or name in KEYWORDS:
+            raise ValueError("Not a variable name: %r" % name)
+        if vtype not in SAMPLES:
+            raise ValueError("Type of %s is not num, str or bool: %r" %
+                             (name, vtype))
+
+    reports = io.StringIO()
+    with reportingTo(reports):
+        statements = Parser(Scanner(source).scanTokens()).parse()
+        if statements is None or None in statements or reports.getvalue():
+            raise exceptions.ParserException(reports.getvalue().rstrip())
+        statements = Optimizer().optimize(statements)
+
+        # Parameters are declared the way the shell keeps the variables of
+        # earlier lines, by checking declarations that never run
+        interpreter = Interpreter()
+        declarations = [Var(Token(TokenType("IDENTIFIER"), name, None, 0),
+                            _typeToken(vtype),
+                            Literal(SAMPLES[vtype]))
+                        for name, vtype in parameters.items()]
+        checker = interpreter.checker
+        if not checker.check(declarations) or not checker.check(statements):
+            raise exceptions.ParserException(reports.getvalue().rstrip())
+    names = interpreter.resolver.globals
+    # Temporaries the hoister declares are not variables of the script
+    variables = dict(names)
+    interpreter.hoister.hoist(statements)
+    slots = tuple((statement.slot, statement.vtype, statement.type,
+                   statement.name.lexeme) for statement in declarations)
+    return Program(statements, names, variables, slots)
+
+
+def _typeToken(vtype):
+    return Token(TokenType(vtype.upper()), vtype, None, 0)
+
+
+class Program(object):
+    """ Checked statements of a script, ready to run on the tree walking
+    interpreter. Nothing changes them while they run, so one program can be
+    run by many threads at once. Every run has an interpreter and global
+    environment of its own."""
+
+    __slots__ = ("statements", "names", "variables", "parameters")
+
+    def __init__(self, statements, names, variables, parameters):
+        object.__setattr__(self, "statements", tuple(statements))
+        object.__setattr__(self, "names", dict(names))
+        object.__setattr__(self, "variables", dict(variables))
+        # Slot, type name, type token and name of every parameter
+        object.__setattr__(self, "parameters", parameters)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Programs can not be changed")
+
+    def run(self, bindings=None, steps=None, seconds=None):
+        """ Runs the program with its parameters bound to the values of
+        bindings, a dictionary of their names to values. Returns what it
+        printed and a dictionary of its global variables to the values
+        they ended with. Raises a TypeError when bindings do not match the
+        parameters, and a RuntimeException when the script fails, a
+        BudgetExceeded when it takes more steps or seconds than given."""
+        bindings = dict(bindings or {})
+        environment = Environment(None, self.names)
+        for slot, vtype, typetok, name in self.parameters:
+            if name not in bindings:
+                raise TypeError("No value for parameter %s" % name)
+            environment.define(slot, vtype, typetok,
+                               _convert(name, vtype, bindings.pop(name)),
+                               True)
+        if bindings:
+            raise TypeError("Not a parameter: %s" % ", ".join(sorted(
+                bindings)))
+
+        interpreter = Interpreter()
+        interpreter.environment = environment
+        interpreter.output = io.StringIO()
+        if steps is not None or seconds is not None:
+            interpreter.limit(steps, seconds)
+            interpreter.startBudget()
+        for statement in self.statements:
+            interpreter.execute(statement)
+
+        values = environment.values
+        types = environment.types
+        variables = dict((name, values[slot])
+                         for name, slot in self.variables.items()
+                         if types[slot] is not None)
+        return interpreter.output.getvalue(), variables
+
+
+def _convert(name, vtype, value):
+    """ Returns the value of a parameter the way Sython holds it, numbers
+    are floats."""
+    if vtype == "num":
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    elif vtype == "str":
+        if isinstance(value, str):
+            return value
+    elif isinstance(value, bool):
+        return value
+    raise TypeError("Parameter %s is a %s, got %r" % (name, vtype, value))
@@ -0,0 +1,214 @@
+"""
+Resolves every variable to the scope declaring it before statements run,
+so environments find variables by their slot instead of by name.
+"""
+from handling.error_reporting import Error
+from tree.expressions import Assign, Binary, Grouping, Logical, Unary, \
+    Variable
+from tree.stmt import If, StmtVisitor
+from tree import stmt
+
+
+def declarations(statements, names=None):
+    """ Returns a dictionary of the names declared by statements to a slot
+    for each. Blocks declare their variables in their own scope, so the
+    statements inside of them are left out."""
+    if names is None:
+        names = {}
+    for statement in variables(statements):
+        names.setdefault(statement.name.lexeme, len(names))
+    return names
+
+
+def variables(statements):
+    """ Yields the declarations among statements that declare their
+    variable in the scope of the statements themselves."""
+    pending = list(reversed(statements))
+    while pending:
+        statement = pending.pop()
+        if statement is None:
+            continue
+        kind = statement.kind
+        if kind == stmt.VAR:
+            yield statement
+        elif kind == stmt.IF:
+            pending.append(statement.then_branch)
+            pending.extend(elseif.then_branch for elseif in statement.elseifs)
+            if statement.else_branch is not None:
+                pending.append(statement.else_branch)
+        elif kind in (stmt.WHILE, stmt.UNTIL, stmt.DO):
+            pending.append(statement.body)
+        elif kind == stmt.FOR:
+            pending.append(statement.body)
+            if statement.else_branch is not None:
+                pending.append(statement.else_branch)
+
+
+class Resolver(StmtVisitor):
+    """ Binds every variable and assignment to a depth, the number of
+    scopes between it and the scope declaring it, and to its slot in that
+    scope. Blocks get the names their environment has slots for, blocks
+    that declare nothing are not counted as scopes. Declarations get the
+    slot and the lowercase type name of the variable they define, and loops
+    get whether a break or continue of their own is in their body.
+
+    A scope declares every variable a statement directly in it declares,
+    so a variable is bound to the innermost scope declaring it even where
+    that declaration has not run yet. Environments look further out for
+    variables that are not defined yet, like they used to look for every
+    variable by name. Variables no scope declares could never be found,
+    they are reported before anything runs. Nothing runs either when a
+    statement in a block failed to parse, the parser reported it.
+    """
+
+    def __init__(self):
+        StmtVisitor.__init__(self)
+        self.globals = {}  # Top level names to slots, kept between calls
+        self.scopes = [self.globals]
+        self.loops = []  # Loops the current statement is in
+        self.undefined = []
+        self.unparsed = False  # Whether a statement in a block failed to parse
+
+    def resolve(self, statements):
+        """ Resolves a list of top level statements. Returns False when
+        they use variables no scope declares, after reporting them, or
+        hold statements that failed to parse, and forgets the top level
+        variables they declare."""
+        known = len(self.globals)
+        self.scopes = [self.globals]
+        self.loops = []
+        self.undefined = []
+        self.unparsed = False
+        declarations(statements, self.globals)
+        for statement in statements:
+            self._statement(statement)
+        if self.unparsed:
+            self.forget(known)
+            return False
+        if not self.undefined:
+            return True
+
+        for name in self.undefined:
+            Error().error(name, "Undefined variable")
+        self.forget(known)
+        return False
+
+    def forget(self, known):
+        """ Forgets the top level variables declared after the first known
+        ones, by statements that are not going to run."""
+        for name, slot in list(self.globals.items()):
+            if slot >= known:
+                del self.globals[name]
+
+    def _statement(self, statement):
+        if statement is not None:
+            self._stmtTable[statement.kind](statement)
+
+    # Functions for resolving statements
+    def visitBreak(self, stmt):
+        self.loops[-1].jumps = True
+
+    def visitContinue(self, stmt):
+        self.loops[-1].jumps = True
+
+    def visitPass(self, stmt):
+        pass
+
+    def visitFor(self, stmt):
+        self._statement(stmt.initializer)
+        self._expression(stmt.condition)
+        if stmt.increment is not None:
+            self._expression(stmt.increment)
+        self._body(stmt)
+        # The else branch is not part of the loop, a break in it leaves
+        # the loop around the for loop
+        self._statement(stmt.else_branch)
+
+    def visitWhile(self, stmt):
+        self._expression(stmt.condition)
+        self._body(stmt)
+
+    def visitDo(self, stmt):
+        self._body(stmt)
+        self._expression(stmt.condition)
+
+    def visitUntil(self, stmt):
+        self._expression(stmt.condition)
+        self._body(stmt)
+
+    def _body(self, loop):
+        loop.jumps = False
+        self.loops.append(loop)
+        self._statement(loop.body)
+        self.loops.pop()
+
+    def visitIf(self, stmt):
+        # Else if chains are resolved by this loop, like they are run
+        while True:
+            self._expression(stmt.condition)
+            self._statement(stmt.then_branch)
+            for elseif in stmt.elseifs:
+                self._expression(elseif.condition)
+                self._statement(elseif.then_branch)
+            stmt = stmt.else_branch
+            if stmt.__class__ is not If:
+                self._statement(stmt)
+                return
+
+    def visitVar(self, stmt):
+        if stmt.initializer is not None:
+            self._expression(stmt.initializer)
+        stmt.slot = self.scopes[-1][stmt.name.lexeme]
+        stmt.vtype = str(stmt.type.type).lower()
+
+    def visitBlock(self, stmt):
+        stmt.names = declarations(stmt.statements)
+        # A block declaring nothing is no scope, it runs in the environment
+        # of the statements around it
+        if stmt.names:
+            self.scopes.append(stmt.names)
+        for statement in stmt.statements:
+            if statement is None:
+                self.unparsed = True
+            self._statement(statement)
+        if stmt.names:
+            self.scopes.pop()
+
+    def visitExpression(self, stmt):
+        self._expression(stmt.expression)
+
+    def visitPrint(self, stmt):
+        self._expression(stmt.expression)
+
+    # Functions for resolving expressions
+    def _expression(self, expr):
+        """ Resolves the variables of an expression, in the order they
+        appear in. Kept off the call stack, as expressions can be nested
+        too deep for recursion."""
+        pending = [expr]
+        while pending:
+            expr = pending.pop()
+            cls = expr.__class__
+            if cls is Variable:
+                self._bind(expr)
+            elif cls is Assign:
+                self._bind(expr)
+                pending.append(expr.value)
+            elif cls is Binary or cls is Logical:
+                pending.append(expr.right)
+                pending.append(expr.left)
+            elif cls is Grouping:
+                pending.append(expr.expression)
+            elif cls is Unary:
+                pending.append(expr.right)
+
+    def _bind(self, expr):
+        name = expr.name.lexeme
+        scopes = self.scopes
+        for depth in range(len(scopes)):
+            slot = scopes[-1 - depth].get(name)
+            if slot is not None:
+                expr.depth = depth
+                expr.slot = slot
+                return
+        self.undefined.append(expr.name)
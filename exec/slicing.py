@@ -0,0 +1,100 @@
+"""
+Runs work that can not be written as a coroutine, such as walking the tree
+of a script, in slices of time on an asyncio event loop, so a long script
+does not keep other tasks of the loop from running.
+"""
+import asyncio
+import threading
+import time
+
+# Steps of work between calls to checkpoint, reading the clock costs more
+# than a small step does
+CHECK_EVERY = 100
+
+
+class Cancelled(BaseException):
+    """ Raised at the checkpoint a function is paused at when the task
+    running it is cancelled. Not an Exception, so nothing catching those
+    keeps it from unwinding the function."""
+
+
+class Slices(object):
+    """ Runs a function one slice at a time on a thread of its own, which
+    holds the stack of the function while it is paused, so every function
+    running takes an OS thread. The event loop goes on with its other
+    tasks while a slice runs, and gives the function its next slice once
+    it gets to it. Python switches between threads every
+    sys.getswitchinterval() seconds, 5ms unless changed, so other tasks
+    wait about that long for every function running on the loop.
+
+    The function has to call checkpoint often, about every CHECK_EVERY
+    steps of its work, which pauses it once its slice is over.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = 0.0
+        self.turn = threading.Event()  # Set when the function may run
+        self.cancelled = False
+        self.loop = None
+        self.paused = None  # Future of the loop done when a slice ends
+
+    def checkpoint(self):
+        """ Pauses the function when its slice is over, until its next
+        slice. Called on the thread of the function."""
+        if time.perf_counter() < self.deadline:
+            return
+        self._pause()
+        self._wait()
+
+    def _pause(self):
+        self.loop.call_soon_threadsafe(_done, self.paused)
+
+    def _wait(self):
+        self.turn.wait()
+        self.turn.clear()
+        if self.cancelled:
+            raise Cancelled
+        self.deadline = time.perf_counter() + self.seconds
+
+    async def run(self, function, *args):
+        """ Returns the value of function called with args, or raises the
+        exception it raised."""
+        self.loop = asyncio.get_running_loop()
+        outcome = []
+
+        def main():
+            try:
+                self._wait()
+                outcome.append((True, function(*args)))
+            except BaseException as error:
+                outcome.append((False, error))
+            finally:
+                self._pause()
+
+        thread = threading.Thread(target=main, daemon=True)
+        thread.start()
+        try:
+            while True:
+                self.paused = self.loop.create_future()
+                self.turn.set()
+                await self.paused
+                if outcome:
+                    break
+        except BaseException:
+            # Cancelled, the function unwinds from the checkpoint it is
+            # paused at or gets to next
+            self.cancelled = True
+            self.turn.set()
+            thread.join()
+            raise
+        thread.join()
+        finished, value = outcome[0]
+        if finished:
+            return value
+        raise value
+
+
+def _done(future):
+    if not future.done():
+        future.set_result(None)
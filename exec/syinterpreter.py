@@ -4,14 +4,166 @@ Implements the runtime world.
 """
 from handling import exceptions
 from handling.error_reporting import Error
+from exec.budget import Budget
+from exec.checker import FLOAT_OPERATORS, TypeChecker
+from exec.hoister import Hoister
+from exec.resolver import Resolver
 from handling.environment import Environment
+from tree.expressions import Binary, ExpressionVisitor, Grouping, Literal, \
+    Logical, Unary, Variable
+from tree import scanner as tok
+from tree.stmt import If, StmtVisitor
+
+# Functions below give values their meaning at runtime. They are shared by
+# every engine that runs Sython, so all of them behave the same way.
+
+
+def isTruthy(val):
+    # All nonzero, nonnull values are true, empty strings are false
+    if val == None:
+        return False
+    if val == 0:
+        return False
+    if isinstance(val, bool):
+        return val
+    if isinstance(val, str):
+        if val == "":
+            return False
+    return True
+
 
-class Interpreter(object):
+def isEqual(left, right):
+    if left == None and right == None:
+        return True
+    if left == None:
+        return False
+
+    return left == right
+
+
+def checkNumberOperand(op, operand):
+    if isinstance(operand, float):
+        return
+    raise exceptions.RuntimeException("Operand must be a number!", op)
+
+
+def checkNumbersOperand(op, operand1, operand2):
+    if isinstance(operand1, float) and isinstance(operand2, float):
+        return
+    raise exceptions.RuntimeException("Operands must be numbers!", op)
+
+
+def stringify(x):
+    if x is None:
+        return "nil"
+    if isinstance(x, int):
+        return x
+    if isinstance(x, float):
+        text = str(x)
+        if text[len(text)-2: len(text)] == ".0":
+            return text[0:len(text)-2]
+    if x is True:
+        return "true"
+    if x is False:
+        return "false"
+    return str(x)  # rely on object __str__ method
+
+
+def unary(operator, right):
+    """ Performs a unary operation on an evaluated operand."""
+    if operator.kind == tok.MINUS:
+        checkNumberOperand(operator, right)
+        return -1 * float(right)
+    if operator.kind == tok.BANG:
+        return not isTruthy(right)
+
+    # Could not reach end
+    return None
+
+
+def binary(operator, left, right):
+    """ Performs a binary operation on evaluated operands."""
+    op = operator.kind
+    if left.__class__ is float and right.__class__ is float:
+        return FLOAT_OPERATORS[op](left, right)
+
+    # Math operator
+    if op == tok.MINUS:
+        checkNumbersOperand(operator, left, right)
+        return float(left) - float(right)
+    if op == tok.PLUS:
+        if isinstance(right, str) and isinstance(left, str):
+            return str(left) + str(right)
+        if isinstance(right, float) and isinstance(left, float):
+            return float(left) + float(right)
+        raise exceptions.RuntimeException("Operands must be two numbers"
+                                          " or two strings", operator)
+    if op == tok.STAR:
+        checkNumbersOperand(operator, left, right)
+        return float(left) * float(right)
+    if op == tok.SLASH:
+        checkNumbersOperand(operator, left, right)
+        return float(left) / float(right)
+
+    # Comparison operator
+    if op == tok.GREATER:
+        checkNumbersOperand(operator, left, right)
+        return float(left) > float(right)
+    if op == tok.GREATER_EQUAL:
+        checkNumbersOperand(operator, left, right)
+        return float(left) >= float(right)
+    if op == tok.LESS:
+        checkNumbersOperand(operator, left, right)
+        return float(left) < float(right)
+    if op == tok.LESS_EQUAL:
+        checkNumbersOperand(operator, left, right)
+        return float(left) <= float(right)
+
+    # Equality operators
+    if op == tok.BANG_EQUAL:
+        return not isEqual(left, right)
+    if op == tok.EQUAL_EQUAL:
+        return isEqual(left, right)
+
+
+# Operators nested deeper than this are evaluated without recursion
+MAX_DEPTH = 100
+
+# Marks an operator on the evaluation stack whose left side is still
+# being evaluated
+_LEFT = object()
+
+
+class _BreakLoop(Exception):
+    """ Raised by a break statement, caught by the loop it leaves."""
+
+
+class _ContinueLoop(Exception):
+    """ Raised by a continue statement, caught by the loop it goes back
+    to."""
+
+
+class Interpreter(ExpressionVisitor, StmtVisitor):
 
     def __init__(self):
-        self.environment = Environment()
-        self.breaking = False
-        self.continueing = False
+        ExpressionVisitor.__init__(self)
+        StmtVisitor.__init__(self)
+        self.resolver = Resolver()
+        self.checker = TypeChecker(self.resolver)
+        self.hoister = Hoister(self.resolver)
+        self.environment = Environment(None, self.resolver.globals)
+        # Environments of blocks that are not running, by their number of
+        # slots
+        self.environments = {}
+        self.output = None  # File print statements write to, stdout if None
+        self.budget = None  # Budget limiting every run, set with limit
+        self.profiler = None  # Profiler timing every run, set with profile
+
+    # Runtime semantics are shared with the other execution engines
+    _isTruthy = staticmethod(isTruthy)
+    _binary = staticmethod(binary)
+    _unary = staticmethod(unary)
+    _stringify = staticmethod(stringify)
 
     def interpret(self, statements):
         """ For each statement given to us by the parser
@@ -20,6 +172,13 @@ class Interpreter(object):
         # there was a parser error. So dont run anything.
         if None in statements:
             return
+        # Nothing runs when there are variables that are never declared,
+        # or operations that can only fail
+        if not self.checker.check(statements):
+            return
+        self.hoister.hoist(statements)
+        self.environment.extend()
+        self.startBudget()
 
         try:
             for statement in statements:
@@ -27,9 +186,173 @@ class Interpreter(object):
         except exceptions.RuntimeException as eee:
             Error().runtimeError(eee)
 
+    def interpretStream(self, statements):
+        """ Executes statements as they arrive from an iterable, such as
+        Parser.statements. Once a statement fails to parse nothing else
+        is executed, but the rest is still parsed to report its errors."""
+        statements = iter(statements)
+        self.startBudget()
+        try:
+            for statement in statements:
+                if statement is None:
+                    break
+                if not self.checker.check([statement]):
+                    break
+                unit = [statement]
+                self.hoister.hoist(unit)
+                self.environment.extend()
+                for statement in unit:
+                    self.execute(statement)
+        except exceptions.RuntimeException as eee:
+            Error().runtimeError(eee)
+            return
+
+        for statement in statements:
+            pass
+
+    async def interpretAsync(self, statements, slice_ms=5):
+        """ Runs statements like interpret, from a coroutine, on a thread of
+        their own that pauses every slice_ms milliseconds until the event
+        loop gives them their next slice, so many scripts can run on one
+        loop. Statements, and with them the body of every loop, run through
+        execute, where the script is paused."""
+        from exec import slicing
+        slices = slicing.Slices(slice_ms / 1000.0)
+        table = self._stmtTable
+        checkpoint = slices.checkpoint
+        countdown = slicing.CHECK_EVERY
+
+        def execute(stmt):
+            nonlocal countdown
+            countdown -= 1
+            if not countdown:
+                countdown = slicing.CHECK_EVERY
+                checkpoint()
+            table[stmt.kind](stmt)
+        # Only this run pays for the checkpoints
+        self.execute = self._runBody = execute
+        try:
+            await slices.run(self.interpret, statements)
+        finally:
+            self._restore("execute", "_runBody")
+
+    def _restore(self, *names):
+        """ Goes back to the methods of the class for functions replaced on
+        this instance. Reading __dict__ instead would make Python keep the
+        attributes of the instance in a dictionary, which is slower to look
+        them up in."""
+        for name in names:
+            try:
+                delattr(self, name)
+            except AttributeError:
+                pass
+
+    def limit(self, steps=None, seconds=None, memory=None):
+        """ Limits every later run to a number of steps, passes through the
+        body of a loop or entries into blocks, and to a number of seconds,
+        and the strings of every run to a number of characters. A run going
+        over any of them is stopped with a BudgetExceeded. Without any of
+        them runs are not limited. Statements are checked for the memory
+        limit, it has to be set before the statements it limits are
+        given."""
+        self._restore("_runBody", "_enterBlock", "_binary")
+        # Concatenations applied directly account for their strings too
+        self.checker.concatenation = None if memory is None else \
+            self._concatenation
+        if steps is None and seconds is None and memory is None:
+            self.budget = None
+        else:
+            self.budget = Budget(steps, seconds, memory)
+
+    def startBudget(self):
+        """ Starts the budget over for a new run. The steps are counted by
+        the functions loops run their body with and blocks are entered
+        with, and strings by the function binary operations are performed
+        with. They are only replaced while there is a budget, so runs
+        without one pay nothing for it."""
+        budget = self.budget
+        if budget is None:
+            return
+        left = budget.start()
+        if budget.memory is not None:
+            self._binary = self._meteredBinary(budget)
+        if budget.steps is None and budget.seconds is None:
+            return
+        check = budget.check
+        execute = self.execute
+        executeBlock = self.executeBlock
+
+        def runBody(stmt):
+            nonlocal left
+            left -= 1
+            if not left:
+                left = check(stmt)
+            execute(stmt)
+
+        def enterBlock(statements, environment):
+            nonlocal left
+            left -= 1
+            if not left:
+                left = check(statements)
+            executeBlock(statements, environment)
+        self._runBody = runBody
+        self._enterBlock = enterBlock
+
+    def profile(self, profiler=None):
+        """ Times every statement of later runs with profiler, a Profiler,
+        or stops timing them when it is None. Only the dispatch table of
+        statements changes, so runs without a profiler pay nothing for
+        it."""
+        self.profiler = profiler
+        table = tuple(getattr(self, name) for name in self._stmtVisits)
+        if profiler is not None:
+            table = profiler.instrument(table)
+        self._stmtTable = table
+
+    def _measure(self):
+        """ Returns the characters the strings of variables take. Only the
+        blocks that are running hold values, their environments lead up
+        to the top level."""
+        size = 0
+        environment = self.environment
+        while environment is not None:
+            for value in environment.values:
+                if value.__class__ is str:
+                    size += len(value)
+            environment = environment.scopeAbove
+        return size
+
+    def _meteredBinary(self, budget):
+        """ Returns binary accounting for the strings it concatenates."""
+        charge = budget.charge
+        measure = self._measure
+        PLUS = tok.PLUS
+
+        def meteredBinary(operator, left, right):
+            if left.__class__ is str and right.__class__ is str and \
+                    operator.kind == PLUS:
+                charge(len(left) + len(right), operator, measure)
+                return left + right
+            return binary(operator, left, right)
+        return meteredBinary
+
+    def _concatenation(self, operator):
+        """ Returns the function the type checker gives + on two strings
+        while there is a memory budget. It accounts for the string it makes
+        with the budget of the run, when it has one, so concatenations are
+        still applied directly and hoisted out of loops."""
+        measure = self._measure
+
+        def concatenate(left, right):
+            budget = self.budget
+            if budget is not None and budget.memory is not None:
+                budget.charge(len(left) + len(right), operator, measure)
+            return left + right
+        return concatenate
+
     def execute(self, stmt):
         """ Begin visitor pattern to evaluate the subexpressions."""
-        stmt.accept(self)
+        self._stmtTable[stmt.kind](stmt)
 
     def executeBlock(self, statements, environment):
         # Save previous env
@@ -39,10 +362,6 @@ class Interpreter(object):
             # Set env for this block
             self.environment = environment
             for statement in statements:
-                if self.breaking:
-                    break
-                if self.continueing:
-                    break
                 self.execute(statement)
         except exceptions.RuntimeException as eee:
             # Reraise as it will be caught in interpret method
@@ -51,71 +370,111 @@ class Interpreter(object):
             # Restore previous env
             self.environment = previous_env
 
+    # Loops run their body and blocks are entered through these, which
+    # count the steps of a run while it has a budget
+    _runBody = execute
+    _enterBlock = executeBlock
+
     # Functions for visiting statements
     def visitBreak(self, stmt):
-        self.breaking = True
+        raise _BreakLoop
 
     def visitContinue(self, stmt):
-        self.continueing = True
+        raise _ContinueLoop
 
     def visitPass(self, stmt):
         pass
 
+    # Loops whose body has no break or continue of its own run without
+    # catching them, only loops that have them pay for it
     def visitFor(self, stmt):
         if stmt.initializer:
             self.execute(stmt.initializer)
-        while self._isTruthy(self._evaluate(stmt.condition))\
-                and not self.breaking:
-            self.execute(stmt.body)
-            self.execute(stmt.increment)
-        self.breaking = False
-        self.continueing = False
-        # TODO: Implement else clause, will need break clause as well
+        condition = stmt.condition
+        increment = stmt.increment
+        if not stmt.jumps:
+            while self._isTruthy(self._evaluate(condition)):
+                self._runBody(stmt.body)
+                if increment is not None:
+                    self._evaluate(increment)
+        else:
+            while self._isTruthy(self._evaluate(condition)):
+                try:
+                    self._runBody(stmt.body)
+                except _ContinueLoop:
+                    pass
+                except _BreakLoop:
+                    # Leaves the else branch out too
+                    return
+                if increment is not None:
+                    self._evaluate(increment)
+        if stmt.else_branch is not None:
+            self.execute(stmt.else_branch)
 
     def visitWhile(self, stmt):
-        while self._isTruthy(self._evaluate(stmt.condition)) \
-                and not self.breaking:
-            self.execute(stmt.body)
-            self.continueing = False
-        self.breaking = False
+        if not stmt.jumps:
+            while self._isTruthy(self._evaluate(stmt.condition)):
+                self._runBody(stmt.body)
+            return
+        while self._isTruthy(self._evaluate(stmt.condition)):
+            try:
+                self._runBody(stmt.body)
+            except _ContinueLoop:
+                pass
+            except _BreakLoop:
+                return
 
     def visitDo(self, stmt):
-        # Execute the block at least once
-        self.execute(stmt.body)
-
-        # If this is a do-while loop
-        if stmt.condition_type == "while":
-            while self._isTruthy(self._evaluate(stmt.condition)) \
-                    and not self.breaking:
-                self.execute(stmt.body)
-        # If this is a do-until loop
-        else:
-            while not self._isTruthy(self._evaluate(stmt.condition)) \
-                    and not self.breaking:
-                self.execute(stmt.body)
-        self.breaking = False
-        self.continueing = False
+        # The body runs at least once, then again while the condition is
+        # true for a do-while loop or until it is for a do-until loop
+        until = stmt.condition_type != "while"
+        if not stmt.jumps:
+            self._runBody(stmt.body)
+            while self._isTruthy(self._evaluate(stmt.condition)) != until:
+                self._runBody(stmt.body)
+            return
+        while True:
+            try:
+                self._runBody(stmt.body)
+            except _ContinueLoop:
+                pass
+            except _BreakLoop:
+                return
+            if self._isTruthy(self._evaluate(stmt.condition)) == until:
+                return
 
     def visitUntil(self, stmt):
-        while not self._isTruthy(self._evaluate(stmt.condition)) \
-                and not self.breaking:
-            self.execute(stmt.body)
-        self.breaking = False
-        self.continueing = False
+        if not stmt.jumps:
+            while not self._isTruthy(self._evaluate(stmt.condition)):
+                self._runBody(stmt.body)
+            return
+        while not self._isTruthy(self._evaluate(stmt.condition)):
+            try:
+                self._runBody(stmt.body)
+            except _ContinueLoop:
+                pass
+            except _BreakLoop:
+                return
 
     def visitIf(self, stmt):
-        if self._isTruthy(self._evaluate(stmt.condition)):
-            self.execute(stmt.then_branch)
-        else:
+        # An else branch that is another if statement is run by this loop,
+        # so long else if chains do not run into the recursion limit
+        while True:
+            if self._isTruthy(self._evaluate(stmt.condition)):
+                self.execute(stmt.then_branch)
+                return
             # Execute elseif branches if there are any
             for elseif in stmt.elseifs:
                 if self._isTruthy(self._evaluate(elseif.condition)):
                     self.execute(elseif.then_branch)
-                    # Break so we dont execute any other elseif block
-                    break
-            else:
-                if stmt.else_branch is not None:
-                    self.execute(stmt.else_branch)
+                    # Return so we dont execute any other elseif block
+                    return
+            stmt = stmt.else_branch
+            if stmt is None:
+                return
+            if stmt.__class__ is not If:
+                self.execute(stmt)
+                return
 
     def visitVar(self, stmt):
         """ Evaluate visitor statement by putting
@@ -123,11 +482,31 @@ class Interpreter(object):
         value = None
         if stmt.initializer is not None:
             value = self._evaluate(stmt.initializer)
-        self.environment.define(stmt.name.lexeme, stmt.type, value)
+        self.environment.define(stmt.slot, stmt.vtype, stmt.type, value,
+                                stmt.safe)
 
     def visitBlock(self, stmt):
         """ Execute statements in block."""
-        self.executeBlock(stmt.statements, Environment(self.environment))
+        if not stmt.names:
+            # Nothing is declared, no environment is needed
+            self._enterBlock(stmt.statements, self.environment)
+            return
+        # Environments are taken from the ones blocks with as many slots
+        # gave back, so there are never more than blocks running at once
+        names = stmt.names
+        free = self.environments.get(len(names))
+        if free is None:
+            free = self.environments[len(names)] = []
+        if free:
+            environment = free.pop()
+            environment.reuse(self.environment, names)
+        else:
+            environment = Environment(self.environment, names)
+        try:
+            self._enterBlock(stmt.statements, environment)
+        finally:
+            environment.clear()
+            free.append(environment)
 
     def visitExpression(self, stmt):
         """ Return the value of the evaluated expression."""
@@ -136,17 +515,18 @@ class Interpreter(object):
     def visitPrint(self, stmt):
         """ Evaluate the expression and print the result."""
         value = self._evaluate(stmt.expression)
-        print(self._stringify(value))
+        print(self._stringify(value), file=self.output)
 
     # Functions for visiting expressions
     def visitVariable(self, expr):
         """ Return the value of the variable the
         expression is referencing."""
-        return self.environment.get(expr.name)
+        return self.environment.get(expr.name, expr.depth, expr.slot)
 
     def visitAssign(self, expr):
         value = self._evaluate(expr.value)
-        self.environment.assign(expr.name, value)
+        self.environment.assign(expr.name, value, expr.depth, expr.slot,
+                                expr.safe)
         return value
 
     def visitLiteral(self, expr):
@@ -154,136 +534,120 @@ class Interpreter(object):
         return expr.val
 
     def visitLogical(self, expr):
-        left = self._evaluate(expr.left)
-
-        if str(expr.operator.type) == "OR":
-            if self._isTruthy(left):
-                # We are in an or statement and the left is true
-                # so short circuit
-                return True
-            elif self._isTruthy(self._evaluate(expr.right)):
-                return True
-            else:
-                return False
-        else:
-            if not self._isTruthy(left):
-                # We are in an and statement and the left is false
-                # so we can short circuit
-                return False
-            if self._isTruthy(self._evaluate(expr.right)):
-                return True
-            else:
-                return False
+        return self._evaluate(expr)
 
     def visitGrouping(self, expr):
         """ Evauluate expression in the parens."""
-        return self._evaluate(expr.expression)
+        return self._evaluate(expr)
 
     def visitUnary(self, expr):
         """ Evaluate the expression on the right of the unary op."""
-        right = self._evaluate(expr.right)
-
-        if str(expr.operator.type) == "MINUS":
-            self._checkNumberOperand(expr.operator, right)
-            return -1 * float(right)
-        if str(expr.operator.type) == "BANG":
-            return not self._isTruthy(right)
-
-        # Could not reach end
-        return None
+        return self._evaluate(expr)
 
     def visitBinary(self, expr):
         """ Evaluate the expressions on the left and right of
         the operator, then perform the operation on them."""
-        left = self._evaluate(expr.left)
-        right = self._evaluate(expr.right)
-        op = str(expr.operator.type)
-
-        # Math operator
-        if op == "MINUS":
-            self._checkNumbersOperand(expr.operator, left, right)
-            return float(left) - float(right)
-        if op == "PLUS":
-            if isinstance(right, str) and isinstance(left, str):
-                return str(left) + str(right)
-            if isinstance(right, float) and isinstance(left, float):
-                return float(left) + float(right)
-            raise exceptions.RuntimeException("Operands must be two numbers"
-                                              " or two strings", expr.operator)
-        if op == "STAR":
-            self._checkNumbersOperand(expr.operator, left, right)
-            return float(left) * float(right)
-        if op == "SLASH":
-            self._checkNumbersOperand(expr.operator, left, right)
-            return float(left) / float(right)
-
-        # Comparison operator
-        if op == "GREATER":
-            self._checkNumbersOperand(expr.operator, left, right)
-            return float(left) > float(right)
-        if op == "GREATER_EQUAL":
-            self._checkNumbersOperand(expr.operator, left, right)
-            return float(left) >= float(right)
-        if op == "LESS":
-            self._checkNumbersOperand(expr.operator, left, right)
-            return float(left) < float(right)
-        if op == "LESS_EQUAL":
-            self._checkNumbersOperand(expr.operator, left, right)
-            return float(left) <= float(right)
-
-        # Equality operators
-        if op == "BANG_EQUAL":
-            return not self._isEqual(left, right)
-        if op == "EQUAL_EQUAL":
-            return self._isEqual(left, right)
-
-    def _evaluate(self, expr):
-        # Recursively working through the expressions
-        # using the visitor patterns
-        return expr.accept(self)
-
-    def _isTruthy(self, val):
-        # All nonzero, nonnull values are true, empty strings are false
-        if val == None:
-            return False
-        if val == 0:
-            return False
-        if isinstance(val, bool):
-            return val
-        if isinstance(val, str):
-            if val == "":
+        return self._evaluate(expr)
+
+    def _evaluate(self, expr, depth=0):
+        """ Evaluates an expression. Operators and groupings are evaluated
+        here directly, anything else goes through the visitor pattern.
+        Past MAX_DEPTH nested operators the rest of the tree is evaluated
+        with an explicit stack, so expressions thousands of levels deep do
+        not run into the recursion limit."""
+        cls = expr.__class__
+        if cls is Literal:
+            return expr.val
+        if cls is Variable:
+            return self.environment.get(expr.name, expr.depth, expr.slot)
+        if cls is Binary:
+            if depth > MAX_DEPTH:
+                return self._evaluateDeep(expr)
+            depth += 1
+            left = self._evaluate(expr.left, depth)
+            right = self._evaluate(expr.right, depth)
+            if expr.apply is not None:
+                # The type checker proved the operands need no checks
+                return expr.apply(left, right)
+            return self._binary(expr.operator, left, right)
+        if cls is Logical:
+            if depth > MAX_DEPTH:
+                return self._evaluateDeep(expr)
+            depth += 1
+            left = self._isTruthy(self._evaluate(expr.left, depth))
+            if expr.operator.kind == tok.OR:
+                # Short circuit when the left side is true
+                if left:
+                    return True
+            elif not left:
+                # Short circuit when the left side is false
                 return False
-        return True
-
-    def _isEqual(self, left, right):
-        if left == None and right == None:
-            return True
-        if left == None:
-            return False
-
-        return left == right
-
-    def _checkNumberOperand(self, op, operand):
-        if isinstance(operand, float):
-            return
-        raise exceptions.RuntimeException("Operand must be a number!", op)
+            return True if self._isTruthy(self._evaluate(expr.right, depth)) \
+                else False
+        if cls is Grouping or cls is Unary:
+            if depth > MAX_DEPTH:
+                return self._evaluateDeep(expr)
+            if cls is Grouping:
+                return self._evaluate(expr.expression, depth + 1)
+            return self._unary(expr.operator,
+                               self._evaluate(expr.right, depth + 1))
+        return self._expressionTable[expr.kind](expr)
+
+    def _evaluateDeep(self, expr):
+        """ Evaluates an expression with an explicit stack of the operators
+        waiting for their operands instead of recursion."""
+        pending = []  # Operators with the value of their left side
+        cls = expr.__class__
+        while True:
+            # Go down the left side of the tree to an operand
+            while True:
+                if cls is Binary or cls is Logical:
+                    pending.append((expr, _LEFT))
+                    expr = expr.left
+                elif cls is Unary:
+                    pending.append((expr, None))
+                    expr = expr.right
+                elif cls is Grouping:
+                    expr = expr.expression
+                else:
+                    break
+                cls = expr.__class__
 
-    def _checkNumbersOperand(self, op, operand1, operand2):
-        if isinstance(operand1, float) and isinstance(operand2, float):
-            return
-        raise exceptions.RuntimeException("Operands must be numbers!", op)
-
-    def _stringify(self, x):
-        if x is None:
-            return "nil"
-        if isinstance(x, int):
-            return x
-        if isinstance(x, float):
-            text = str(x)
-            if text[len(text)-2: len(text)] == ".0":
-                return text[0:len(text)-2]
-        if x is True:
-            return "true"
-        if x is False:
-            return "false"
-        return str(x)  # rely on object __str__ method
+            if cls is Literal:
+                value = expr.val
+            elif cls is Variable:
+                value = self.environment.get(expr.name, expr.depth,
+                                             expr.slot)
+            else:
+                value = self._expressionTable[expr.kind](expr)
+
+            # Go back up, applying operators, until one needs its right side
+            while pending:
+                expr, left = pending.pop()
+                cls = expr.__class__
+                if cls is Unary:
+                    value = self._unary(expr.operator, value)
+                    continue
+                if left is _LEFT:
+                    if cls is Logical:
+                        # Short circuit and and or
+                        if expr.operator.kind == tok.OR:
+                            if self._isTruthy(value):
+                                value = True
+                                continue
+                        elif not self._isTruthy(value):
+                            value = False
+                            continue
+                    pending.append((expr, value))
+                    expr = expr.right
+                    cls = expr.__class__
+                    break
+                if cls is Logical:
+                    value = True if self._isTruthy(value) else False
+                else:
+                    if expr.apply is not None:
+                        value = expr.apply(left, value)
+                    else:
+                        value = self._binary(expr.operator, left, value)
+            else:
+                return value
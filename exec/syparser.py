@@ -5,11 +5,73 @@ from handling import exceptions
 from tree import expressions as exp
 from tree import stmt
 from handling.error_reporting import Error
-from tree.scanner import Token, TokenType
+from tree import scanner as tok
+
+# Binary operators by token kind, mapped to their precedence and the node
+# that is built for them. A higher precedence binds tighter.
+BINARY_OPERATORS = {
+    tok.OR: (1, exp.Logical),
+    tok.AND: (2, exp.Logical),
+    tok.BANG_EQUAL: (3, exp.Binary),
+    tok.EQUAL_EQUAL: (3, exp.Binary),
+    tok.GREATER: (4, exp.Binary),
+    tok.GREATER_EQUAL: (4, exp.Binary),
+    tok.LESS: (4, exp.Binary),
+    tok.LESS_EQUAL: (4, exp.Binary),
+    tok.MINUS: (5, exp.Binary),
+    tok.PLUS: (5, exp.Binary),
+    tok.SLASH: (6, exp.Binary),
+    tok.STAR: (6, exp.Binary)
+}
+
+# Prefix operators, these bind tighter than any binary operator
+UNARY_OPERATORS = (tok.BANG, tok.MINUS)
+
+# Precedence of what else the expression parser keeps on its stack
+END_PRECEDENCE = -2  # Anything that is not an operator
+GROUP_PRECEDENCE = -1
+ASSIGN_PRECEDENCE = 0
+UNARY_PRECEDENCE = 7
+
+# Keywords that are literal values
+LITERALS = {
+    tok.FALSE: False,
+    tok.TRUE: True,
+    tok.NIL: None
+}
+
+class TokenBuffer(object):
+    """ Lets the parser index into tokens that are still being scanned.
+    Tokens are pulled from the iterator as the parser reaches them and
+    tokens the parser is done with can be released."""
+
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.buffer = []
+        self.offset = 0  # Index of the first token still in the buffer
+
+    def __getitem__(self, index):
+        index -= self.offset
+        buffer = self.buffer
+        while index >= len(buffer):
+            # The scanner always ends with EOF and the parser never
+            # moves past it
+            buffer.append(next(self.tokens))
+        return buffer[index]
+
+    def release(self, index):
+        """ Drops every token before index."""
+        del self.buffer[:index - self.offset]
+        self.offset = index
+
 
 class Parser(object):
 
     def __init__(self, tokens):
+        """ tokens is either a list of tokens or an iterator over them,
+        such as the one returned by scanner.streamTokens."""
+        if not isinstance(tokens, list):
+            tokens = TokenBuffer(tokens)
         self.tokens = tokens
         self.current = 0
 
@@ -24,10 +86,22 @@ class Parser(object):
         except exceptions.ParserException:
             return None
 
+    def statements(self):
+        """ Generator that yields top level statements one at a time as
+        they are parsed. A statement with a parser error is yielded as None.
+        Tokens of statements already yielded are released when streaming."""
+        self.inloop = 0
+        while not self._isAtEnd():
+            statement = self.declaration()
+            if isinstance(self.tokens, TokenBuffer):
+                # Keep the previous token, the parser may still look at it
+                self.tokens.release(self.current - 1)
+            yield statement
+
     def declaration(self):
         try:
             # Check if it is a variable declaration
-            if self._match("NUM", "STR", "BOOL"):
+            if self._match(tok.NUM, tok.STR, tok.BOOL):
                 return self.varDelcaration()
             return self.statement()
         except exceptions.ParserException as eee:
@@ -36,61 +110,49 @@ class Parser(object):
 
     def varDelcaration(self):
         vartype = self._previous()
-        name = self._consume("IDENTIFIER", "Expected varibale name")
+        name = self._consume(tok.IDENTIFIER, "Expected varibale name")
         initializer = None
-        if self._match("EQUAL"):
+        if self._match(tok.EQUAL):
             initializer = self.expression()
-        self._consume("SEMICOLON", "Expected a ; after variable declaration")
+        self._consume(tok.SEMICOLON, "Expected a ; after variable declaration")
         return stmt.Var(name, vartype, initializer)
 
     def statement(self):
-        if self._match("PASS"):
+        if self._match(tok.PASS):
             return self.passstatement()
 
-        if self._match("IF"):
+        if self._match(tok.IF):
             return self.ifstatement()
 
-        if self._match("ELSEIF"):
+        if self._match(tok.ELSEIF):
             raise self.error(self.tokens[self.current],
                              "elseif much be mapped to an if")
 
-        if self._match("PRINT"):
+        if self._match(tok.PRINT):
             return self.printStatement()
 
-        if self._match("WHILE"):
-            self.inloop += 1
-            temp = self.whilestatement()
-            self.inloop -= 1
-            return temp
+        if self._match(tok.WHILE):
+            return self._loop(self.whilestatement)
 
-        if self._match("DO"):
-            self.inloop += 1
-            temp  = self.dostatement()
-            self.inloop -= 1
-            return temp
+        if self._match(tok.DO):
+            return self._loop(self.dostatement)
 
-        if self._match("UNTIL"):
-            self.inloop += 1
-            temp = self.untilstatement()
-            self.inloop -= 1
-            return temp
+        if self._match(tok.UNTIL):
+            return self._loop(self.untilstatement)
 
-        if self._match("FOR"):
-            self.inloop += 1
-            temp = self.forstatement()
-            self.inloop -= 1
-            return temp
+        if self._match(tok.FOR):
+            return self._loop(self.forstatement)
 
-        if self._match("LEFT_BRACE"):
+        if self._match(tok.LEFT_BRACE):
             return stmt.Block(self.block())
 
-        if self._match("BREAK"):
+        if self._match(tok.BREAK):
             if not self.inloop:
                 raise self.error(self.tokens[self.current],
                                  "Break statement must be inside a loop")
             return self.breakstatement()
 
-        if self._match("CONTINUE"):
+        if self._match(tok.CONTINUE):
             if not self.inloop:
                 raise self.error(self.tokens[self.current],
                                  "Continue statement must be inside a loop")
@@ -98,90 +160,112 @@ class Parser(object):
 
         return self.expressionStatement()
 
-    def ifstatement(self):
-        # Get condition
-        self._consume("LEFT_PAREN", "Expected ( after if")
-        condition = self.expression()
-        self._consume("RIGHT_PAREN", "Expected ) after condition")
-
-        # Get then branch
-        then_branch = self.statement()
-
-        # Get elseif branches if there are any
-        # elseif branches will be represents as a list
-        # of if statements
-        elseifs = []
-        while(self._match("ELSEIF")):
-            self._consume("LEFT_PAREN", "Expected ( after elseif")
-            econdition = self.expression()
-            self._consume("RIGHT_PAREN", "Expected ) after condtion")
-            elseif_body = self.statement()
-            elseifs.append(stmt.If(econdition, elseif_body, [], None))
-
-
-        else_branch = None
-        if self._match("ELSE"):
-            else_branch = self.statement()
+    def _loop(self, parse):
+        """ Parses a loop with the given method while keeping track of
+        being inside a loop, even when the loop has a parser error."""
+        self.inloop += 1
+        try:
+            return parse()
+        finally:
+            self.inloop -= 1
 
-        return stmt.If(condition, then_branch, elseifs, else_branch)
+    def ifstatement(self):
+        # An else branch that is another if statement is parsed in this
+        # loop rather than by calling back in, so long else if chains
+        # do not run into the recursion limit
+        chain = []
+        while True:
+            # Get condition
+            self._consume(tok.LEFT_PAREN, "Expected ( after if")
+            condition = self.expression()
+            self._consume(tok.RIGHT_PAREN, "Expected ) after condition")
+
+            # Get then branch
+            then_branch = self.statement()
+
+            # Get elseif branches if there are any
+            # elseif branches will be represents as a list
+            # of if statements
+            elseifs = []
+            while(self._match(tok.ELSEIF)):
+                self._consume(tok.LEFT_PAREN, "Expected ( after elseif")
+                econdition = self.expression()
+                self._consume(tok.RIGHT_PAREN, "Expected ) after condtion")
+                elseif_body = self.statement()
+                elseifs.append(stmt.If(econdition, elseif_body, [], None))
+
+            chain.append(stmt.If(condition, then_branch, elseifs, None))
+            if not self._match(tok.ELSE):
+                break
+            if not self._match(tok.IF):
+                chain[-1].else_branch = self.statement()
+                break
+
+        for index in range(len(chain) - 1):
+            chain[index].else_branch = chain[index + 1]
+        return chain[0]
 
     def breakstatement(self):
-        self._consume("SEMICOLON", "Expected ; after break")
+        self._consume(tok.SEMICOLON, "Expected ; after break")
         return stmt.Break(None)
 
     def continuestatement(self):
-        self._consume("SEMICOLON", "Expected ; after continue")
+        self._consume(tok.SEMICOLON, "Expected ; after continue")
         return stmt.Continue(None)
 
     def passstatement(self):
-        self._consume("SEMICOLON", "Expected ; after pass")
+        self._consume(tok.SEMICOLON, "Expected ; after pass")
         return stmt.Pass(None)
 
     def forstatement(self):
-        self._consume("LEFT_PAREN", "Expected left paren after for")
+        self._consume(tok.LEFT_PAREN, "Expected left paren after for")
 
         # Get the initializer
-        if self._match("SEMICOLON"):  # No initializer
+        if self._match(tok.SEMICOLON):  # No initializer
             initializer = None
         else:  # initializer is an assignment
             initializer = self.expressionStatement()
 
-        # Get condition
-        if self._check("SEMICOLON"):
-            condition = None
-        else:
-            condition = self.expression()
-        self._consume("SEMICOLON", "Expected semicolon after condition")
+        # Get condition, a loop without one could never end
+        if self._check(tok.SEMICOLON):
+            raise self.error(self._peek(), "Expected a condition in for loop")
+        condition = self.expression()
+        self._consume(tok.SEMICOLON, "Expected semicolon after condition")
 
         # Get increment
-        if self._check("RIGHT_PAREN"):
+        if self._check(tok.RIGHT_PAREN):
             increment = None
         else:
             increment = self.expression()
 
-        self._consume("RIGHT_PAREN", "Expected ')' after clauses")
+        self._consume(tok.RIGHT_PAREN, "Expected ')' after clauses")
 
         body = self.statement()
 
-        # Get else branch, which executes if the loop does not complete
-        if self._match("ELSE"):
-            else_branch = self.statement()
-        else:
-            else_branch = None
+        # Get else branch, which executes if the loop ends without a break.
+        # It is not part of the loop, break and continue in it belong to
+        # the loop around this one
+        else_branch = None
+        if self._match(tok.ELSE):
+            self.inloop -= 1
+            try:
+                else_branch = self.statement()
+            finally:
+                self.inloop += 1
         return stmt.For(initializer, condition, body,increment, else_branch)
 
     def whilestatement(self):
-        self._consume("LEFT_PAREN", "Expected left paren after while")
+        self._consume(tok.LEFT_PAREN, "Expected left paren after while")
         condition = self.expression()
-        self._consume("RIGHT_PAREN", "Expected right paren after condition")
+        self._consume(tok.RIGHT_PAREN, "Expected right paren after condition")
 
         body = self.statement()
         return stmt.While(condition, body)
 
     def untilstatement(self):
-        self._consume("LEFT_PAREN", "Expected left paren after until")
+        self._consume(tok.LEFT_PAREN, "Expected left paren after until")
         condition = self.expression()
-        self._consume("RIGHT_PAREN", "Expected right paren after until")
+        self._consume(tok.RIGHT_PAREN, "Expected right paren after until")
 
         body = self.statement()
         return stmt.Until(condition, body)
@@ -191,15 +275,15 @@ class Parser(object):
         body = self.statement()
 
         # Get condition
-        er = self._consume("WHILE", "Expected while after do block", True)
-        et = self._consume("UNTIL", "Expected while after do block", True)
+        er = self._consume(tok.WHILE, "Expected while after do block", True)
+        et = self._consume(tok.UNTIL, "Expected while after do block", True)
         if not er and not et:
             raise self.error(self._peek(),
                              "Expected while or until after do block")
 
-        self._consume("LEFT_PAREN", "Expected left paren after while/until")
+        self._consume(tok.LEFT_PAREN, "Expected left paren after while/until")
         condition = self.expression()
-        self._consume("RIGHT_PAREN", "Expected right paren after condition")
+        self._consume(tok.RIGHT_PAREN, "Expected right paren after condition")
         if er:
             return stmt.Do(condition, body, "while")
         else:
@@ -208,117 +292,103 @@ class Parser(object):
     def block(self):
         """ Returns a list of statements in the block."""
         statements = []
-        while not self._check("RIGHT_BRACE") and not self._isAtEnd():
+        while not self._check(tok.RIGHT_BRACE) and not self._isAtEnd():
             statements.append(self.declaration())
-        self._consume("RIGHT_BRACE", "Expected } to end block")
+        self._consume(tok.RIGHT_BRACE, "Expected } to end block")
         return statements
 
     def printStatement(self):
         value = self.expression()
-        self._consume("SEMICOLON", "Expected ; after value")
+        self._consume(tok.SEMICOLON, "Expected ; after value")
         return stmt.Print(value)
 
     def expressionStatement(self):
         expr = self.expression()
-        self._consume("SEMICOLON", "Expected ; after value")
+        self._consume(tok.SEMICOLON, "Expected ; after value")
         return stmt.Expression(expr)
 
-    def assignment(self):
-        expr = self.ore()
-
-        if self._match("EQUAL"):
-            eq = self._previous()
-            value = self.assignment()
-
-            if isinstance(expr, exp.Variable):
-                name = expr.name
-                return exp.Assign(name, value)
-            self.error(eq, "Invalid assignment")
-        return expr
-
     def expression(self):
-        return self.assignment()
-
-    def ore(self):
-        expr = self.andd()
-        while self._match("OR"):
-            op = self._previous()
-            right = self.andd()
-            expr = exp.Logical(expr, op, right)
-        return expr
-
-    def andd(self):
-        expr = self.equality()
-        while self._match("AND"):
-            op = self._previous()
-            right = self.equality()
-            expr = exp.Logical(expr, op, right)
-        return expr
-
-    def equality(self):
-        expr = self.comparison()
-
-        while self._match("BANG_EQUAL", "EQUAL_EQUAL"):
-            # Operator is the previous one since we consumed the token in match
-            operator = self._previous()
-
-            # Get the right side of the cquality
-            right = self.comparison()
-
-            # Create binary expression ast node
-            expr = exp.Binary(expr, operator, right)
-        return expr
-
-    def comparison(self):
-        expr = self.addition()
-
-        while self._match("GREATER", "GREATER_EQUAL", "LESS", "LESS_EQUAL"):
-            operator = self._previous()
-            right = self.addition()
-            expr = exp.Binary(expr, operator, right)
-        return expr
-
-    def addition(self):
-        expr = self.multiplication()
-
-        while self._match("MINUS", "PLUS"):
-            operator = self._previous()
-            right = self.multiplication()
-            expr = exp.Binary(expr, operator, right)
-        return expr
-
-    def multiplication(self):
-        expr = self.unary()
-
-        while self._match("SLASH", "STAR"):
-            operator = self._previous()
-            right = self.unary()
-            expr = exp.Binary(expr, operator, right)
-        return expr
-
-    def unary(self):
-        if self._match("BANG", "MINUS"):
-            operator = self._previous()
-            right = self.unary()
-            return exp.Unary(operator, right)
-        return self.primary()
+        """ Parses an expression by precedence climbing. Instead of calling
+        itself for every operand, operators and open parentheses waiting for
+        their operand are kept on a stack, so deeply nested expressions do
+        not run into the recursion limit. Each entry on the stack is
+        (precedence, left operand, operator token, node to build)."""
+        tokens = self.tokens
+        pending = []
+        while True:
+            # Prefix operators and open parentheses, then an operand
+            token = tokens[self.current]
+            kind = token.kind
+            if kind in UNARY_OPERATORS:
+                self.current += 1
+                pending.append((UNARY_PRECEDENCE, None, token, exp.Unary))
+                continue
+            if kind == tok.LEFT_PAREN:
+                self.current += 1
+                pending.append((GROUP_PRECEDENCE, None, token, None))
+                continue
+            expr = self.primary()
+
+            # Reduce what is waiting on the stack until the next operator
+            # can be pushed, or the expression or grouping is complete
+            while True:
+                operator = tokens[self.current]
+                entry = BINARY_OPERATORS.get(operator.kind)
+                if entry is not None:
+                    precedence = entry[0]
+                elif operator.kind == tok.EQUAL:
+                    precedence = ASSIGN_PRECEDENCE
+                else:
+                    precedence = END_PRECEDENCE
+
+                while pending:
+                    top, left, optoken, node = pending[-1]
+                    if top == GROUP_PRECEDENCE:
+                        break
+                    if top == ASSIGN_PRECEDENCE:
+                        # Assignment is right associative and its value
+                        # holds everything up to the end of the expression
+                        if precedence != END_PRECEDENCE:
+                            break
+                        if isinstance(left, exp.Variable):
+                            expr = exp.Assign(left.name, expr)
+                        else:
+                            self.error(optoken, "Invalid assignment")
+                            expr = left
+                    elif top < precedence:
+                        break
+                    elif node is exp.Unary:
+                        expr = exp.Unary(optoken, expr)
+                    else:
+                        expr = node(left, optoken, expr)
+                    pending.pop()
+
+                if precedence != END_PRECEDENCE:
+                    self.current += 1
+                    pending.append((precedence, expr, operator,
+                                    entry and entry[1]))
+                    break
+                if not pending:
+                    return expr
+
+                # Only an open parenthesis can be left on the stack
+                self._consume(tok.RIGHT_PAREN, "Expected ')' after expression")
+                pending.pop()
+                expr = exp.Grouping(expr)
 
     def primary(self):
-        if self._match("FALSE"):
-            return exp.Literal(False)
-        if self._match("TRUE"):
-            return exp.Literal(True)
-        if self._match("NIL"):
-            return exp.Literal(None)
-        if self._match("STRING", "NUMBER"):
-            return exp.Literal(self._previous().literal)
-        if self._match("LEFT_PAREN"):
-            expr = self.expression()
-            self._consume("RIGHT_PAREN", "Expected ')' after expression")
-            return exp.Grouping(expr)
-        if self._match("IDENTIFIER"):
-            return exp.Variable(self._previous())
-        raise self.error(self._peek(), " Expected expression")
+        token = self.tokens[self.current]
+        kind = token.kind
+        if kind in LITERALS:
+            self.current += 1
+            return exp.Literal(LITERALS[kind])
+        if kind == tok.STRING or kind == tok.NUMBER:
+            self.current += 1
+            return exp.Literal(token.literal)
+        if kind == tok.IDENTIFIER:
+            self.current += 1
+            return exp.Variable(token)
+        raise self.error(token, " Expected expression")
 
     def error(self, token, msg):
         Error().error(token, msg)
@@ -329,33 +399,34 @@ class Parser(object):
         self._advance()
 
         while not self._isAtEnd():
-            if self._previous().type == "SEMICOLON":
+            if self._previous().kind == tok.SEMICOLON:
                 return
-            to_return = ["CLASS", "DEF", "NUM", "FOR", "IF", "WHILE",
-            "RETURN", "BOOL", "STR"]
-            if self._peek().type in to_return:
+            to_return = (tok.CLASS, tok.DEF, tok.NUM, tok.FOR, tok.IF,
+                         tok.WHILE, tok.RETURN, tok.BOOL, tok.STR)
+            if self._peek().kind in to_return:
                 return
             self._advance()
 
-    def _consume(self, type, msg, silent=False):
-        if self._check(type):
+    def _consume(self, kind, msg, silent=False):
+        if self._check(kind):
             return self._advance()
         if not silent:
             raise self.error(self._peek(), msg)
 
-    def _match(self, *types):
+    def _match(self, *kinds):
         """ Iterates through tokens and determines if they
-        match the given types."""
-        for type in types:
-            if self._check(type):
+        match the given kinds."""
+        for kind in kinds:
+            if self._check(kind):
                 self._advance()
                 return True
         return False
 
-    def _check(self, type):
+    def _check(self, kind):
+        """ Compares the integer kind of the current token."""
         if self._isAtEnd():
             return False
-        return str(self._peek().type) == type
+        return self.tokens[self.current].kind == kind
 
     def _advance(self):
         if not self._isAtEnd():
@@ -363,7 +434,7 @@ class Parser(object):
         return self._previous()
 
     def _isAtEnd(self):
-        return str(self._peek().type) == "EOF"
+        return self.tokens[self.current].kind == tok.EOF
 
     def _peek(self):
         return self.tokens[self.current]
@@ -0,0 +1,595 @@
+"""
+Translates statements into the source of a Python function, which Python
+compiles into a code object and runs. Sython loops become Python loops and
+variables become local variables of the function, so most of the work is
+done by Python itself. Line numbers of the code object are those of the
+Sython script, so tracebacks point into the script.
+"""
+import ast
+
+from exec.bytecode import empty
+from exec.resolver import declarations, variables
+from exec.closures import ClosureCompiler, ClosureMachine
+from exec.syinterpreter import binary, isTruthy, stringify, unary
+from handling import exceptions
+from handling.environment import checkAssign, checkDefine
+from tree import scanner as tok
+from tree import stmt
+from tree.expressions import Assign, Binary, Call, Grouping, Literal, \
+    Logical, Unary, Variable
+from tree.stmt import If, StmtVisitor
+
+# Deepest expression translated, past it the parentheses of the Python
+# source could nest deeper than Python can parse
+MAX_NESTING = 30
+
+PYTHON_OPERATORS = {
+    tok.MINUS: "-",
+    tok.PLUS: "+",
+    tok.STAR: "*",
+    tok.SLASH: "/",
+    tok.GREATER: ">",
+    tok.GREATER_EQUAL: ">=",
+    tok.LESS: "<",
+    tok.LESS_EQUAL: "<=",
+    tok.BANG_EQUAL: "!=",
+    tok.EQUAL_EQUAL: "=="
+}
+
+COMPARISONS = (tok.GREATER, tok.GREATER_EQUAL, tok.LESS, tok.LESS_EQUAL,
+               tok.BANG_EQUAL, tok.EQUAL_EQUAL)
+
+# Class of the values every type of variable holds, when they are not
+# holding a value that only passes the type check, like 0 in a num
+TYPE_CLASSES = {"num": float, "str": str, "bool": bool}
+
+# Value of a variable that is not defined yet
+UNDEFINED = object()
+
+
+class _TooDeep(Exception):
+    """ Raised for statements Python could not compile once translated."""
+
+
+def _load(name, *values):
+    # Value of the first defined variable of those that could be name
+    for value in values:
+        if value is not UNDEFINED:
+            if value is None:
+                _uninitialized(name)
+            return value
+    raise exceptions.RuntimeException("Undefined variable " + name.lexeme)
+
+
+def _uninitialized(name):
+    raise exceptions.RuntimeException(
+        "Line %d Cannot access uninitialized variable" % name.line)
+
+
+def _undefined(name):
+    raise exceptions.RuntimeException(
+        "Line %d Undefined variable %s" % (name.line, name.lexeme))
+
+
+def _assigned(vtype, name, value):
+    checkAssign(vtype, name, value)
+    return value
+
+
+# Names the translated source uses, besides T, the tokens it reports errors
+# with, and K, the constants that can not be written in Python
+RUNTIME = {
+    "UNDEFINED": UNDEFINED,
+    "_assigned": _assigned,
+    "_binary": binary,
+    "_defined": checkDefine,
+    "_load": _load,
+    "_stringify": stringify,
+    "_truthy": isTruthy,
+    "_unary": unary,
+    "_uninitialized": _uninitialized,
+    "_undefined": _undefined,
+}
+
+
+def lineOf(node):
+    """ Returns the line of the first token found in a statement or an
+    expression, or None for nodes without any, like literals."""
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if node is None:
+            continue
+        cls = node.__class__
+        if cls in (Variable, Assign, stmt.Var):
+            return node.name.line
+        if cls in (Binary, Logical, Unary):
+            return node.operator.line
+        if cls in (Grouping, stmt.Expression, stmt.Print):
+            pending.append(node.expression)
+        elif cls in (If, stmt.While, stmt.Until, stmt.Do):
+            pending.append(node.condition)
+        elif cls is stmt.For:
+            pending.append(node.condition)
+            pending.append(node.initializer)
+    return None
+
+
+class _Scope(object):
+    """ Python names of the variables declared in a block, or at the top
+    level."""
+
+    __slots__ = ('names', 'above')
+
+    def __init__(self, names, above):
+        self.names = names
+        self.above = above
+
+
+class Transpiler(StmtVisitor):
+    """ Translates statements into a Python function taking a
+    PythonMachine.
+
+    Every variable becomes a local variable of the function, holding
+    UNDEFINED until it is defined. Blocks set their variables back to
+    UNDEFINED when they start, and top level variables are loaded from the
+    first frame of the machine and stored back when the function returns,
+    so they are kept between calls to compile. A variable declared with one
+    type only is checked against that type inline, otherwise its type is
+    kept in a second local variable. Where a variable is certainly defined,
+    because its declaration comes first in the same block or one around it,
+    reading it is reading the local variable.
+
+    Sython loops become Python while loops, break and continue their break
+    and continue. A continue first runs what the loop runs before its next
+    pass, the increment of a for loop or the condition of a do loop, and
+    the else branch of a for loop is the else of its while loop.
+
+    Statements Python can not compile, like very deeply nested expressions,
+    are compiled into closures instead.
+    """
+
+    def __init__(self, filename="<sython>"):
+        StmtVisitor.__init__(self)
+        self.filename = filename
+        self.closures = ClosureCompiler()
+        self.globals = self.closures.globals
+        self.globalTypes = {}  # Every type each top level name was given
+
+    def compile(self, statements):
+        """ Compiles a list of top level statements into a function."""
+        declarations(statements, self.globals.names)
+        for statement in variables(statements):
+            self.globalTypes.setdefault(statement.name.lexeme, set()).add(
+                str(statement.type.type).lower())
+        try:
+            return self._compile(statements)
+        except (_TooDeep, SyntaxError, RecursionError, MemoryError):
+            return self.closures.compile(statements)
+
+    def _compile(self, statements):
+        self.lines = []
+        self.indent = 1  # The statements go inside of a try statement
+        self.line = 1
+        self.tokens = []
+        self._tokenIndex = {}
+        self.constants = []
+        self.temps = 0
+        self.types = {}  # Python name to type, None when it can change
+        self.defined = set()  # Python names certainly defined here
+        self.used = set()
+        self.loop = None
+        self.counter = 0
+
+        names = {}
+        for name, slot in self.globals.names.items():
+            names[name] = "g%d" % slot
+            types = self.globalTypes[name]
+            self.types[names[name]] = next(iter(types)) \
+                if len(types) == 1 else None
+        self.scope = _Scope(names, None)
+        self._body(statements)
+        return self._function(self._source())
+
+    def _source(self):
+        """ Returns the source of the function, along with the line of the
+        script every line of it came from."""
+        body = self.lines
+        self.lines = []
+        self.indent = 0
+        self.line = body[0][2] if body else 1
+        self._emit("def program(rt):")
+        self.indent = 1
+        # Top level variables in use are loaded from their slots, the ones
+        # that are defined are stored back when the function returns
+        store = []
+        for name, slot in sorted(self.globals.names.items(),
+                                 key=lambda item: item[1]):
+            ident = self.scope.names[name]
+            if ident not in self.used:
+                continue
+            self._emit("%s = UNDEFINED if rt.types[0][%d] is None else "
+                       "rt.frames[0][%d]" % (ident, slot, slot))
+            vtype = self.types[ident]
+            if vtype is None:
+                self._emit("t%s = rt.types[0][%d]" % (ident, slot))
+                vtype = "t" + ident
+            else:
+                vtype = repr(vtype)
+            store.append("if %s is not UNDEFINED:" % ident)
+            store.append("    rt.frames[0][%d] = %s" % (slot, ident))
+            store.append("    rt.types[0][%d] = %s" % (slot, vtype))
+        if store:
+            self._emit("try:")
+            self.lines.extend(body)
+            self._emit("finally:")
+            self.indent = 2
+            for line in store:
+                self._emit(line)
+        else:
+            self.lines.extend((indent - 1, text, line)
+                              for indent, text, line in body)
+        source = "\n".join("    " * indent + text
+                           for indent, text, line in self.lines)
+        return source, [line for indent, text, line in self.lines]
+
+    def _function(self, translated):
+        """ Compiles the source of the function with the line numbers of the
+        script and returns the function."""
+        source, lines = translated
+        tree = ast.parse(source, self.filename)
+        for node in ast.walk(tree):
+            if hasattr(node, "lineno"):
+                node.lineno = node.end_lineno = lines[node.lineno - 1]
+                node.col_offset = node.end_col_offset = 0
+        namespace = dict(RUNTIME, T=self.tokens, K=self.constants)
+        exec(compile(tree, self.filename, "exec"), namespace)
+        return namespace["program"]
+
+    # Functions for writing the source
+    def _emit(self, text, offset=0):
+        self.lines.append((self.indent + offset, text, self.line))
+
+    def _emitAll(self, lines):
+        for offset, text in lines:
+            self._emit(text, offset)
+
+    def _body(self, statements):
+        """ Writes statements one level further in, or pass when they write
+        nothing."""
+        self.indent += 1
+        start = len(self.lines)
+        for statement in statements:
+            self._statement(statement)
+        if len(self.lines) == start:
+            self._emit("pass")
+        self.indent -= 1
+
+    def _statement(self, statement):
+        line = lineOf(statement)
+        if line is not None:
+            self.line = line
+        self.temps = 0
+        self._stmtTable[statement.kind](statement)
+
+    def _token(self, token):
+        """ Returns the index of a token in T."""
+        index = self._tokenIndex.get(id(token))
+        if index is None:
+            index = self._tokenIndex[id(token)] = len(self.tokens)
+            self.tokens.append(token)
+        return index
+
+    def _temp(self):
+        self.temps += 1
+        return "_t%d" % self.temps
+
+    def _found(self, name):
+        """ Returns the Python names of the variables name could be, from the
+        innermost scope out."""
+        found = []
+        scope = self.scope
+        while scope is not None:
+            ident = scope.names.get(name.lexeme)
+            if ident is not None:
+                found.append(ident)
+            scope = scope.above
+        self.used.update(found)
+        return found
+
+    # Functions for translating statements
+    def visitBreak(self, stmt):
+        self._emitAll(self.loop[0])
+
+    def visitContinue(self, stmt):
+        self._emitAll(self.loop[1])
+
+    def visitPass(self, stmt):
+        pass
+
+    def _loopBody(self, body, continueing):
+        """ Writes the body of a loop, continue writes the lines in
+        continueing."""
+        outer = self.loop
+        self.loop = ([(0, "break")], continueing)
+        self._body([body])
+        self.loop = outer
+
+    def visitWhile(self, stmt):
+        self._emit("while %s:" % self._truth(stmt.condition))
+        self._loopBody(stmt.body, [(0, "continue")])
+
+    def visitUntil(self, stmt):
+        self._emit("while not %s:" % self._truth(stmt.condition))
+        self._loopBody(stmt.body, [(0, "continue")])
+
+    def visitDo(self, stmt):
+        condition = self._truth(stmt.condition)
+        if stmt.condition_type == "while":
+            again = condition
+            stop = "not " + condition
+        else:
+            again = "not " + condition
+            stop = condition
+        self._emit("while True:")
+        self._loopBody(stmt.body, [(0, "if %s:" % again), (1, "continue"),
+                                   (0, "break")])
+        self._emit("if %s:" % stop, 1)
+        self._emit("break", 2)
+
+    def visitFor(self, stmt):
+        if stmt.initializer:
+            self._statement(stmt.initializer)
+        condition = self._truth(stmt.condition)
+        step = []
+        if stmt.increment is not None:
+            step = [(0, self._value(stmt.increment)[0])]
+        self._emit("while %s:" % condition)
+        self._loopBody(stmt.body, step + [(0, "continue")])
+        if step:
+            self._emit(step[0][1], 1)
+        if stmt.else_branch is not None and not empty(stmt.else_branch):
+            # Runs when the condition ends the loop, not after a break
+            self._emit("else:")
+            self._body([stmt.else_branch])
+
+    def visitIf(self, stmt):
+        # Else if chains, including else branches that are if statements,
+        # become one Python if statement
+        keyword = "if"
+        while True:
+            self._emit("%s %s:" % (keyword, self._truth(stmt.condition)))
+            self._body([stmt.then_branch])
+            keyword = "elif"
+            for elseif in stmt.elseifs:
+                self._emit("elif %s:" % self._truth(elseif.condition))
+                self._body([elseif.then_branch])
+            stmt = stmt.else_branch
+            if stmt is None or empty(stmt):
+                break
+            if stmt.__class__ is not If:
+                self._emit("else:")
+                self._body([stmt])
+                break
+
+    def visitVar(self, stmt):
+        ident = self.scope.names[stmt.name.lexeme]
+        vtype = str(stmt.type.type).lower()
+        if stmt.initializer is None:
+            value = repr(checkDefine(vtype, stmt.type, None))
+        else:
+            value, kind = self._value(stmt.initializer)
+            if kind is None.__class__:
+                value = repr(checkDefine(vtype, stmt.type, None))
+            else:
+                value = self._checked(vtype, stmt.type, value, kind,
+                                      "_defined")
+        self._emit("%s = %s" % (ident, value))
+        self.used.add(ident)
+        if self.types[ident] is None:
+            self._emit("t%s = %r" % (ident, vtype))
+        self.defined.add(ident)
+
+    def visitBlock(self, stmt):
+        defined = self.defined
+        self.defined = set(defined)
+        names = {}
+        for name in declarations(stmt.statements):
+            self.counter += 1
+            names[name] = "v%d" % self.counter
+        types = {}
+        for statement in variables(stmt.statements):
+            types.setdefault(names[statement.name.lexeme], set()).add(
+                str(statement.type.type).lower())
+        for ident in types:
+            self.types[ident] = next(iter(types[ident])) \
+                if len(types[ident]) == 1 else None
+        if names:
+            self.scope = _Scope(names, self.scope)
+            self._emit(" = ".join(names.values()) + " = UNDEFINED")
+        start = len(self.lines)
+        for statement in stmt.statements:
+            self._statement(statement)
+        if len(self.lines) == start and not names:
+            self._emit("pass")
+        if names:
+            self.scope = self.scope.above
+        self.defined = defined
+
+    def visitExpression(self, stmt):
+        self._emit(self._value(stmt.expression)[0])
+
+    def visitPrint(self, stmt):
+        self._emit("print(_stringify(%s))" % self._value(stmt.expression)[0])
+
+    # Functions for translating expressions. Every one of them returns
+    # Python source, _value also returns what kind of source it is: the
+    # class of the value of a literal, "name" for a local variable that can
+    # be read again, or None for anything else
+    def _truth(self, expr, depth=0):
+        """ Returns the source of the truth of an expression."""
+        while expr.__class__ is Grouping:
+            expr = expr.expression
+        if depth > MAX_NESTING:
+            raise _TooDeep()
+        cls = expr.__class__
+        if cls is Logical:
+            return "(%s %s %s)" % (
+                self._truth(expr.left, depth + 1),
+                "or" if expr.operator.kind == tok.OR else "and",
+                self._truth(expr.right, depth + 1))
+        if cls is Unary and expr.operator.kind == tok.BANG:
+            return "(not %s)" % self._truth(expr.right, depth + 1)
+        if cls is Binary and expr.operator.kind in COMPARISONS:
+            # Comparisons always give a bool
+            return self._binary(expr, depth + 1)
+        if cls is Literal:
+            return repr(isTruthy(expr.val))
+        value, kind = self._value(expr, depth)
+        if kind == "name" and self.types[value] == "bool":
+            return value
+        return "_truthy(%s)" % value
+
+    def _literal(self, val):
+        if val.__class__ is float and val - val != 0:
+            # Infinity has no literal in Python
+            self.constants.append(val)
+            return "K[%d]" % (len(self.constants) - 1)
+        return repr(val)
+
+    def _value(self, expr, depth=0):
+        """ Returns the source of the value of an expression and its
+        kind."""
+        while expr.__class__ is Grouping:
+            expr = expr.expression
+        if depth > MAX_NESTING:
+            raise _TooDeep()
+        cls = expr.__class__
+        if cls is Literal:
+            return self._literal(expr.val), expr.val.__class__
+        if cls is Variable:
+            return self._load(expr.name)
+        if cls is Assign:
+            value, kind = self._value(expr.value, depth + 1)
+            return self._assign(expr.name, value, kind), None
+        if cls is Binary:
+            return self._binary(expr, depth + 1), None
+        if cls is Logical:
+            return self._truth(expr, depth), None
+        if cls is Unary:
+            operator = self._token(expr.operator)
+            if expr.operator.kind == tok.BANG:
+                return "(not %s)" % self._truth(expr.right, depth + 1), None
+            right, kind = self._value(expr.right, depth + 1)
+            if kind is float:
+                return "(-1 * %s)" % right, None
+            if kind is None:
+                temp = self._temp()
+                return ("(-1 * %s if (%s := %s).__class__ is float else "
+                        "_unary(T[%d], %s))" % (temp, temp, right, operator,
+                                                temp)), None
+            if kind == "name":
+                return ("(-1 * %s if %s.__class__ is float else "
+                        "_unary(T[%d], %s))" % (right, right, operator,
+                                                right)), None
+            return "_unary(T[%d], %s)" % (operator, right), None
+        if cls is Call:
+            # Sython has nothing to call yet, the parser makes no calls
+            raise exceptions.RuntimeException("Calls are not supported",
+                                              expr.paren)
+
+    def _binary(self, expr, depth):
+        operator = self._token(expr.operator)
+        left, leftKind = self._value(expr.left, depth)
+        right, rightKind = self._value(expr.right, depth)
+        if leftKind == "name" and rightKind is None:
+            # The right side could assign to the variable on the left
+            leftKind = None
+        if leftKind not in (None, "name", float) or \
+                rightKind not in (None, "name", float):
+            return "_binary(T[%d], %s, %s)" % (operator, left, right)
+
+        # Operands are tested for floats, which the Python operator handles
+        # the same way, and anything else goes to the shared function. Both
+        # are evaluated before either is tested
+        operands = [left, right]
+        tests = []
+        joint = " and "
+        for index, kind in enumerate((leftKind, rightKind)):
+            if kind is None:
+                temp = self._temp()
+                tests.append("(%s := %s).__class__ is float" %
+                             (temp, operands[index]))
+                operands[index] = temp
+                if index:
+                    joint = " & "
+            elif kind == "name":
+                tests.append("%s.__class__ is float" % operands[index])
+        left, right = operands
+        symbol = PYTHON_OPERATORS[expr.operator.kind]
+        if not tests:
+            return "(%s %s %s)" % (left, symbol, right)
+        if joint == " & ":
+            tests = ["(%s)" % test for test in tests]
+        return "(%s %s %s if %s else _binary(T[%d], %s, %s))" % (
+            left, symbol, right, joint.join(tests), operator, left, right)
+
+    def _load(self, name):
+        found = self._found(name)
+        if found and found[0] in self.defined:
+            ident = found[0]
+            if self.types[ident] in ("num", "bool"):
+                return ident, "name"
+            # Strings can be uninitialized
+            return "(%s if %s is not None else _uninitialized(T[%d]))" % (
+                ident, ident, self._token(name)), None
+        return "_load(T[%d]%s)" % (
+            self._token(name), "".join(", " + ident for ident in found)), \
+            None
+
+    def _checked(self, vtype, name, value, kind, check):
+        """ Returns the source of value once check, _assigned or _defined,
+        passes it as a value of the type named vtype."""
+        cls = TYPE_CLASSES[vtype]
+        if kind is cls:
+            return value
+        if kind == "name":
+            return "(%s if %s.__class__ is %s else %s(%r, T[%d], %s))" % (
+                value, value, cls.__name__, check, vtype, self._token(name),
+                value)
+        temp = self._temp()
+        return "(%s if (%s := %s).__class__ is %s else %s(%r, T[%d], %s))" \
+            % (temp, temp, value, cls.__name__, check, vtype,
+               self._token(name), temp)
+
+    def _assign(self, name, value, kind):
+        found = self._found(name)
+        if found and found[0] in self.defined:
+            return "(%s := %s)" % (found[0], self._assigned(found[0], name,
+                                                            value, kind))
+        # Assigns the first variable that is defined, after evaluating the
+        # value
+        temp = self._temp()
+        chain = ["(%s := %s) if %s is not UNDEFINED else " % (
+            ident, self._assigned(ident, name, temp, "name"), ident)
+            for ident in found]
+        return "((%s := %s), %s_undefined(T[%d]))[1]" % (
+            temp, value, "".join(chain), self._token(name))
+
+    def _assigned(self, ident, name, value, kind):
+        vtype = self.types[ident]
+        if vtype is None:
+            # Type that is only known at runtime
+            return "_assigned(t%s, T[%d], %s)" % (ident, self._token(name),
+                                                  value)
+        return self._checked(vtype, name, value, kind, "_assigned")
+
+
+class PythonMachine(ClosureMachine):
+    """ Runs the functions compiled by Transpiler, which keep the top level
+    variables in the first frame. Statements compiled into closures instead
+    run as they do on a ClosureMachine."""
+
+    def __init__(self, filename="<sython>"):
+        ClosureMachine.__init__(self)
+        self.compiler = Transpiler(filename)
@@ -0,0 +1,252 @@
+"""
+Virtual machine that runs the bytecode compiled by exec/bytecode.py. An
+alternative to the tree walking interpreter, it prints the same output
+and reports the same errors.
+"""
+from exec.bytecode import AND_JUMP, BINARY, BINARY_CONST, BINARY_VAR, \
+    COMPARE_JUMP, CONST, DEFINE, ENTER, JUMP, JUMP_IF, LEAVE, LOAD, \
+    LOAD_ANY, LOAD_BINARY_CONST, LOAD_COMPARE_JUMP, OR_JUMP, POP, PRINT, \
+    STORE, STORE_ANY, STORE_POP, TO_BOOL, UNARY, UNWIND, Compiler
+from exec.checker import TypeChecker
+from exec.hoister import Hoister
+from exec.resolver import Resolver
+from exec.syinterpreter import binary, isTruthy, stringify, unary
+from handling import exceptions
+from handling.environment import checkAssign, checkDefine
+from handling.error_reporting import Error
+
+
+class VirtualMachine(object):
+    """ Stack based virtual machine. Variables live in frames, lists with
+    a slot for every variable a block declares, the first frame holds the
+    top level variables. The type of every variable is kept in a list of
+    the same shape, a slot whose type is None is not defined yet."""
+
+    def __init__(self):
+        self.compiler = Compiler()
+        self.checker = TypeChecker(Resolver())
+        self.hoister = Hoister(self.checker.resolver)
+        self.frames = [[]]
+        self.types = [[]]
+
+    def interpret(self, statements):
+        """ Compiles the statements given to us by the parser and runs
+        them."""
+        # If there is a null reference in statements,
+        # there was a parser error. So dont run anything.
+        if None in statements:
+            return
+        # Nothing runs when there are variables that are never declared,
+        # or operations that can only fail
+        if not self.checker.check(statements):
+            return
+        self.hoister.hoist(statements)
+
+        try:
+            self.run(self.compiler.compile(statements))
+        except exceptions.RuntimeException as eee:
+            Error().runtimeError(eee)
+
+    def interpretStream(self, statements):
+        """ Compiles and runs statements one at a time as they arrive from
+        an iterable, such as Parser.statements. Once a statement fails to
+        parse nothing else is run, but the rest is still parsed to report
+        its errors."""
+        statements = iter(statements)
+        try:
+            for statement in statements:
+                if statement is None:
+                    break
+                if not self.checker.check([statement]):
+                    break
+                unit = [statement]
+                self.hoister.hoist(unit)
+                self.run(self.compiler.compile(unit))
+        except exceptions.RuntimeException as eee:
+            Error().runtimeError(eee)
+            return
+
+        for statement in statements:
+            pass
+
+    def run(self, code):
+        """ Runs compiled code. Frames of blocks are dropped when it fails,
+        the top level variables are kept."""
+        frames = self.frames
+        types = self.types
+        # Make room for top level variables declared since the last run
+        missing = len(self.compiler.globals.names) - len(frames[0])
+        frames[0].extend([None] * missing)
+        types[0].extend([None] * missing)
+        try:
+            self._run(code.instructions, code.constants, frames, types)
+        finally:
+            del frames[1:]
+            del types[1:]
+
+    def _run(self, instructions, constants, frames, types):
+        """ Runs instructions and returns the value they leave on the stack,
+        if any."""
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        end = len(instructions)
+        while pc < end:
+            op, a, b, c = instructions[pc]
+            pc += 1
+            if op == LOAD_BINARY_CONST:
+                left = frames[a][b]
+                name, function, constant, operator = c
+                if left.__class__ is float:
+                    push(function(left, constants[constant]))
+                else:
+                    if left is None:
+                        left = self._load(((a, b),), name)
+                    push(binary(operator, left, constants[constant]))
+            elif op == STORE_POP:
+                value = pop()
+                vtype = types[a][b]
+                if vtype != "num" or value.__class__ is not float:
+                    if vtype is None:
+                        self._store(((a, b),), c, value)
+                        continue
+                    checkAssign(vtype, c, value)
+                frames[a][b] = value
+            elif op == LOAD_COMPARE_JUMP:
+                frame, slot, name, function, constant, operator = c
+                left = frames[frame][slot]
+                if left.__class__ is float:
+                    value = function(left, constants[constant])
+                else:
+                    if left is None:
+                        left = self._load(((frame, slot),), name)
+                    value = binary(operator, left, constants[constant])
+                if value.__class__ is not bool:
+                    value = isTruthy(value)
+                if value is b:
+                    pc = a
+            elif op == BINARY_CONST:
+                left = stack[-1]
+                if left.__class__ is float:
+                    stack[-1] = a(left, constants[b])
+                else:
+                    stack[-1] = binary(c, left, constants[b])
+            elif op == LOAD:
+                value = frames[a][b]
+                if value is None:
+                    value = self._load(((a, b),), c)
+                push(value)
+            elif op == BINARY_VAR:
+                right = frames[a][b]
+                name, function, operator = c
+                if right is None:
+                    right = self._load(((a, b),), name)
+                left = stack[-1]
+                if left.__class__ is float and right.__class__ is float:
+                    stack[-1] = function(left, right)
+                else:
+                    stack[-1] = binary(operator, left, right)
+            elif op == BINARY:
+                right = pop()
+                left = stack[-1]
+                if left.__class__ is float and right.__class__ is float:
+                    stack[-1] = a(left, right)
+                else:
+                    stack[-1] = binary(c, left, right)
+            elif op == JUMP:
+                pc = a
+            elif op == CONST:
+                push(constants[a])
+            elif op == COMPARE_JUMP:
+                right = pop()
+                left = pop()
+                if left.__class__ is float and right.__class__ is float:
+                    value = c[0](left, right)
+                else:
+                    value = binary(c[1], left, right)
+                if value.__class__ is not bool:
+                    value = isTruthy(value)
+                if value is b:
+                    pc = a
+            elif op == JUMP_IF:
+                value = pop()
+                if value.__class__ is not bool:
+                    value = isTruthy(value)
+                if value is b:
+                    pc = a
+            elif op == ENTER:
+                frames.append([None] * a)
+                types.append([None] * a)
+            elif op == LEAVE:
+                frames.pop()
+                types.pop()
+            elif op == PRINT:
+                print(stringify(pop()))
+            elif op == STORE:
+                value = stack[-1]
+                vtype = types[a][b]
+                if vtype is None:
+                    self._store(((a, b),), c, value)
+                    continue
+                checkAssign(vtype, c, value)
+                frames[a][b] = value
+            elif op == DEFINE:
+                frames[a][b] = checkDefine(c[0], c[1], pop())
+                types[a][b] = c[0]
+            elif op == POP:
+                pop()
+            elif op == OR_JUMP:
+                if isTruthy(stack[-1]):
+                    stack[-1] = True
+                    pc = a
+                else:
+                    pop()
+            elif op == AND_JUMP:
+                if not isTruthy(stack[-1]):
+                    stack[-1] = False
+                    pc = a
+                else:
+                    pop()
+            elif op == TO_BOOL:
+                stack[-1] = True if isTruthy(stack[-1]) else False
+            elif op == UNARY:
+                stack[-1] = unary(c, stack[-1])
+            elif op == LOAD_ANY:
+                push(self._load(a, c))
+            elif op == STORE_ANY:
+                self._store(a, c, stack[-1])
+            elif op == UNWIND:
+                del frames[b:]
+                del types[b:]
+                pc = a
+        if stack:
+            return stack[-1]
+
+    def _load(self, found, name):
+        """ Returns the value of the first defined variable of the frame and
+        slot pairs in found."""
+        for frame, slot in found:
+            if self.types[frame][slot] is not None:
+                value = self.frames[frame][slot]
+                if value is None:
+                    raise exceptions.RuntimeException(
+                        "Line %d Cannot access uninitialized variable" %
+                        name.line)
+                return value
+
+        # Variable is not defined in any scope
+        raise exceptions.RuntimeException("Undefined variable " + name.lexeme)
+
+    def _store(self, found, name, value):
+        """ Assigns value to the first defined variable of the frame and
+        slot pairs in found."""
+        for frame, slot in found:
+            vtype = self.types[frame][slot]
+            if vtype is not None:
+                checkAssign(vtype, name, value)
+                self.frames[frame][slot] = value
+                return
+
+        raise exceptions.RuntimeException(
+            "Line %d Undefined variable %s" % (name.line, name.lexeme))
@@ -3,86 +3,147 @@ Class that mangages runtime environment of sython.
 """
 from handling import exceptions
 
+
+def checkDefine(type, typetok, value):
+    """ Returns the value a variable of the lowercase type name, declared
+    by typetok, starts out with. Raises a RuntimeException when the value
+    does not have that type."""
+    # Check that value type and vartype match
+    # Uninitialized strs are nil, nums are 0 and bools are false
+    if value is not None:
+        if type == "str":
+            if not isinstance(value, str):
+                raise exceptions.RuntimeException(
+                    "Line %d Type error: not str" % typetok.line)
+        if type == "num":
+            if not (isinstance(value, int) or isinstance(value, float)):
+                raise exceptions.RuntimeException(
+                    "Line %d Type error: not a num" % typetok.line)
+        if type == "bool":
+            if not isinstance(value, bool):
+                raise exceptions.RuntimeException(
+                    "Line %d Type error not a bool" % typetok.line)
+    else:
+        if type == "num":
+            value = 0
+        elif type == "bool":
+            value = False
+    return value
+
+
+def checkAssign(vtype, name, value):
+    """ Raises a RuntimeException when value can not be assigned to the
+    variable name of type vtype."""
+    if vtype == "num":
+        if not (isinstance(value, int) or isinstance(value, float)):
+            raise exceptions.RuntimeException("Line %d Type error: not num"
+                                              % name.line)
+    if vtype == "str":
+        if not isinstance(value, str):
+            raise exceptions.RuntimeException("Line %d Type error: not str"
+                                              % name.line)
+    if vtype == "bool":
+        if not isinstance(value, bool):
+            raise exceptions.RuntimeException("Line %d Type error: not bool"
+                                              % name.line)
+
+
 class Environment(object):
+    """ Values and types of the variables a block, or the top level,
+    declares. Both are lists with a slot for each variable, given to it by
+    the resolver along with the dictionary of names to slots. A slot whose
+    type is None is not defined yet."""
 
-    def __init__(self, above=None):
-        self.values = {}
-        self.types = {}
+    def __init__(self, above=None, names=None):
+        if names is None:
+            names = {}
+        self.names = names
+        self.values = [None] * len(names)
+        self.types = [None] * len(names)
         self.scopeAbove = above  # The environment (block) above this one
+        self.blank = (None,) * len(names)
+
+    def extend(self):
+        """ Makes room for the names declared since the environment was
+        made, which the top level of the shell keeps getting."""
+        missing = len(self.names) - len(self.values)
+        self.values.extend([None] * missing)
+        self.types.extend([None] * missing)
+
+    def reuse(self, above, names):
+        """ Takes the environment for running a block declaring names, as
+        many as the environment has slots for, below the environment
+        above."""
+        self.scopeAbove = above
+        self.names = names
 
-    def define(self, name, type, value):
-        typetok = type
-        type = typetok.type
-
-        # Check that value type and vartype match
-        # Uninitialized strs are nil, nums are 0 and bools are false
-        if value is not None:
-            if type.lower() == "str":
-                if not isinstance(value, str):
-                    raise exceptions.RuntimeException(
-                        "Line %d Type error: not str" % typetok.line)
-            if type.lower() == "num":
-                if not (isinstance(value, int) or isinstance(value, float)):
-                    raise exceptions.RuntimeException(
-                        "Line %d Type error: not a num" % typetok.line)
-            if type.lower() == "bool":
-                if not isinstance(value, bool):
-                    raise exceptions.RuntimeException(
-                        "Line %d Type error not a bool" % typetok.line)
-        else:
-            if type.lower() == "num":
-                value = 0
-            elif type.lower() == "bool":
-                value = False
+    def clear(self):
+        """ Undefines every variable and lets go of their values and of the
+        environment above, once the block of the environment has run."""
+        self.scopeAbove = None
+        self.values[:] = self.blank
+        self.types[:] = self.blank
+
+    def define(self, slot, type, typetok, value, safe=False):
+        """ Defines the variable in slot with the lowercase type name,
+        declared by typetok. Values the type checker proved safe are not
+        checked again."""
+        if not safe:
+            value = checkDefine(type, typetok, value)
 
         # Save variable type and value
-        self.types[name] = type.lower()
-        self.values[name] = value
+        self.types[slot] = type
+        self.values[slot] = value
+
+    def assign(self, name, value, depth, slot, safe=False):
+        # Go up to the scope the resolver found the variable in
+        env = self
+        while depth:
+            env = env.scopeAbove
+            depth -= 1
 
-    def assign(self, name, value):
         # Check that variable exists
-        if self.scopeAbove:
-            if not name.lexeme in self.values:
-                self.scopeAbove.assign(name, value)
-                return
-        else:  # At the global level, if not here than var does not exist
-            if not name.lexeme in self.values:
+        if env.types[slot] is None:
+            env, slot = env._outer(name)
+            if env is None:
                 raise exceptions.RuntimeException(
                     "Line %d Undefined variable %s" % (name.line, name.lexeme))
 
         # Variable is in this scope
-        # Check type
-        vtype = self.types[name.lexeme]
-        if vtype == "num":
-            if not (isinstance(value, int) or isinstance(value, float)):
-                raise exceptions.RuntimeException("Line %d Type error: not num"
-                                                  % name.line)
-        if vtype == "str":
-            if not isinstance(value, str):
-                raise exceptions.RuntimeException("Line %d Type error: not str"
-                                                  % name.line)
-        if vtype == "bool":
-            if not isinstance(value, bool):
-                raise exceptions.RuntimeException("Line %d Type error: not bool"
-                                                  % name.line)
-        self.values[name.lexeme] = value
-
-    def get(self, name):
-        # Look for the variable in our scope/env
-        if name.lexeme in self.values:
-            # nums and bools can be accessed before being initialized
-            # nothing else can
-            varval = self.values[name.lexeme]
-            vartype = self.types[name.lexeme]
-            if (vartype != "num" or vartype != "bool") and \
-                    (varval is None):
+        if not safe:
+            checkAssign(env.types[slot], name, value)
+        env.values[slot] = value
+
+    def get(self, name, depth, slot):
+        # Go up to the scope the resolver found the variable in
+        env = self
+        while depth:
+            env = env.scopeAbove
+            depth -= 1
+
+        if env.types[slot] is None:
+            env, slot = env._outer(name)
+            if env is None:
+                # Variable is not defined in any scope
                 raise exceptions.RuntimeException(
-                    "Line %d Cannot access uninitialized variable" % name.line)
-            return self.values[name.lexeme]
+                    "Undefined variable " + name.lexeme)
 
-        # Did not find the variable in our scope so go up the chain
-        if self.scopeAbove:
-            return self.scopeAbove.get(name)
+        # nums and bools can be accessed before being initialized
+        # nothing else can
+        value = env.values[slot]
+        if value is None:
+            raise exceptions.RuntimeException(
+                "Line %d Cannot access uninitialized variable" % name.line)
+        return value
 
-        # Variable is not defined in any scope
-        raise exceptions.RuntimeException("Undefined variable " + name.lexeme)
+    def _outer(self, name):
+        """ Returns the environment and slot of the variable name in the
+        scopes above this one, where it is found while it is not defined
+        here yet, or None and None when no scope has it defined."""
+        env = self.scopeAbove
+        while env is not None:
+            slot = env.names.get(name.lexeme)
+            if slot is not None and env.types[slot] is not None:
+                return env, slot
+            env = env.scopeAbove
+        return None, None
@@ -1,18 +1,35 @@
 """
 Class used to report errors
 """
+import contextlib
+
+from tree import scanner as tok
 
 class Error(object):
+    # Where errors are reported, the output when None
+    file = None
 
     def error(self, token, msg):
-        if token.type == "EOF":
+        if token.kind == tok.EOF:
             self.report(token.line, "at end of file" + msg)
         else:
             self.report(token.line, " at '" + token.lexeme + "' " + msg)
 
     def report(self, line, msg):
-        print("Line %d, %s" % (line, msg))
+        print("Line %d, %s" % (line, msg), file=Error.file)
 
     def runtimeError(self, error):
-        print(str(error))
+        print(str(error), file=Error.file)
         # print("\nline [%s]" % error.token.line)
+
+
+@contextlib.contextmanager
+def reportingTo(file):
+    """ Reports the errors of the scanner, parser and interpreter to file
+    while in the context, instead of where they were reported to."""
+    previous = Error.file
+    Error.file = tok.Error.file = file
+    try:
+        yield
+    finally:
+        Error.file = tok.Error.file = previous
@@ -15,3 +15,11 @@ class RuntimeException(Exception):
         if self.token:
             return "Line %d %s" % (self.token.line, self.msg)
         return self.msg
+
+class BudgetExceeded(RuntimeException):
+    """ Raised when a script runs for more steps, or longer, than its budget
+    allows. budget is "steps" or "time", token is the first token of the
+    statement that was about to run, when it has any."""
+    def __init__(self, msg, budget, token=None):
+        RuntimeException.__init__(self, msg, token)
+        self.budget = budget
@@ -1,19 +1,74 @@
 """
 Main program to execute Sython code.
 """
+import argparse
+import functools
+import io
+import os
 import sys
+from exec import batch, cache, daemon
+from exec.checker import TypeChecker
+from exec.closures import ClosureMachine
 from exec.lexer import Lexer
+from exec.optimizer import Optimizer
+from exec.profiler import Profiler
+from exec.resolver import Resolver
 from exec.syinterpreter import Interpreter
 from exec.syparser import Parser
+from exec.transpiler import PythonMachine
+from exec.vm import VirtualMachine
+from handling.error_reporting import Error, reportingTo
 from tools.ast_printer import Printer
 
+# Lines the profile of a script shows, the most time first
+PROFILE_LINES = 25
+
+# Engines that can run statements, by the name given to --engine
+ENGINES = {
+    "tree": Interpreter,
+    "vm": VirtualMachine,
+    "closure": ClosureMachine,
+    "python": PythonMachine,
+}
+
 class Sython(object):
-    def __init__(self, path_to_file=None):
-        """ Define path_to_file if running a script."""
-        self.lex = Lexer(path_to_file)
-        self.interpreter = Interpreter()
+    def __init__(self, path_to_file=None, stream=False, lex_jobs=1,
+                 engine="tree", use_cache=True, programs=None, max_steps=None,
+                 timeout=None, max_memory=None, profiler=None):
+        """ Define path_to_file if running a script. When stream is set
+        statements are executed as soon as they are parsed, instead of
+        after the whole script has been read. lex_jobs is the number of
+        processes used to scan large scripts. engine names the entry of
+        ENGINES that runs the statements. Unless use_cache is False the
+        parsed statements of a script are kept in a .syc file next to it,
+        and loaded from there while the script does not change. programs
+        is a dictionary of the scripts parsed before, for scripts that are
+        run over and over in the same process. max_steps and timeout limit
+        the steps and seconds the tree walking interpreter runs the script
+        for, and max_memory the characters its strings take. profiler, a
+        Profiler, times every statement the tree walking interpreter
+        runs."""
+        self.path = path_to_file
+        self.use_cache = use_cache
+        self.programs = programs
+        self.lex = Lexer(path_to_file, lex_jobs)
+        self.interpreter = ENGINES[engine]()
+        if max_steps is not None or timeout is not None or \
+                max_memory is not None:
+            self.interpreter.limit(max_steps, timeout, max_memory)
+        if profiler is not None:
+            self.interpreter.profile(profiler)
+        if engine == "python" and path_to_file:
+            # Tracebacks of the compiled script point at its own lines
+            self.interpreter.compiler.filename = path_to_file
+        self.optimizer = Optimizer()
+        self.stream = stream
 
     def execute(self, source=None):
+        if self.stream:
+            par = Parser(self.lex.stream(source))
+            self.interpreter.interpretStream(self._optimized(par.statements()))
+            return
         # We are running the shell
         if source:
             self.lex.execute(source)
@@ -24,31 +79,227 @@ class Sython(object):
             statements = par.parse()
             if not isinstance(statements, list):
                 statements = [statements]
-            self.interpreter.interpret(statements)
+            self._interpret(statements)
         else:
-            self.lex.execute()
-            # for token in self.lex.tokens:
-            #     print(str(token))
-            par = Parser(self.lex.tokens)
-            statements = par.parse()
+            statements = self._parse()
             if not statements:
                 return
             if not isinstance(statements, list):
                 statements = [statements]
-            self.interpreter.interpret(statements)
+            self._interpret(statements)
 
+    def _parse(self):
+        """ Returns the statements of the script, loaded from its cache when
+        the script has not changed since they were cached. Otherwise the
+        script is parsed, and cached when it has no errors, so scripts
+        with errors still report them every time. Scripts parsed before
+        are taken from programs when it is given."""
+        if self.programs is None and (not self.use_cache or not self.path):
+            self.lex.execute()
+            return Parser(self.lex.tokens).parse()
+        with open(self.path, 'rb') as sourceFile:
+            source = sourceFile.read()
+        digest = cache.key(source)
+        if self.programs is not None and digest in self.programs:
+            return cache.decode(self.programs[digest])
+        if self.use_cache:
+            statements = cache.load(self.path, digest)
+            if statements is not None:
+                self._keep(digest, statements)
+                return statements
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        sy = Sython(sys.argv[1])
-        sy.execute()
-    else:
-        sy = Sython()
-        author_info = (" Welcome to the Sython shell, where you can script in "
-        "Sython. Authored by Austin Tercha")
-        print(author_info)
+        reports = io.StringIO()
+        with reportingTo(reports):
+            # Decoded the way the lexer reads the file itself
+            self.lex.execute(io.TextIOWrapper(io.BytesIO(source)).read())
+            statements = Parser(self.lex.tokens).parse()
+        (Error.file or sys.stdout).write(reports.getvalue())
+        if isinstance(statements, list) and None not in statements and \
+                not reports.getvalue():
+            if self.use_cache:
+                cache.store(self.path, digest, statements)
+            self._keep(digest, statements)
+        return statements
+
+    def _keep(self, digest, statements):
+        """ Adds parsed statements to programs. They are kept encoded, as
+        running statements changes them."""
+        if self.programs is not None:
+            self.programs[digest] = cache.encode(statements)
+
+    def _interpret(self, statements):
+        # Statements with parser errors are not run, nor simplified
+        if None not in statements:
+            statements = self.optimizer.optimize(statements)
+        self.interpreter.interpret(statements)
+
+    def _optimized(self, statements):
+        """ Yields the simplified form of statements as they are parsed."""
+        for statement in statements:
+            if statement is not None:
+                statement = self.optimizer.optimize([statement])[0]
+            yield statement
+
+    def check(self):
+        """ Parses and checks the types of the script without running it.
+        Returns False when it has errors, after reporting them."""
+        statements = self._parse()
+        if statements is None or None in statements:
+            return False
+        statements = self.optimizer.optimize(statements)
+        return TypeChecker(Resolver()).check(statements)
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(prog="sython",
+                                     description="Run Sython scripts.")
+    parser.add_argument("script", nargs="?",
+                        help="script to run, starts the shell if not given")
+    parser.add_argument("--stream", action="store_true",
+                        help="execute statements while the script is read")
+    parser.add_argument("--lex-jobs", type=int, default=1, metavar="N",
+                        help="scan large scripts on N processes")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="tree",
+                        help="run statements by walking the tree, on the "
+                        "bytecode virtual machine, as compiled closures or "
+                        "translated into Python")
+    parser.add_argument("--check", action="store_true",
+                        help="only check the types of the script, exits "
+                        "with 1 when it has errors")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse the script again instead of loading it "
+                        "from its .syc file, and write no .syc file")
+    parser.add_argument("--serve", action="store_true",
+                        help="keep running as a daemon that runs the "
+                        "scripts sythonc.py sends it")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="Unix socket the daemon listens on, by default "
+                        "one in a directory only the user can use")
+    parser.add_argument("--max-jobs", type=int, metavar="N",
+                        help="scripts the daemon runs at the same time, by "
+                        "default the number of CPUs")
+    parser.add_argument("--batch", metavar="DIR|GLOB",
+                        help="run every script in a directory, or matching "
+                        "a glob pattern, on a pool of processes")
+    parser.add_argument("-j", "--jobs", type=int, metavar="N",
+                        help="processes --batch runs scripts on, by default "
+                        "the number of CPUs")
+    parser.add_argument("--batch-output", default="sython-batch",
+                        metavar="DIR",
+                        help="directory --batch writes the output and errors "
+                        "of every script to, along with a summary")
+    parser.add_argument("--max-steps", type=int, metavar="N",
+                        help="stop scripts after N passes through loops and "
+                        "blocks, only with the tree engine")
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+                        help="stop scripts that run for longer, only with "
+                        "the tree engine")
+    parser.add_argument("--max-memory", type=int, metavar="N",
+                        help="stop scripts once their strings take more than "
+                        "N characters, only with the tree engine")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every line and kind of statement of the "
+                        "script and print the lines that took longest, "
+                        "only with the tree engine")
+    parser.add_argument("--profile-stacks", metavar="FILE",
+                        help="profile the script and write the time of its "
+                        "statements in the collapsed stack format of flame "
+                        "graph tools")
+    args = parser.parse_args(argv)
+    if (args.max_steps is not None or args.timeout is not None or
+            args.max_memory is not None) and args.engine != "tree":
+        parser.error("--max-steps, --timeout and --max-memory need --engine "
+                     "tree")
+    if (args.profile or args.profile_stacks) and args.engine != "tree":
+        parser.error("--profile and --profile-stacks need --engine tree")
+    return args
+
+
+def run(args):
+    """ Checks or runs the script of the parsed arguments, returns the exit
+    status."""
+    if args.check:
+        sy = Sython(args.script, lex_jobs=args.lex_jobs,
+                    use_cache=not args.no_cache)
+        return 0 if sy.check() else 1
+    profiler = None
+    if args.profile or args.profile_stacks:
+        profiler = Profiler()
+    sy = Sython(args.script, stream=args.stream, lex_jobs=args.lex_jobs,
+                engine=args.engine, use_cache=not args.no_cache,
+                max_steps=args.max_steps, timeout=args.timeout,
+                max_memory=args.max_memory, profiler=profiler)
+    sy.execute()
+    if profiler is not None:
+        reportProfile(args, profiler)
+    return 0
+
+
+def reportProfile(args, profiler):
+    """ Prints the profile of the script after it ran, apart from what the
+    script printed, and writes its stacks when asked to."""
+    with open(args.script, "r") as script:
+        source = script.read()
+    profiler.report(sys.stderr, source, PROFILE_LINES)
+    if args.profile_stacks:
+        with open(args.profile_stacks, "w") as stacks:
+            profiler.writeStacks(stacks, os.path.basename(args.script))
+
+
+# Programs of the scripts a batch worker ran, for the scripts that repeat
+_programs = {}
+
+
+def runBatchScript(args, path, repeated):
+    """ Runs one script of a batch on a worker, with a new interpreter."""
+    sy = Sython(path, engine=args.engine, use_cache=not args.no_cache,
+                programs=_programs if repeated else None,
+                max_steps=args.max_steps, timeout=args.timeout,
+                max_memory=args.max_memory)
+    sy.execute()
+
+
+def runJob(argv):
+    """ Runs a script for a client of the daemon, in a process of its own
+    with a new interpreter."""
+    args = parseArgs(argv)
+    if not args.script or args.serve or args.batch:
+        print("sython: the daemon only runs scripts", file=sys.stderr)
+        return 2
+    return run(args)
+
+
+def main(argv):
+    args = parseArgs(argv)
+    if args.serve:
+        try:
+            daemon.Server(runJob, args.socket, args.max_jobs).serve()
+        except OSError as error:
+            print("sython: %s" % error, file=sys.stderr)
+            return 1
+        return 0
+    if args.batch:
+        paths = batch.findScripts(args.batch)
+        if not paths:
+            print("sython: no scripts match %s" % args.batch, file=sys.stderr)
+            return 2
+        runScript = functools.partial(runBatchScript, args)
+        failed = batch.Batch(runScript, args.batch_output,
+                             args.jobs).execute(paths)
+        return 1 if failed else 0
+    if args.script:
+        return run(args)
+    sy = Sython(engine=args.engine)
+    author_info = (" Welcome to the Sython shell, where you can script in "
+    "Sython. Authored by Austin Tercha")
+    print(author_info)
+    uinput = input(">>> ")
+    sy.execute(uinput)
+    while uinput != "quit":
         uinput = input(">>> ")
         sy.execute(uinput)
-        while uinput != "quit":
-            uinput = input(">>> ")
-            sy.execute(uinput)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
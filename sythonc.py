@@ -0,0 +1,30 @@
+"""
+Runs a Sython script on the daemon started with sython --serve, which skips
+starting the interpreter. Takes the arguments of sython.py, and --socket
+PATH for a daemon listening somewhere else. Runs the script itself when no
+daemon is listening.
+"""
+import sys
+
+from exec import daemon
+
+
+def main(argv):
+    path = None
+    if argv[:1] == ["--socket"] and len(argv) > 1:
+        path, argv = argv[1], argv[2:]
+    try:
+        return daemon.request(argv, path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # No daemon is listening
+        pass
+    except PermissionError as error:
+        # Someone else could be listening, the script is not sent to them
+        print("sythonc: %s, running the script here" % error,
+              file=sys.stderr)
+    import sython
+    return sython.main(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,599 @@
+"""
+Used for measuring the speed of the interpreter. Generates a large Sython
+script and times the different parts of the interpreter against it.
+
+    python tools/benchmark.py scanner [lines]
+    python tools/benchmark.py lexer [lines]
+    python tools/benchmark.py incremental [lines]
+    python tools/benchmark.py parser [lines]
+    python tools/benchmark.py interpreter [iterations]
+    python tools/benchmark.py hoisting [iterations]
+    python tools/benchmark.py ast [lines]
+    python tools/benchmark.py cache [lines]
+    python tools/benchmark.py daemon [lines]
+    python tools/benchmark.py batch [scripts]
+    python tools/benchmark.py embed [runs]
+    python tools/benchmark.py async [iterations]
+    python tools/benchmark.py budget [iterations]
+    python tools/benchmark.py memory [iterations]
+    python tools/benchmark.py profile [iterations]
+"""
+import asyncio
+import contextlib
+import functools
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sython
+from exec import batch, cache, daemon
+from exec.closures import ClosureMachine
+from exec.incremental import Document
+from exec.lexer import scanParallel
+from exec.profiler import Profiler
+from exec.program import compile as compileProgram
+from exec.syinterpreter import Interpreter
+from exec.syparser import Parser
+from exec.transpiler import PythonMachine
+from exec.vm import VirtualMachine
+from tree import expressions as exp
+from tree import scanner as tok
+from tree.scanner import Scanner, Token, TokenType
+
+
+class LegacyScanner(Scanner):
+    """ Scanner that only uses the character by character scanner,
+    the way every token used to be scanned."""
+
+    def scanTokens(self):
+        while not self._atEnd():
+            self.start = self.current
+            self._scanToken()
+
+        self.tokenList.append(Token(TokenType("EOF"), "", None, self.line))
+        return self.tokenList
+
+
+class LegacyParser(Parser):
+    """ Parser that goes through one method per precedence level,
+    the way expressions used to be parsed."""
+
+    def expression(self):
+        return self.assignment()
+
+    def assignment(self):
+        expr = self.ore()
+
+        if self._match(tok.EQUAL):
+            eq = self._previous()
+            value = self.assignment()
+
+            if isinstance(expr, exp.Variable):
+                return exp.Assign(expr.name, value)
+            self.error(eq, "Invalid assignment")
+        return expr
+
+    def _level(self, operand, node, *kinds):
+        expr = operand()
+        while self._match(*kinds):
+            operator = self._previous()
+            expr = node(expr, operator, operand())
+        return expr
+
+    def ore(self):
+        return self._level(self.andd, exp.Logical, tok.OR)
+
+    def andd(self):
+        return self._level(self.equality, exp.Logical, tok.AND)
+
+    def equality(self):
+        return self._level(self.comparison, exp.Binary,
+                           tok.BANG_EQUAL, tok.EQUAL_EQUAL)
+
+    def comparison(self):
+        return self._level(self.addition, exp.Binary, tok.GREATER,
+                           tok.GREATER_EQUAL, tok.LESS, tok.LESS_EQUAL)
+
+    def addition(self):
+        return self._level(self.multiplication, exp.Binary,
+                           tok.MINUS, tok.PLUS)
+
+    def multiplication(self):
+        return self._level(self.unary, exp.Binary, tok.SLASH, tok.STAR)
+
+    def unary(self):
+        if self._match(tok.BANG, tok.MINUS):
+            operator = self._previous()
+            return exp.Unary(operator, self.unary())
+        return self.primary()
+
+    def primary(self):
+        if self._match(tok.FALSE):
+            return exp.Literal(False)
+        if self._match(tok.TRUE):
+            return exp.Literal(True)
+        if self._match(tok.NIL):
+            return exp.Literal(None)
+        if self._match(tok.STRING, tok.NUMBER):
+            return exp.Literal(self._previous().literal)
+        if self._match(tok.LEFT_PAREN):
+            expr = self.expression()
+            self._consume(tok.RIGHT_PAREN, "Expected ')' after expression")
+            return exp.Grouping(expr)
+        if self._match(tok.IDENTIFIER):
+            return exp.Variable(self._previous())
+        raise self.error(self._peek(), " Expected expression")
+
+
+def generateSource(lines):
+    """ Returns a Sython script with roughly the given number of lines."""
+    chunk = ['# generated block %d',
+             'num a%d = 12.5 * (3 + 4) / 2;',
+             'str s%d = "some text";',
+             'bool b%d = a%d >= 10 and true;',
+             'while (a%d > 0) {',
+             '    a%d = a%d - 1;',
+             '    if (a%d == 3) { break; } elseif (a%d != 4) { pass; }',
+             '}',
+             'print s%d;']
+    out = []
+    i = 0
+    while len(out) < lines:
+        for line in chunk:
+            out.append(line.replace('%d', str(i)))
+        i += 1
+    return '\n'.join(out) + '\n'
+
+
+# Loop heavy script, ITERATIONS is replaced by the number of iterations
+LOOP_SOURCE = """
+num total = 0;
+num count = 0;
+str label = "";
+num i = 0;
+while (i < ITERATIONS) {
+    num j = 0;
+    until (j >= 10) {
+        total = total + (i * 2 + j) / 4 - 1;
+        if (j == 3 or j == 7) {
+            count = count + 1;
+        } elseif (j > 8 and i > 2) {
+            total = total - 1;
+        } else {
+            pass;
+        }
+        j = j + 1;
+    }
+    if (i < 3) {
+        label = label + "x";
+    }
+    i = i + 1;
+}
+print total;
+print count;
+print label;
+"""
+
+
+# Numeric loops with work that does not change while they run,
+# ITERATIONS is replaced by the number of iterations
+INVARIANT_SOURCE = """
+num width = 640;
+num height = 480;
+num scale = 2.5;
+num total = 0;
+num i = 0;
+while (i < ITERATIONS) {
+    num j = 0;
+    until (j >= 10) {
+        total = total + (width * height) / (scale * scale) + j * (scale - 1)
+            - (i * 2 + j * 3) / (i * 2 + j * 3 + 1);
+        j = j + 1;
+    }
+    i = i + 1;
+}
+print total;
+"""
+
+
+def timeit(func, repeat=3):
+    """ Returns the best wall time of running func repeat times and
+    the result of the last run."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def benchScanner(lines):
+    source = generateSource(lines)
+    print("Scanning %d lines (%d characters)" % (lines, len(source)))
+    for name, cls in (("legacy", LegacyScanner), ("scanner", Scanner)):
+        elapsed, tokens = timeit(lambda: cls(source).scanTokens())
+        print("%-10s %8.3fs  %10.0f tokens/s" % (name, elapsed,
+                                                 len(tokens) / elapsed))
+
+
+def benchLexer(lines):
+    source = generateSource(lines)
+    print("Scanning %d lines (%d characters) on %d cores" %
+          (lines, len(source), os.cpu_count()))
+    base, tokens = timeit(lambda: Scanner(source).scanTokens())
+    print("%-10s %8.3fs  %10.0f tokens/s" % ("sequential", base,
+                                             len(tokens) / base))
+    jobs = 1
+    while jobs <= os.cpu_count():
+        elapsed, tokens = timeit(lambda: scanParallel(source, jobs))
+        print("%-10s %8.3fs  %10.0f tokens/s  %5.2fx" % (
+              "%d jobs" % jobs, elapsed, len(tokens) / elapsed,
+              base / elapsed))
+        jobs *= 2
+
+
+def benchIncremental(lines):
+    print("Editing the middle of scripts up to %d lines long" % lines)
+    size = 1000
+    while size <= lines:
+        doc = Document(generateSource(size))
+        offset = doc.source.index("12.5", len(doc.source) // 2)
+        sameLine, _ = timeit(lambda: doc.edit(offset, 1, "3"))
+        newLine, _ = timeit(lambda: (doc.edit(offset, 0, "\n"),
+                                     doc.edit(offset, 1, "")))
+        print("%8d lines  %8.3fms per edit  %8.3fms per line break" %
+              (size, sameLine * 1000, newLine * 500))
+        size *= 10
+
+
+def benchParser(lines):
+    tokens = Scanner(generateSource(lines)).scanTokens()
+    print("Parsing %d lines (%d tokens)" % (lines, len(tokens)))
+    for name, cls in (("legacy", LegacyParser), ("parser", Parser)):
+        elapsed, _ = timeit(lambda: cls(tokens).parse())
+        print("%-10s %8.3fs  %10.0f tokens/s" % (name, elapsed,
+                                                 len(tokens) / elapsed))
+
+
+def loopProgram(iterations):
+    """ Returns the parsed statements of the loop heavy script."""
+    source = LOOP_SOURCE.replace("ITERATIONS", str(iterations))
+    return Parser(Scanner(source).scanTokens()).parse()
+
+
+def runQuietly(run):
+    """ Runs a function with its printing captured and returns the
+    printed output."""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        run()
+    return out.getvalue()
+
+
+def benchInterpreter(iterations):
+    statements = loopProgram(iterations)
+    print("Running %d loop iterations" % (iterations * 10))
+    base = None
+    for name, cls in (("interpreter", Interpreter), ("vm", VirtualMachine),
+                      ("closures", ClosureMachine),
+                      ("python", PythonMachine)):
+        elapsed, output = timeit(lambda: runQuietly(
+            lambda: cls().interpret(statements)))
+        if base is None:
+            base, expected = elapsed, output
+        elif output != expected:
+            print("%-12s printed something else" % name)
+        print("%-12s %8.3fs  %5.2fx" % (name, elapsed, base / elapsed))
+
+
+def benchHoisting(iterations):
+    source = INVARIANT_SOURCE.replace("ITERATIONS", str(iterations))
+    print("Running %d loop iterations with and without hoisting" %
+          (iterations * 10))
+    for name, cls in (("interpreter", Interpreter), ("vm", VirtualMachine),
+                      ("closures", ClosureMachine),
+                      ("python", PythonMachine)):
+        times = []
+        for enabled in (False, True):
+            def run():
+                machine = cls()
+                machine.hoister.enabled = enabled
+                # Statements are changed by hoisting, every run parses them
+                machine.interpret(Parser(Scanner(source).scanTokens()).parse())
+            elapsed, output = timeit(lambda: runQuietly(run))
+            times.append(elapsed)
+            if enabled and output != expected:
+                print("%-12s printed something else" % name)
+            expected = output
+        print("%-12s %8.3fs  %8.3fs  %5.2fx" % (name, times[0], times[1],
+                                                times[0] / times[1]))
+
+
+def benchAst(lines):
+    tokens = Scanner(generateSource(lines)).scanTokens()
+    tracemalloc.start()
+    statements = Parser(tokens).parse()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("Statements of %d lines take %.1fMB, %.0f bytes per line" %
+          (lines, size / 1e6, size / float(lines)))
+
+
+def benchCache(lines):
+    source = generateSource(lines).encode()
+    print("Loading %d lines (%d characters)" % (lines, len(source)))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "script.sy")
+        with open(path, "wb") as script:
+            script.write(source)
+        parse, statements = timeit(lambda: Parser(
+            Scanner(source.decode()).scanTokens()).parse())
+        digest = cache.key(source)
+        store, _ = timeit(lambda: cache.store(path, digest, statements))
+        load, _ = timeit(lambda: cache.load(path, cache.key(source)))
+        size = os.path.getsize(cache.cachePath(path))
+    print("%-10s %8.3fs" % ("parse", parse))
+    print("%-10s %8.3fs  %5.2fx  %d bytes" % ("load", load, parse / load,
+                                              size))
+    print("%-10s %8.3fs" % ("store", store))
+
+
+def benchDaemon(lines):
+    source = generateSource(lines)
+    print("Running a script of %d lines in a new process and on the daemon"
+          % lines)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "script.sy")
+        with open(path, "w") as script:
+            script.write(source)
+        address = os.path.join(directory, "daemon.sock")
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "sython.py"), "--serve",
+             "--socket", address])
+        try:
+            while True:
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    probe.connect(address)
+                    break
+                except OSError:
+                    time.sleep(0.01)
+                finally:
+                    probe.close()
+
+            def command(program, *options):
+                return lambda: subprocess.run(
+                    [sys.executable, os.path.join(ROOT, program)] +
+                    list(options) + [path], stdout=subprocess.DEVNULL,
+                    check=True)
+            runs = (
+                ("process", command("sython.py")),
+                ("client", command("sythonc.py", "--socket", address)),
+                ("request", lambda: runQuietly(
+                    lambda: daemon.request([path], address))),
+            )
+            base = None
+            for name, run in runs:
+                # The first run writes the .syc file
+                elapsed, _ = timeit(run, repeat=10)
+                if base is None:
+                    base = elapsed
+                print("%-10s %8.1fms  %5.2fx" % (name, elapsed * 1000,
+                                                 base / elapsed))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def runScript(path, repeated):
+    """ Runs a script of the batch benchmark."""
+    sython.Sython(path, use_cache=False).execute()
+
+
+def benchBatch(scripts):
+    source = LOOP_SOURCE.replace("ITERATIONS", "1000")
+    print("Running %d scripts one after another and on a pool of processes"
+          % scripts)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index in range(scripts):
+            paths.append(os.path.join(directory, "script%d.sy" % index))
+            with open(paths[-1], "w") as script:
+                # Every script is different, none are parsed only once
+                script.write("print %d;\n%s" % (index, source))
+        base, _ = timeit(lambda: runQuietly(
+            lambda: [runScript(path, False) for path in paths]), repeat=1)
+        print("%-10s %8.3fs" % ("serial", base))
+        jobs = 1
+        while jobs <= os.cpu_count():
+            runner = batch.Batch(runScript, os.path.join(directory, "out"),
+                                 jobs)
+            elapsed, _ = timeit(lambda: runQuietly(
+                functools.partial(runner.execute, paths)), repeat=1)
+            print("%-10s %8.3fs  %5.2fx" % ("%d jobs" % jobs, elapsed,
+                                            base / elapsed))
+            jobs *= 2
+
+
+RULE_SOURCE = """
+num score = amount * rate;
+if (score > limit) {
+    print name + " over the limit";
+} elseif (score > limit / 2) {
+    print name + " near the limit";
+}
+"""
+
+
+def benchEmbed(runs):
+    parameters = {"amount": "num", "rate": "num", "limit": "num",
+                  "name": "str"}
+    declarations = "".join("%s %s = %s;\n" % (vtype, name,
+                                               '"a"' if vtype == "str" else 1)
+                           for name, vtype in parameters.items())
+    print("Running a rule %d times with different values" % runs)
+
+    def parseEveryTime():
+        for index in range(runs):
+            statements = Parser(Scanner(
+                declarations + RULE_SOURCE).scanTokens()).parse()
+            Interpreter().interpret(statements)
+    base, _ = timeit(lambda: runQuietly(parseEveryTime), repeat=1)
+    print("%-10s %8.3fs  %8.0f runs/s" % ("parse", base, runs / base))
+
+    program = compileProgram(RULE_SOURCE, parameters)
+    elapsed, _ = timeit(lambda: [program.run(
+        {"amount": index, "rate": 1.5, "limit": 100, "name": "a"})
+        for index in range(runs)], repeat=1)
+    print("%-10s %8.3fs  %8.0f runs/s  %5.2fx" % ("program", elapsed,
+                                                  runs / elapsed,
+                                                  base / elapsed))
+
+
+def benchAsync(iterations):
+    print("Running %d loop iterations on an event loop, in slices of 5ms"
+          % (iterations * 10))
+    base, expected = timeit(lambda: runQuietly(
+        lambda: Interpreter().interpret(loopProgram(iterations))))
+    print("%-10s %8.3fs" % ("interpret", base))
+
+    async def measure():
+        # Longest a task waking up every millisecond had to wait
+        gaps = []
+
+        async def other():
+            last = time.perf_counter()
+            while True:
+                await asyncio.sleep(0.001)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+        task = asyncio.ensure_future(other())
+        await Interpreter().interpretAsync(loopProgram(iterations),
+                                           slice_ms=5)
+        task.cancel()
+        return max(gaps)
+
+    gaps = []
+    elapsed, output = timeit(lambda: runQuietly(
+        lambda: gaps.append(asyncio.run(measure()))))
+    if output != expected:
+        print("async printed something else")
+    print("%-10s %8.3fs  %5.2fx  longest wait %.1fms" % (
+          "async", elapsed, base / elapsed, max(gaps) * 1000))
+
+
+def benchBudget(iterations):
+    print("Running %d loop iterations with and without budgets" %
+          (iterations * 10))
+    base = None
+    for name, steps, seconds in (("none", None, None),
+                                 ("steps", 10 ** 12, None),
+                                 ("time", None, 3600.0),
+                                 ("both", 10 ** 12, 3600.0)):
+        def run():
+            interpreter = Interpreter()
+            # The baseline never calls limit, so it runs the way scripts
+            # without a budget do
+            if steps is not None or seconds is not None:
+                interpreter.limit(steps, seconds)
+            interpreter.interpret(loopProgram(iterations))
+        elapsed, output = timeit(lambda: runQuietly(run))
+        if base is None:
+            base, expected = elapsed, output
+        elif output != expected:
+            print("%-10s printed something else" % name)
+        print("%-10s %8.3fs  %+6.1f%%" % (name, elapsed,
+                                          (elapsed / base - 1) * 100))
+
+
+STRING_SOURCE = """
+str line = "";
+str word = "sython";
+num i = 0;
+while (i < ITERATIONS) {
+    str pair = word + " " + word;
+    line = pair + "!";
+    i = i + 1;
+}
+print line;
+"""
+
+
+def benchMemory(iterations):
+    print("Running %d loop iterations and %d concatenating ones with and "
+          "without a memory budget" % (iterations * 10, iterations))
+    strings = STRING_SOURCE.replace("ITERATIONS", str(iterations))
+    for label, program in (
+            ("loops", lambda: loopProgram(iterations)),
+            ("strings", lambda: Parser(Scanner(strings).scanTokens())
+             .parse())):
+        base = None
+        for name, memory in (("none", None), ("memory", 10 ** 12)):
+            def run():
+                interpreter = Interpreter()
+                interpreter.limit(memory=memory)
+                interpreter.interpret(program())
+            elapsed, output = timeit(lambda: runQuietly(run))
+            if base is None:
+                base, expected = elapsed, output
+            elif output != expected:
+                print("%-10s printed something else" % name)
+            print("%-8s %-8s %8.3fs  %+6.1f%%" % (
+                  label, name, elapsed, (elapsed / base - 1) * 100))
+
+
+def benchProfile(iterations):
+    print("Running %d loop iterations with and without profiling" %
+          (iterations * 10))
+    base = None
+    for name, profiled in (("none", False), ("profile", True)):
+        def run():
+            interpreter = Interpreter()
+            if profiled:
+                interpreter.profile(Profiler())
+            interpreter.interpret(loopProgram(iterations))
+        elapsed, output = timeit(lambda: runQuietly(run))
+        if base is None:
+            base, expected = elapsed, output
+        elif output != expected:
+            print("%-10s printed something else" % name)
+        print("%-10s %8.3fs  %+6.1f%%" % (name, elapsed,
+                                          (elapsed / base - 1) * 100))
+
+
+BENCHMARKS = {
+    "scanner": benchScanner,
+    "lexer": benchLexer,
+    "incremental": benchIncremental,
+    "parser": benchParser,
+    "interpreter": benchInterpreter,
+    "hoisting": benchHoisting,
+    "ast": benchAst,
+    "cache": benchCache,
+    "daemon": benchDaemon,
+    "batch": benchBatch,
+    "embed": benchEmbed,
+    "async": benchAsync,
+    "budget": benchBudget,
+    "memory": benchMemory,
+    "profile": benchProfile,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: benchmark.py <%s> [size]" % "|".join(BENCHMARKS))
+        sys.exit(1)
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    BENCHMARKS[sys.argv[1]](size)
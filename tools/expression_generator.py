@@ -36,48 +36,116 @@ class ExpGen(object):
         "Continue": "x",
         "Pass": "x"
         }
+        # Fields filled in by the resolver and the type checker before
+        # statements run, which the constructor sets to None
+        self.resolved_map = {
+        "Assign": "depth, slot, safe",
+        "Binary": "apply, types",
+        "Logical": "types",
+        "Unary": "types",
+        "Variable": "depth, slot, types",
+        "Var": "slot, vtype, safe",
+        "Block": "names",
+        "While": "jumps",
+        "For": "jumps",
+        "Do": "jumps",
+        "Until": "jumps"
+        }
         self.path_to_file = ("%s/%s.py" % (self.outputdir, self.filename))
         self.expfile = open("%s" % self.path_to_file, 'w')
 
-    def _setupFile(self):
+    def _fields(self, classname, map):
+        """ Returns the field names of a class as a list."""
+        return [param.strip() for param in map[classname].split(',')]
+
+    def _kindName(self, classname):
+        return classname.upper()
+
+    def _setupFile(self, map):
         file_preamble = ("# This file was generated by the expresion_"
                          "generator tool.\n# Holds all of the expression"
                          " classes.\n\n")
         self.expfile.write(file_preamble)
 
+        # Write the integer kind of every class, in the order of the map
+        self.expfile.write("# Kind of every node, indexes the dispatch "
+                           "table of the visitor\n")
+        for kind, classname in enumerate(map):
+            self.expfile.write("%s = %d\n" % (self._kindName(classname),
+                                              kind))
+        self.expfile.write("\n")
+
         # Write the base class shared by all
-        base_class = ("class %s():\n" % self.basename)
+        base_class = ("class %s(object):\n" % self.basename)
         self.expfile.write(base_class)
+        self.expfile.write("\t__slots__ = ()\n\t_fields = ()\n"
+                           "\tkind = -1\n\n")
 
         # Add abstract method to the base class
         abstract_vis = ("\tdef accept(self, visitor):\n\t\tpass\n\n")
         self.expfile.write(abstract_vis)
 
-    def _addVisitor(self, types, basename):
-        class_sign = ("class Visitor(object):\n\t")
-        self.expfile.write(class_sign)
+    def _addVisitor(self, map):
+        """ Writes a visitor base class that dispatches on the kind of a
+        node through a table of bound visit methods."""
+        table = "_%sTable" % self.basename.lower()
+        visits = "_%sVisits" % self.basename.lower()
+        param = self.basename.lower()
+
+        self.expfile.write("class %sVisitor(object):\n" % self.basename)
+        self.expfile.write("\t\"\"\" Dispatches on the kind of a node through "
+                           "a table of bound visit\n\tmethods instead of "
+                           "calling accept on the node.\"\"\"\n\n")
+
+        names = ", ".join("'visit%s'" % classname for classname in map)
+        self.expfile.write("\t%s = (%s)\n\n" % (visits, names))
+
+        self.expfile.write("\tdef __init__(self):\n")
+        self.expfile.write("\t\tself.%s = tuple(getattr(self, name) "
+                           "for name in self.%s)\n\n" % (table, visits))
+
+        self.expfile.write("\tdef dispatch%s(self, %s):\n" % (self.basename,
+                                                            param))
+        self.expfile.write("\t\treturn self.%s[%s.kind](%s)\n" %
+                           (table, param, param))
 
-        for typename in types:
-            method_sig = ("def visit%s%s(%s):\n" % (typename, basename,
-                                                 basename.lower()))
+        for classname in map:
+            method_sig = ("\n\tdef visit%s(self, %s):\n" % (classname, param))
             self.expfile.write(method_sig)
             self.expfile.write("\t\tpass\n")
 
     def _addClass(self, classname, map):
-        class_sign = ("class %s(%s):\n\t" % (classname, self.basename))
+        class_sign = ("class %s(%s):\n" % (classname, self.basename))
         self.expfile.write(class_sign)
 
+        # Add slots, field names and kind
+        fields = self._fields(classname, map)
+        resolved = []
+        if classname in self.resolved_map:
+            resolved = self._fields(classname, self.resolved_map)
+        slots = ", ".join("'%s'" % field for field in fields + resolved)
+        if len(fields + resolved) == 1:
+            slots += ","
+        names = ", ".join("'%s'" % field for field in fields)
+        if len(fields) == 1:
+            names += ","
+        self.expfile.write("\t__slots__ = (%s)\n" % slots)
+        self.expfile.write("\t_fields = (%s)\n" % names)
+        self.expfile.write("\tkind = %s\n\n\t" % self._kindName(classname))
+
         # Add constructor
         class_params = map[classname]
         init = ("def __init__(self, %s):\n" % class_params)
         self.expfile.write(init)
 
         # Add field definitions to constructor
-        class_params = class_params.split(',')
-        for param in class_params:
-            param = param.strip()
+        for param in fields:
             field_def = "\t\tself.%s = %s\n" % (param, param)
             self.expfile.write(field_def)
+        if resolved:
+            self.expfile.write("\t\t# Filled in before the statements run\n")
+        for field in resolved:
+            self.expfile.write("\t\tself.%s = None\n" % field)
 
         # Add accept method
         accept_sig = ("\n\tdef accept(self, visitor):\n")
@@ -86,19 +154,23 @@ class ExpGen(object):
         self.expfile.write(accept_body)
 
     def designAst(self):
-        # Add the file preamble and the base class
-        self._setupFile()
-
-        # Add each class to file
+        # Pick the classes for this file
         if self.basename == "Expression":
             map = self.exp_map
         elif self.basename == "Stmt":
             map = self.stmt_map
 
+        # Add the file preamble and the base class
+        self._setupFile(map)
+
+        # Add each class to file
         for classname in map:
             self._addClass(classname, map)
             self.expfile.write("\n")
 
+        # Add the visitor base class
+        self._addVisitor(map)
+
 
     def tear_down(self):
         self.expfile.close()
@@ -1,37 +1,76 @@
 # This file was generated by the expresion_generator tool.
 # Holds all of the expression classes.
 
-class Expression():
+# Kind of every node, indexes the dispatch table of the visitor
+ASSIGN = 0
+BINARY = 1
+LOGICAL = 2
+GROUPING = 3
+LITERAL = 4
+UNARY = 5
+CALL = 6
+VARIABLE = 7
+
+class Expression(object):
+	__slots__ = ()
+	_fields = ()
+	kind = -1
+
 	def accept(self, visitor):
 		pass
 
 class Assign(Expression):
+	__slots__ = ('name', 'value', 'depth', 'slot', 'safe')
+	_fields = ('name', 'value')
+	kind = ASSIGN
+
 	def __init__(self, name, value):
 		self.name = name
 		self.value = value
+		# Filled in before the statements run
+		self.depth = None
+		self.slot = None
+		self.safe = None
 
 	def accept(self, visitor):
 		return visitor.visitAssign(self)
 
 class Binary(Expression):
+	__slots__ = ('left', 'operator', 'right', 'apply', 'types')
+	_fields = ('left', 'operator', 'right')
+	kind = BINARY
+
 	def __init__(self, left, operator, right):
 		self.left = left
 		self.operator = operator
 		self.right = right
+		# Filled in before the statements run
+		self.apply = None
+		self.types = None
 
 	def accept(self, visitor):
 		return visitor.visitBinary(self)
 
 class Logical(Expression):
+	__slots__ = ('left', 'operator', 'right', 'types')
+	_fields = ('left', 'operator', 'right')
+	kind = LOGICAL
+
 	def __init__(self, left, operator, right):
 		self.left = left
 		self.operator = operator
 		self.right = right
+		# Filled in before the statements run
+		self.types = None
 
 	def accept(self, visitor):
 		return visitor.visitLogical(self)
 
 class Grouping(Expression):
+	__slots__ = ('expression',)
+	_fields = ('expression',)
+	kind = GROUPING
+
 	def __init__(self, expression):
 		self.expression = expression
 
@@ -39,6 +78,10 @@ class Grouping(Expression):
 		return visitor.visitGrouping(self)
 
 class Literal(Expression):
+	__slots__ = ('val',)
+	_fields = ('val',)
+	kind = LITERAL
+
 	def __init__(self, val):
 		self.val = val
 
@@ -46,17 +89,79 @@ class Literal(Expression):
 		return visitor.visitLiteral(self)
 
 class Unary(Expression):
+	__slots__ = ('operator', 'right', 'types')
+	_fields = ('operator', 'right')
+	kind = UNARY
+
 	def __init__(self, operator, right):
 		self.operator = operator
 		self.right = right
+		# Filled in before the statements run
+		self.types = None
 
 	def accept(self, visitor):
 		return visitor.visitUnary(self)
 
+class Call(Expression):
+	__slots__ = ('callee', 'paren', 'arguments')
+	_fields = ('callee', 'paren', 'arguments')
+	kind = CALL
+
+	def __init__(self, callee, paren, arguments):
+		self.callee = callee
+		self.paren = paren
+		self.arguments = arguments
+
+	def accept(self, visitor):
+		return visitor.visitCall(self)
+
 class Variable(Expression):
+	__slots__ = ('name', 'depth', 'slot', 'types')
+	_fields = ('name',)
+	kind = VARIABLE
+
 	def __init__(self, name):
 		self.name = name
+		# Filled in before the statements run
+		self.depth = None
+		self.slot = None
+		self.types = None
 
 	def accept(self, visitor):
 		return visitor.visitVariable(self)
 
+class ExpressionVisitor(object):
+	""" Dispatches on the kind of a node through a table of bound visit
+	methods instead of calling accept on the node."""
+
+	_expressionVisits = ('visitAssign', 'visitBinary', 'visitLogical', 'visitGrouping', 'visitLiteral', 'visitUnary', 'visitCall', 'visitVariable')
+
+	def __init__(self):
+		self._expressionTable = tuple(getattr(self, name) for name in self._expressionVisits)
+
+	def dispatchExpression(self, expression):
+		return self._expressionTable[expression.kind](expression)
+
+	def visitAssign(self, expression):
+		pass
+
+	def visitBinary(self, expression):
+		pass
+
+	def visitLogical(self, expression):
+		pass
+
+	def visitGrouping(self, expression):
+		pass
+
+	def visitLiteral(self, expression):
+		pass
+
+	def visitUnary(self, expression):
+		pass
+
+	def visitCall(self, expression):
+		pass
+
+	def visitVariable(self, expression):
+		pass
@@ -1,6 +1,72 @@
 """
 Classes for scanning and lexer error reporting.
 """
+import re
+
+# Name of every kind of token, the position of a name in this list is
+# the integer kind of the token
+TOKEN_NAMES = [
+    "LEFT_PAREN", "RIGHT_PAREN", "LEFT_BRACE", "RIGHT_BRACE",
+    "COMMA", "DOT", "MINUS", "PLUS", "SEMICOLON", "SLASH", "STAR",
+    "BANG", "BANG_EQUAL",
+    "EQUAL", "EQUAL_EQUAL",
+    "GREATER", "GREATER_EQUAL",
+    "LESS", "LESS_EQUAL",
+    "IDENTIFIER", "STRING", "NUMBER",
+    "AND", "CLASS", "ELSE", "FALSE", "TRUE", "FOR", "DEF", "IF", "NIL", "OR",
+    "RETURN", "SUPER", "SELF", "WHILE", "NUM", "STR", "BOOL", "PRINT",
+    "DO", "UNTIL", "BREAK", "CONTINUE", "ELSEIF", "PASS",
+    "EOF"
+]
+
+# Integer token kinds, in the same order as TOKEN_NAMES
+(LEFT_PAREN, RIGHT_PAREN, LEFT_BRACE, RIGHT_BRACE,
+ COMMA, DOT, MINUS, PLUS, SEMICOLON, SLASH, STAR,
+ BANG, BANG_EQUAL,
+ EQUAL, EQUAL_EQUAL,
+ GREATER, GREATER_EQUAL,
+ LESS, LESS_EQUAL,
+ IDENTIFIER, STRING, NUMBER,
+ AND, CLASS, ELSE, FALSE, TRUE, FOR, DEF, IF, NIL, OR,
+ RETURN, SUPER, SELF, WHILE, NUM, STR, BOOL, PRINT,
+ DO, UNTIL, BREAK, CONTINUE, ELSEIF, PASS,
+ EOF) = range(len(TOKEN_NAMES))
+
+# Master pattern used by the scanner. Leading spaces are skipped as part of
+# the match, each alternative is a named group and the name of the group
+# that matched tells the scanner what to do with it. Numbers and
+# identifiers only match plain ascii and refuse to match when followed by
+# something the character scanner might treat differently, so unusual
+# input falls back to Scanner._scanToken and is lexed exactly as before.
+_TOKEN_RE = re.compile(r"""
+    [ \t\r]*
+    (?:(?P<newline>\n)
+  | (?P<comment>\#[^\n]*)
+  | (?P<string>"[^"\n]*")
+  | (?P<number>[0-9]+(?:\.[0-9]+)?)(?![0-9]|\.[0-9]|[0-9.]?[^\x00-\x7f])
+  | (?P<identifier>[A-Za-z][A-Za-z0-9]*)(?![A-Za-z0-9]|[^\x00-\x7f])
+  | (?P<op>[!=<>]=|[(){},.\-+/*;!=<>]))
+""", re.VERBOSE)
+
+KEYWORDS = ['and', 'class', 'else', 'false', 'true', 'for',
+            'def', 'if', 'nil', 'or', 'return',
+            'super', 'self', 'while', 'num', 'str', 'bool',
+            'print', 'do', 'until', 'break', 'continue', 'elseif',
+            'pass']
+
+# Maps operator lexemes to their token type names, turned into the
+# shared TokenType instances once the class is defined
+_OPERATORS = {
+    '(': "LEFT_PAREN", ')': "RIGHT_PAREN",
+    '{': "LEFT_BRACE", '}': "RIGHT_BRACE",
+    ',': "COMMA", '.': "DOT", '-': "MINUS", '+': "PLUS",
+    '/': "SLASH", '*': "STAR", ';': "SEMICOLON",
+    '!': "BANG", '!=': "BANG_EQUAL",
+    '=': "EQUAL", '==': "EQUAL_EQUAL",
+    '<': "LESS", '<=': "LESS_EQUAL",
+    '>': "GREATER", '>=': "GREATER_EQUAL"
+}
+
 
 class Scanner(object):
     """ Class for scanner used by the lexer to form tokens and such. """
@@ -11,21 +77,60 @@ class Scanner(object):
         self.start = 0
         self.line = 1
         self.tokenList = []
-        self.keywords = ['and', 'class', 'else', 'false', 'true', 'for',
-                         'def', 'if', 'nil', 'or', 'return',
-                         'super', 'self', 'while', 'num', 'str', 'bool',
-                         'print', 'do', 'until', 'break', 'continue', 'elseif',
-                         'pass']
+        self.keywords = KEYWORDS
 
     def scanTokens(self):
         """ Scans tokens in the source code and returns a list of tokens."""
-        while not self._atEnd():
-            self.start = self.current
-            self._scanToken()
-
-        self.tokenList.append(Token("EOF", "", None, self.line))
+        self._scanSource()
+        self.tokenList.append(Token(TokenType("EOF"), "", None, self.line))
         return self.tokenList
 
+    def _scanSource(self):
+        """ Scans the rest of the source into the token list without adding
+        an EOF token. Most of the source is matched by the master pattern,
+        anything it does not cover is handed to the character by character
+        scanner."""
+        source = self.source
+        end = len(source)
+        tokens = self.tokenList
+        keywords = _KEYWORDS
+        operators = _OPERATOR_TYPES
+        identifier = TokenType("IDENTIFIER")
+        number = TokenType("NUMBER")
+        string = TokenType("STRING")
+        match = _TOKEN_RE.match
+        pos = self.current
+        line = self.line
+
+        while pos < end:
+            m = match(source, pos)
+            if m is None:
+                # Let the character scanner deal with this token
+                self.start = self.current = pos
+                self.line = line
+                self._scanToken()
+                pos = self.current
+                line = self.line
+                continue
+
+            kind = m.lastgroup
+            lexeme = m.group(kind)
+            pos = m.end()
+            if kind == "op":
+                tokens.append(Token(operators[lexeme], lexeme, None, line))
+            elif kind == "identifier":
+                tokens.append(Token(keywords.get(lexeme, identifier), lexeme,
+                                    None, line))
+            elif kind == "number":
+                tokens.append(Token(number, lexeme, float(lexeme), line))
+            elif kind == "newline":
+                line += 1
+            elif kind == "string":
+                tokens.append(Token(string, lexeme, lexeme[1:-1], line))
+
+        self.current = pos
+        self.line = line
+
     def _atEnd(self):
         """ Determines if we are at end of file."""
         return self.current >= len(self.source)
@@ -100,12 +205,13 @@ class Scanner(object):
             self._advance()
         val = self.source[self.start:self.current]
         if val in self.keywords:
-            type = val.upper()
+            type = TokenType(val.upper())
         else:
             type = TokenType("IDENTIFIER")
         self._addToken(type)
 
     def _scanToken(self):
+        """ Scans a single token one character at a time."""
         c = self._advance()
         if c == '(':
             type = TokenType("LEFT_PAREN")
@@ -144,7 +250,7 @@ class Scanner(object):
             if self._match('='):
                 type = TokenType("BANG_EQUAL")
             else:
-                type = TokenType("EQUAL")
+                type = TokenType("BANG")
             self._addToken(type)
         elif c == "=":
             if self._match('='):
@@ -183,47 +289,97 @@ class Scanner(object):
                 err.report()
 
 
+def streamTokens(stream, chunkSize=1 << 16):
+    """ Generator that scans a file like object a chunk at a time and yields
+    its tokens, ending with EOF. Tokens never span lines, so every chunk is
+    cut after its last newline and the rest is carried into the next one."""
+    line = 1
+    rest = ""
+    while True:
+        data = stream.read(chunkSize)
+        if not data:
+            break
+        data = rest + data
+        cut = data.rfind('\n') + 1
+        if cut == 0:
+            # No complete line yet
+            rest = data
+            continue
+        rest = data[cut:]
+        scan = Scanner(data[:cut])
+        scan.line = line
+        scan._scanSource()
+        line = scan.line
+        for token in scan.tokenList:
+            yield token
+
+    scan = Scanner(rest)
+    scan.line = line
+    for token in scan.scanTokens():
+        yield token
+
+
 class Error(object):
     """ Class for reporting lexer error."""
+    # Where errors are reported, the output when None
+    file = None
 
     def __init__(self, line, msg):
         self.line = line
         self.msg = msg
 
     def report(self):
-        print("Line %d, %s" % (self.line, self.msg))
+        print("Line %d, %s" % (self.line, self.msg), file=Error.file)
 
 
 class TokenType(object):
-    """ Describes the type of token."""
-
-    def __init__(self, type):
-        self.types = \
-        ["LEFT_PAREN", "RIGHT_PAREN", "LEFT_BRACE", "RIGHT_BRACE",
-          "COMMA", "DOT", "MINUS", "PLUS", "SEMICOLON", "SLASH", "STAR",
-          "BANG", "BANG_EQUAL",
-          "EQUAL", "EQUAL_EQUAL",
-          "GREATER", "GREATER_EQUAL",
-          "LESS", "LESS_EQUAL",
-          "IDENTIFIER", "STRING", "NUMBER", 'PRINT',
-          "AND", "CLASS", "ELSE", "FALSE", "DEF", "FOR", "IF", "NIL", "OR",
-          "RETURN", "SUPER", "THIS", "TRUE", "WHILE", "NUM", "STR", "BOOL",
-          "EOF"
-          ]
-        self.name = type
+    """ Describes the type of token. There is a single shared instance
+    for every kind of token, TokenType("NUMBER") always returns the same
+    object."""
+
+    __slots__ = ('name', 'kind')
+    _instances = {}
+
+    def __new__(cls, type):
+        try:
+            return cls._instances[type]
+        except KeyError:
+            # Unknown token type, kind -1 marks it as invalid
+            instance = object.__new__(cls)
+            instance.name = type
+            instance.kind = -1
+            return instance
 
     def is_valid(self):
-        return self.name in self.types
+        return self.kind >= 0
 
     def __str__(self):
         return self.name
 
+    def __repr__(self):
+        return "TokenType(%r)" % self.name
+
+    def __reduce__(self):
+        # Unpickle to the shared instance
+        return (TokenType, (self.name,))
+
+
+for _kind, _name in enumerate(TOKEN_NAMES):
+    _type = object.__new__(TokenType)
+    _type.name = _name
+    _type.kind = _kind
+    TokenType._instances[_name] = _type
+
 
 class Token(object):
-    """ Represents token in source code."""
+    """ Represents token in source code. type must be a TokenType, kind
+    is its integer kind and is what the parser compares against."""
+
+    __slots__ = ('type', 'kind', 'lexeme', 'literal', 'line')
 
     def __init__(self, type, lexeme, literal, line):
         self.type = type
+        self.kind = type.kind
         self.lexeme = lexeme
         self.literal = literal
         self.line = line
@@ -231,3 +387,9 @@ class Token(object):
     def __str__(self):
         return "Type = %s    lexeme = %s     literal = %s    line = %d" % \
         (self.type, self.lexeme, str(self.literal), self.line)
+
+
+# Shared token types for keywords and operators used by the scanner
+_KEYWORDS = dict((word, TokenType(word.upper())) for word in KEYWORDS)
+_OPERATOR_TYPES = dict((lexeme, TokenType(name))
+                       for lexeme, name in _OPERATORS.items())
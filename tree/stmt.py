@@ -1,11 +1,33 @@
 # This file was generated by the expresion_generator tool.
 # Holds all of the expression classes.
 
-class Stmt():
+# Kind of every node, indexes the dispatch table of the visitor
+IF = 0
+BLOCK = 1
+EXPRESSION = 2
+PRINT = 3
+VAR = 4
+WHILE = 5
+FOR = 6
+DO = 7
+UNTIL = 8
+BREAK = 9
+CONTINUE = 10
+PASS = 11
+
+class Stmt(object):
+	__slots__ = ()
+	_fields = ()
+	kind = -1
+
 	def accept(self, visitor):
 		pass
 
 class If(Stmt):
+	__slots__ = ('condition', 'then_branch', 'elseifs', 'else_branch')
+	_fields = ('condition', 'then_branch', 'elseifs', 'else_branch')
+	kind = IF
+
 	def __init__(self, condition, then_branch, elseifs, else_branch):
 		self.condition = condition
 		self.then_branch = then_branch
@@ -16,13 +38,23 @@ class If(Stmt):
 		return visitor.visitIf(self)
 
 class Block(Stmt):
+	__slots__ = ('statements', 'names')
+	_fields = ('statements',)
+	kind = BLOCK
+
 	def __init__(self, statements):
 		self.statements = statements
+		# Filled in before the statements run
+		self.names = None
 
 	def accept(self, visitor):
 		return visitor.visitBlock(self)
 
 class Expression(Stmt):
+	__slots__ = ('expression',)
+	_fields = ('expression',)
+	kind = EXPRESSION
+
 	def __init__(self, expression):
 		self.expression = expression
 
@@ -30,6 +62,10 @@ class Expression(Stmt):
 		return visitor.visitExpression(self)
 
 class Print(Stmt):
+	__slots__ = ('expression',)
+	_fields = ('expression',)
+	kind = PRINT
+
 	def __init__(self, expression):
 		self.expression = expression
 
@@ -37,51 +73,87 @@ class Print(Stmt):
 		return visitor.visitPrint(self)
 
 class Var(Stmt):
+	__slots__ = ('name', 'type', 'initializer', 'slot', 'vtype', 'safe')
+	_fields = ('name', 'type', 'initializer')
+	kind = VAR
+
 	def __init__(self, name, type, initializer):
 		self.name = name
 		self.type = type
 		self.initializer = initializer
+		# Filled in before the statements run
+		self.slot = None
+		self.vtype = None
+		self.safe = None
 
 	def accept(self, visitor):
 		return visitor.visitVar(self)
 
 class While(Stmt):
+	__slots__ = ('condition', 'body', 'jumps')
+	_fields = ('condition', 'body')
+	kind = WHILE
+
 	def __init__(self, condition, body):
 		self.condition = condition
 		self.body = body
+		# Filled in before the statements run
+		self.jumps = None
 
 	def accept(self, visitor):
 		return visitor.visitWhile(self)
 
 class For(Stmt):
+	__slots__ = ('initializer', 'condition', 'body', 'increment', 'else_branch', 'jumps')
+	_fields = ('initializer', 'condition', 'body', 'increment', 'else_branch')
+	kind = FOR
+
 	def __init__(self, initializer, condition, body, increment, else_branch):
 		self.initializer = initializer
 		self.condition = condition
 		self.body = body
 		self.increment = increment
 		self.else_branch = else_branch
+		# Filled in before the statements run
+		self.jumps = None
 
 	def accept(self, visitor):
 		return visitor.visitFor(self)
 
 class Do(Stmt):
+	__slots__ = ('condition', 'body', 'condition_type', 'jumps')
+	_fields = ('condition', 'body', 'condition_type')
+	kind = DO
+
 	def __init__(self, condition, body, condition_type):
 		self.condition = condition
 		self.body = body
 		self.condition_type = condition_type
+		# Filled in before the statements run
+		self.jumps = None
 
 	def accept(self, visitor):
 		return visitor.visitDo(self)
 
 class Until(Stmt):
+	__slots__ = ('condition', 'body', 'jumps')
+	_fields = ('condition', 'body')
+	kind = UNTIL
+
 	def __init__(self, condition, body):
 		self.condition = condition
 		self.body = body
+		# Filled in before the statements run
+		self.jumps = None
 
 	def accept(self, visitor):
 		return visitor.visitUntil(self)
 
 class Break(Stmt):
+	__slots__ = ('x',)
+	_fields = ('x',)
+	kind = BREAK
+
 	def __init__(self, x):
 		self.x = x
 
@@ -89,6 +161,10 @@ class Break(Stmt):
 		return visitor.visitBreak(self)
 
 class Continue(Stmt):
+	__slots__ = ('x',)
+	_fields = ('x',)
+	kind = CONTINUE
+
 	def __init__(self, x):
 		self.x = x
 
@@ -96,9 +172,60 @@ class Continue(Stmt):
 		return visitor.visitContinue(self)
 
 class Pass(Stmt):
+	__slots__ = ('x',)
+	_fields = ('x',)
+	kind = PASS
+
 	def __init__(self, x):
 		self.x = x
 
 	def accept(self, visitor):
 		return visitor.visitPass(self)
 
+class StmtVisitor(object):
+	""" Dispatches on the kind of a node through a table of bound visit
+	methods instead of calling accept on the node."""
+
+	_stmtVisits = ('visitIf', 'visitBlock', 'visitExpression', 'visitPrint', 'visitVar', 'visitWhile', 'visitFor', 'visitDo', 'visitUntil', 'visitBreak', 'visitContinue', 'visitPass')
+
+	def __init__(self):
+		self._stmtTable = tuple(getattr(self, name) for name in self._stmtVisits)
+
+	def dispatchStmt(self, stmt):
+		return self._stmtTable[stmt.kind](stmt)
+
+	def visitIf(self, stmt):
+		pass
+
+	def visitBlock(self, stmt):
+		pass
+
+	def visitExpression(self, stmt):
+		pass
+
+	def visitPrint(self, stmt):
+		pass
+
+	def visitVar(self, stmt):
+		pass
+
+	def visitWhile(self, stmt):
+		pass
+
+	def visitFor(self, stmt):
+		pass
+
+	def visitDo(self, stmt):
+		pass
+
+	def visitUntil(self, stmt):
+		pass
+
+	def visitBreak(self, stmt):
+		pass
+
+	def visitContinue(self, stmt):
+		pass
+
+	def visitPass(self, stmt):
+		pass